@@ -0,0 +1,38 @@
+"""Compares creating transactions one by one against the bulk INSERT ... RETURNING path.
+
+Usage:
+    python -m benchmarks.bulk_create [--url postgresql+asyncpg://...] [--count 2000]
+"""
+import asyncio
+import time
+
+from benchmarks.common import parse_args, report, seed_parties, setup_database
+from src.db.operations import create_transaction, create_transactions_bulk
+from src.db.schemas.transaction import TransactionCreate
+
+
+async def main():
+    args = parse_args(__doc__, count=2000)
+    engine, session_factory = await setup_database(args.url)
+    merchant_id, customer_id = await seed_parties(session_factory)
+    item = {"merchant_id": merchant_id, "customer_id": customer_id, "amount": "10.00", "currency": "USD",
+            "hash_credit_card": "card"}
+
+    started = time.perf_counter()
+    for _ in range(args.count):
+        async with session_factory() as db:
+            await create_transaction(db, TransactionCreate(**item))
+    report("single item (one request each)", args.count, started)
+
+    for batch_size in (10, 100, 1000):
+        started = time.perf_counter()
+        for _ in range(args.count // batch_size):
+            async with session_factory() as db:
+                await create_transactions_bulk(db, [item] * batch_size)
+        report(f"bulk, {batch_size} items per request", args.count // batch_size * batch_size, started)
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,80 @@
+import argparse
+import os
+import tempfile
+import time
+import uuid
+
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from src.db.connection import Base
+from src.db.models import (audit_log, customer, idempotency_key, ledger, merchant,  # noqa: F401
+                           merchant_balance_slot, token, transaction, user, webhook_event)
+from src.db.models.customer import Customer as CustomerModel
+from src.db.models.merchant import Merchant as MerchantModel
+
+
+def parse_args(description: str, **extra) -> argparse.Namespace:
+    """Parses the options shared by every benchmark.
+
+    Args:
+        description (str): The description of the benchmark.
+        **extra: Additional integer options and their defaults.
+
+    Returns:
+        argparse.Namespace: The parsed options.
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--url", default=None,
+                        help="Async database URL. Defaults to a temporary SQLite database.")
+    for name, default in extra.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=int, default=default)
+    return parser.parse_args()
+
+
+async def setup_database(url: str = None):
+    """Creates the engine and the tables used by a benchmark.
+
+    Args:
+        url (str, optional): The async database URL.
+
+    Returns:
+        Tuple[AsyncEngine, async_sessionmaker]: The engine and its session factory.
+    """
+    if url is None:
+        url = f"sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(), 'bench.db')}"
+    engine = create_async_engine(url)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    return engine, async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+
+async def seed_parties(session_factory):
+    """Creates an active customer and merchant for the benchmark transactions.
+
+    Args:
+        session_factory (async_sessionmaker): The session factory.
+
+    Returns:
+        Tuple[int, int]: The merchant ID and the customer ID.
+    """
+    suffix = uuid.uuid4().hex
+    async with session_factory() as db:
+        customer = CustomerModel(name="Bench customer", email=f"customer-{suffix}@example.com",
+                                 hash_credit_card=f"card-{suffix}")
+        merchant = MerchantModel(name="Bench merchant", email=f"merchant-{suffix}@example.com",
+                                 authentication_key=f"key-{suffix}", amount_account=0)
+        db.add_all([customer, merchant])
+        await db.commit()
+        return merchant.id, customer.id
+
+
+def report(label: str, operations: int, started: float):
+    """Prints the throughput of a benchmark step.
+
+    Args:
+        label (str): The name of the step.
+        operations (int): The number of operations performed.
+        started (float): The perf_counter value when the step started.
+    """
+    elapsed = time.perf_counter() - started
+    print(f"{label:<40} {operations:>8} ops {elapsed:>8.3f} s {operations / elapsed:>12.1f} ops/s")
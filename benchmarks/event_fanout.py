@@ -0,0 +1,47 @@
+"""Measures the in-process fan-out of transaction events to open event streams.
+
+Every subscriber runs the stream generator of the endpoint, so the numbers
+include the SSE encoding and the wake-up of each stream.
+
+Usage:
+    python -m benchmarks.event_fanout [--count 20000] [--merchants 100] [--subscribers 1000]
+"""
+import asyncio
+import json
+import time
+
+from benchmarks.common import parse_args, report
+from src.utils.event_stream import TransactionEventBroker
+
+
+async def consume(broker, subscription, received):
+    async for message in broker.stream(subscription, heartbeat=60):
+        if message.startswith("event:"):
+            received[0] += 1
+
+
+async def main():
+    args = parse_args(__doc__, count=20000, merchants=100, subscribers=1000)
+    broker = TransactionEventBroker(buffer_size=args.count)
+    received = [0]
+    consumers = [asyncio.create_task(consume(broker, broker.subscribe(n % args.merchants), received))
+                 for n in range(args.subscribers)]
+    payload = json.dumps({"token": "00000000-0000-0000-0000-000000000000", "state": "success", "amount": "10.00"})
+    expected = args.count * args.subscribers // args.merchants
+
+    started = time.perf_counter()
+    for n in range(0, args.count, 100):
+        broker.publish([{"merchant_id": m % args.merchants, "event_type": "transaction.captured", "payload": payload}
+                        for m in range(n, min(n + 100, args.count))])
+        await asyncio.sleep(0)
+    while received[0] < expected:
+        await asyncio.sleep(0.001)
+    report("events published", args.count, started)
+    report("messages delivered to streams", received[0], started)
+
+    await broker.stop()
+    await asyncio.gather(*consumers)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,75 @@
+"""Compares the peak memory of the streaming export against loading every transaction at once.
+
+Usage:
+    python -m benchmarks.export_memory [--url postgresql+asyncpg://...] [--rows 100000]
+"""
+import asyncio
+import json
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, select
+
+from benchmarks.common import parse_args, seed_parties, setup_database
+from src.db.connection import AsyncSessionLocal
+from src.db.models.transaction import Transaction as TransactionModel
+from src.db.operations import EXPORT_COLUMNS, stream_transactions_by_merchant_id
+from src.db.schemas.transaction import Transaction
+from src.utils.export import ndjson_chunks
+
+
+async def seed_transactions(session_factory, merchant_id, customer_id, rows):
+    start = datetime(2024, 1, 1)
+    async with session_factory() as db:
+        for offset in range(0, rows, 5000):
+            await db.execute(insert(TransactionModel), [
+                {"merchant_id": merchant_id, "customer_id": customer_id, "amount": 10, "currency": "USD",
+                 "hash_credit_card": "card", "token": str(uuid.uuid4()), "state": "success",
+                 "created_at": start + timedelta(seconds=index)}
+                for index in range(offset, min(offset + 5000, rows))
+            ])
+        await db.commit()
+
+
+async def load_all(merchant_id):
+    async with AsyncSessionLocal() as db:
+        transactions = (await db.scalars(
+            select(TransactionModel).where(TransactionModel.merchant_id == merchant_id)
+        )).all()
+        return json.dumps([Transaction.model_validate(transaction, from_attributes=True).model_dump(mode="json") for transaction in transactions])
+
+
+async def stream(merchant_id):
+    size = 0
+    columns = [column.key for column in EXPORT_COLUMNS]
+    async for chunk in ndjson_chunks(columns, stream_transactions_by_merchant_id(merchant_id)):
+        size += len(chunk)
+    return size
+
+
+async def measure(label, rows, coroutine):
+    tracemalloc.start()
+    started = time.perf_counter()
+    await coroutine
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<30} {rows:>8} rows {elapsed:>8.2f} s {peak / 2 ** 20:>10.1f} MiB peak")
+
+
+async def main():
+    args = parse_args(__doc__, rows=100000)
+    engine, session_factory = await setup_database(args.url)
+    AsyncSessionLocal.configure(bind=engine)
+    for rows in (1000, 10000, args.rows):
+        merchant_id, customer_id = await seed_parties(session_factory)
+        await seed_transactions(session_factory, merchant_id, customer_id, rows)
+        await measure("load everything", rows, load_all(merchant_id))
+        await measure("streaming export", rows, stream(merchant_id))
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,69 @@
+"""Local stand-in for the payment processor batch API, for tests and benchmarks.
+
+Payments are approved unless their card starts with "declined". A payment sent
+again with the same reference and type gets the first answer back, like the real
+processor deduplicates retries.
+
+Usage:
+    python -m benchmarks.fake_processor [--port 9000] [--latency-ms 20]
+"""
+import argparse
+import asyncio
+import uuid
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+
+class FakeProcessor:
+    """Serves POST /payments/batch with a fixed latency per call.
+
+    Args:
+        latency (float): Seconds each call takes, whatever its size.
+        payment_latency (float): Additional seconds per payment of the call.
+    """
+
+    def __init__(self, latency: float = 0.0, payment_latency: float = 0.0):
+        self.latency = latency
+        self.payment_latency = payment_latency
+        self.fail_next = 0
+        self.calls = 0
+        self.batch_sizes = []
+        self.results = {}
+        self.app = FastAPI()
+        self.app.post("/payments/batch")(self.batch)
+
+    async def batch(self, request: Request):
+        self.calls += 1
+        if self.fail_next:
+            self.fail_next -= 1
+            return JSONResponse({"detail": "Processor unavailable"}, status_code=503)
+        payments = (await request.json())["payments"]
+        self.batch_sizes.append(len(payments))
+        await asyncio.sleep(self.latency + self.payment_latency * len(payments))
+        return {"results": [self.answer(payment) for payment in payments]}
+
+    def answer(self, payment: dict) -> dict:
+        key = (payment["reference"], payment["type"])
+        if key not in self.results:
+            declined = payment["card"].startswith("declined")
+            self.results[key] = {
+                "reference": payment["reference"],
+                "status": "declined" if declined else "approved",
+                "processor_id": uuid.uuid4().hex,
+                "reason": "Card declined by the issuer." if declined else None,
+            }
+        return self.results[key]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency-ms", type=float, default=20.0)
+    args = parser.parse_args()
+    uvicorn.run(FakeProcessor(latency=args.latency_ms / 1000).app, host="127.0.0.1", port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""Measures the primary key and token lookups, built per call and as cached lambda statements.
+
+The first part times the Python side only: building each statement and computing
+its cache key, which the lambda statements skip. The second part times the whole
+lookups, including the database round trip.
+
+Usage:
+    python -m benchmarks.hot_lookups [--url postgresql+asyncpg://...] [--count 5000]
+"""
+import asyncio
+import time
+import uuid
+
+from sqlalchemy import insert, lambda_stmt, select
+
+from benchmarks.common import parse_args, report, seed_parties, setup_database
+from src.db.models.customer import Customer as CustomerModel
+from src.db.models.merchant import Merchant as MerchantModel
+from src.db.models.transaction import Transaction as TransactionModel
+from src.db.operations import get_customer, get_merchant_by_id, get_transaction_by_token
+
+
+# The lookups as they were before, building a new select on every call.
+async def select_customer(db, customer_id):
+    return await db.scalar(select(CustomerModel).where(CustomerModel.id == customer_id))
+
+
+async def select_merchant(db, merchant_id):
+    return await db.scalar(select(MerchantModel).where(MerchantModel.id == merchant_id))
+
+
+async def select_transaction(db, token):
+    return await db.scalar(select(TransactionModel).where(TransactionModel.token == token))
+
+
+STATEMENTS = [
+    ("customer by id", lambda key: select(CustomerModel).where(CustomerModel.id == key),
+     lambda key: lambda_stmt(lambda: select(CustomerModel).where(CustomerModel.id == key))),
+    ("merchant by id", lambda key: select(MerchantModel).where(MerchantModel.id == key),
+     lambda key: lambda_stmt(lambda: select(MerchantModel).where(MerchantModel.id == key))),
+    ("transaction by token", lambda key: select(TransactionModel).where(TransactionModel.token == key),
+     lambda key: lambda_stmt(lambda: select(TransactionModel).where(TransactionModel.token == key))),
+]
+
+
+def prepare_statements(count: int):
+    for name, before, after in STATEMENTS:
+        for label, build in (("select", before), ("lambda", after)):
+            started = time.perf_counter()
+            for key in range(count):
+                build(key)._generate_cache_key()
+            report(f"{name}, {label} statement", count, started)
+
+
+async def seed_transaction(session_factory, merchant_id, customer_id):
+    token = str(uuid.uuid4())
+    async with session_factory() as db:
+        card = await db.scalar(select(CustomerModel.hash_credit_card).where(CustomerModel.id == customer_id))
+        await db.execute(insert(TransactionModel).values(
+            merchant_id=merchant_id, customer_id=customer_id, amount=1, currency="USD",
+            hash_credit_card=card, token=token, state="pending"))
+        await db.commit()
+    return token
+
+
+async def main():
+    args = parse_args(__doc__, count=5000)
+    prepare_statements(args.count * 10)
+
+    engine, session_factory = await setup_database(args.url)
+    merchant_id, customer_id = await seed_parties(session_factory)
+    token = await seed_transaction(session_factory, merchant_id, customer_id)
+
+    lookups = [
+        ("customer by id", select_customer, get_customer, customer_id),
+        ("merchant by id", select_merchant, get_merchant_by_id, merchant_id),
+        ("transaction by token", select_transaction, get_transaction_by_token, token),
+    ]
+    async with session_factory() as db:
+        for name, before, after, key in lookups:
+            for label, lookup in (("select", before), ("lambda", after)):
+                await lookup(db, key)
+                started = time.perf_counter()
+                for _ in range(args.count):
+                    await lookup(db, key)
+                report(f"{name}, {label}", args.count, started)
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,67 @@
+"""Measures concurrent captures for a single merchant, with and without sharded balance slots.
+
+The difference only shows on a database with row-level locking; SQLite serializes
+every writer, so run it against PostgreSQL for meaningful numbers.
+
+Usage:
+    python -m benchmarks.hot_merchant [--url postgresql+asyncpg://...] [--count 2000] [--concurrency 10] [--shards 16]
+"""
+import asyncio
+import time
+import uuid
+
+from sqlalchemy import insert, select, update
+
+from benchmarks.common import parse_args, report, seed_parties, setup_database
+from src.db.balance_slots import create_slots
+from src.db.models.customer import Customer as CustomerModel
+from src.db.models.merchant import Merchant as MerchantModel
+from src.db.models.transaction import Transaction as TransactionModel
+from src.db.operations import merchant_cache, process_transaction
+
+
+async def pending_tokens(session_factory, merchant_id, customer_id, count):
+    tokens = [str(uuid.uuid4()) for _ in range(count)]
+    async with session_factory() as db:
+        card = await db.scalar(select(CustomerModel.hash_credit_card).where(CustomerModel.id == customer_id))
+        await db.execute(insert(TransactionModel), [
+            {"merchant_id": merchant_id, "customer_id": customer_id, "amount": 1, "currency": "USD",
+             "hash_credit_card": card, "token": token, "state": "pending"}
+            for token in tokens
+        ])
+        await db.commit()
+    return tokens
+
+
+async def capture_all(session_factory, tokens, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def capture(token):
+        async with semaphore, session_factory() as db:
+            await process_transaction(db, token, "capture")
+
+    await asyncio.gather(*(capture(token) for token in tokens))
+
+
+async def main():
+    args = parse_args(__doc__, count=2000, concurrency=10, shards=16)
+    engine, session_factory = await setup_database(args.url)
+    merchant_id, customer_id = await seed_parties(session_factory)
+
+    for shards in (0, args.shards):
+        async with session_factory() as db:
+            await db.execute(update(MerchantModel).where(MerchantModel.id == merchant_id)
+                             .values(balance_shards=shards))
+            await create_slots(db, merchant_id, shards)
+            await db.commit()
+        merchant_cache.clear()
+        tokens = await pending_tokens(session_factory, merchant_id, customer_id, args.count)
+        started = time.perf_counter()
+        await capture_all(session_factory, tokens, args.concurrency)
+        report(f"{shards} balance slots, {args.concurrency} concurrent", args.count, started)
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+"""Measures /health latency while /api/v1/token is flooded with concurrent logins.
+
+Runs the flood twice: with bcrypt inline on the event loop (the old behaviour) and
+with the password worker pool.
+
+Usage:
+    python -m benchmarks.login_flood [--url ...] [--logins 200] [--concurrency 50]
+"""
+import asyncio
+import statistics
+import time
+
+import httpx
+
+from benchmarks.common import parse_args, setup_database
+from main import app
+from src.db.connection import AsyncSessionLocal
+from src.routes import auth
+from src.utils.hashing import PASSWORD_HASH_WORKERS, PasswordHasher
+
+
+async def flood(client: httpx.AsyncClient, logins: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    statuses = []
+
+    async def login():
+        async with semaphore:
+            response = await client.post("/api/v1/token", data={"username": "bench", "password": "secret"})
+            statuses.append(response.status_code)
+
+    await asyncio.gather(*(login() for _ in range(logins)))
+    return statuses
+
+
+async def probe(client: httpx.AsyncClient, done: asyncio.Event):
+    latencies = []
+    while not done.is_set():
+        started = time.perf_counter()
+        await client.get("/health")
+        latencies.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(0.005)
+    return latencies
+
+
+async def run(label: str, hasher: PasswordHasher, logins: int, concurrency: int):
+    auth.password_hasher = hasher
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        done = asyncio.Event()
+        probe_task = asyncio.create_task(probe(client, done))
+        started = time.perf_counter()
+        statuses = await flood(client, logins, concurrency)
+        elapsed = time.perf_counter() - started
+        done.set()
+        latencies = sorted(await probe_task)
+    hasher.shutdown()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{label:<28} logins/s {logins / elapsed:>7.1f}  rejected {statuses.count(503):>4}  "
+          f"/health p50 {statistics.median(latencies):>8.1f} ms  p99 {p99:>8.1f} ms  max {latencies[-1]:>8.1f} ms")
+
+
+async def main():
+    args = parse_args(__doc__, logins=200, concurrency=50)
+    engine, _ = await setup_database(args.url)
+    AsyncSessionLocal.configure(bind=engine)
+    async with AsyncSessionLocal() as db:
+        db.add(auth.UserModel(username="bench", password=auth.bcrypt_context.hash("secret")))
+        await db.commit()
+
+    await run("inline on the event loop", PasswordHasher(auth.bcrypt_context, workers=0),
+              args.logins, args.concurrency)
+    await run(f"worker pool ({PASSWORD_HASH_WORKERS} threads)", PasswordHasher(auth.bcrypt_context),
+              args.logins, args.concurrency)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,55 @@
+"""Measures payments per second through the processor client at different batch sizes.
+
+A fake processor answering every call in --latency-ms milliseconds runs on a local
+port, so the client goes through real keep-alive HTTP connections.
+
+Usage:
+    python -m benchmarks.processor_load [--count 2000] [--concurrency 200] [--latency-ms 20] [--port 9100]
+"""
+import asyncio
+import time
+import uuid
+
+import uvicorn
+
+from benchmarks.common import parse_args, report
+from benchmarks.fake_processor import FakeProcessor
+from src.utils.processor import ProcessorClient
+
+BATCH_SIZES = (1, 10, 50, 100)
+
+
+async def run(client: ProcessorClient, count: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def pay():
+        async with semaphore:
+            await client.submit({"reference": uuid.uuid4().hex, "type": "capture", "amount": "1.00",
+                                 "currency": "USD", "card": "card", "merchant_id": 1})
+
+    await asyncio.gather(*(pay() for _ in range(count)))
+
+
+async def main():
+    args = parse_args(__doc__, count=2000, concurrency=200, latency_ms=20, port=9100)
+    fake = FakeProcessor(latency=args.latency_ms / 1000)
+    server = uvicorn.Server(uvicorn.Config(fake.app, host="127.0.0.1", port=args.port, log_level="warning"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    for batch_size in BATCH_SIZES:
+        client = ProcessorClient(f"http://127.0.0.1:{args.port}", batch_size=batch_size, timeout=60)
+        await client.start()
+        calls = fake.calls
+        started = time.perf_counter()
+        await run(client, args.count, args.concurrency)
+        report(f"batch size {batch_size} ({fake.calls - calls} calls)", args.count, started)
+        await client.stop()
+
+    server.should_exit = True
+    await serving
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,110 @@
+"""Shows the query plans of the hot lookups without and with the hot column indexes.
+
+The indexes of migration 0002 are dropped, the plans are
+printed, then the indexes are created again and the plans printed a second time.
+Run it against a scratch database: it creates, seeds and re-indexes the tables.
+
+Usage:
+    python -m benchmarks.query_plans [--url postgresql+asyncpg://...] [--rows 200000]
+"""
+import asyncio
+import random
+import uuid
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert, select, text
+
+from benchmarks.common import parse_args, seed_parties, setup_database
+from src.db.models.audit_log import AuditLogModel
+from src.db.models.customer import Customer as CustomerModel
+from src.db.models.merchant import Merchant as MerchantModel
+from src.db.models.token import Token as TokenModel
+from src.db.models.transaction import Transaction as TransactionModel
+
+INDEXED_TABLES = [TransactionModel, CustomerModel, MerchantModel, AuditLogModel, TokenModel]
+# The indexes added by migration 0002; the baseline ones, such as ix_tokens_id, stay in both runs.
+HOT_INDEXES = {
+    "ix_transactions_merchant_id_created_at", "ix_transactions_customer_id_created_at",
+    "ix_transactions_state_pending", "ix_customers_created_at", "ix_merchants_created_at",
+    "ix_audit_log_timestamp", "ix_tokens_access_token_user_id",
+}
+
+
+def hot_queries(merchant_id: int, customer_id: int, now: datetime):
+    return {
+        "merchant transactions page": select(TransactionModel)
+        .where(TransactionModel.merchant_id == merchant_id)
+        .order_by(TransactionModel.created_at.desc(), TransactionModel.id.desc()).limit(51),
+        "customer transactions page": select(TransactionModel)
+        .where(TransactionModel.customer_id == customer_id)
+        .order_by(TransactionModel.created_at.desc(), TransactionModel.id.desc()).limit(51),
+        "pending transactions": select(TransactionModel.id).where(TransactionModel.state == 'pending').limit(100),
+        "audit log last hour": select(AuditLogModel.id)
+        .where(AuditLogModel.timestamp >= now - timedelta(hours=1)),
+        "token to user": select(TokenModel.user_id).where(TokenModel.access_token == "token-42"),
+    }
+
+
+async def seed(session_factory, rows: int, merchant_id: int, customer_id: int, now: datetime):
+    async with session_factory() as db:
+        merchants = [merchant_id] + [(await seed_parties(session_factory))[0] for _ in range(9)]
+        for start in range(0, rows, 5000):
+            count = min(5000, rows - start)
+            await db.execute(insert(TransactionModel), [
+                {"merchant_id": random.choice(merchants), "customer_id": customer_id, "amount": 10,
+                 "currency": "USD", "hash_credit_card": "card", "token": str(uuid.uuid4()),
+                 "state": "pending" if random.random() < 0.02 else "success",
+                 "created_at": now - timedelta(seconds=rows - start - offset)}
+                for offset in range(count)
+            ])
+            await db.execute(insert(AuditLogModel), [
+                {"activity_type": "GET", "path": "/health",
+                 "timestamp": now - timedelta(seconds=rows - start - offset)}
+                for offset in range(count)
+            ])
+        await db.execute(insert(TokenModel), [
+            {"access_token": f"token-{index}", "token_type": "bearer"} for index in range(min(rows, 10000))
+        ])
+        await db.commit()
+
+
+async def explain(engine, queries):
+    async with engine.connect() as conn:
+        postgres = engine.dialect.name == "postgresql"
+        if postgres:
+            await conn.execute(text("ANALYZE"))
+        for label, query in queries.items():
+            compiled = query.compile(engine, compile_kwargs={"literal_binds": True})
+            prefix = "EXPLAIN (ANALYZE, BUFFERS, COSTS OFF)" if postgres else "EXPLAIN QUERY PLAN"
+            plan = (await conn.execute(text(f"{prefix} {compiled}"))).all()
+            print(f"--- {label}")
+            for row in plan:
+                print(f"    {row[-1]}")
+
+
+async def main():
+    args = parse_args(__doc__, rows=200000)
+    engine, session_factory = await setup_database(args.url)
+    merchant_id, customer_id = await seed_parties(session_factory)
+    now = datetime.utcnow()
+    await seed(session_factory, args.rows, merchant_id, customer_id, now)
+    indexes = [index for model in INDEXED_TABLES for index in model.__table__.indexes if index.name in HOT_INDEXES]
+    queries = hot_queries(merchant_id, customer_id, now)
+
+    async with engine.begin() as conn:
+        for index in indexes:
+            await conn.run_sync(index.drop, checkfirst=True)
+    print("=== before (baseline indexes, primary keys and unique constraints only)")
+    await explain(engine, queries)
+
+    async with engine.begin() as conn:
+        for index in indexes:
+            await conn.run_sync(index.create, checkfirst=True)
+    print("=== after migration 0002")
+    await explain(engine, queries)
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
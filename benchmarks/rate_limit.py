@@ -0,0 +1,29 @@
+"""Measures the cost of a rate limit decision with each bucket store.
+
+Usage:
+    python -m benchmarks.rate_limit [--count 200000] [--clients 10000]
+"""
+import os
+import tempfile
+import time
+
+from benchmarks.common import parse_args, report
+from src.utils.rate_limit import MemoryRateLimitStore, SharedMemoryRateLimitStore
+
+
+def main():
+    args = parse_args(__doc__, count=200000, clients=10000)
+    keys = [f"* /|user:{n}" for n in range(args.clients)]
+    stores = [
+        ("memory", MemoryRateLimitStore()),
+        ("shared", SharedMemoryRateLimitStore(os.path.join(tempfile.mkdtemp(), "buckets"))),
+    ]
+    for name, store in stores:
+        started = time.perf_counter()
+        for n in range(args.count):
+            store.take(keys[n % args.clients], 100.0, 200)
+        report(f"{name} store", args.count, started)
+
+
+if __name__ == "__main__":
+    main()
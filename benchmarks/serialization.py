@@ -0,0 +1,101 @@
+"""Measures the response serialization of the listing endpoints, before and after the row serializers.
+
+"validated" loads ORM objects and serializes them the way FastAPI does with a
+response_model: validation into the pydantic schema, a JSON-mode dump and the
+stdlib json encoder. "rows" selects the schema columns and renders them with
+RowSerializer and orjson. Each endpoint is measured on serialization alone, then
+with the query of the page.
+
+Usage:
+    python -m benchmarks.serialization [--url postgresql+asyncpg://...] [--rows 500] [--pages 200]
+"""
+import asyncio
+import json
+import time
+import uuid
+
+from pydantic import TypeAdapter
+from sqlalchemy import insert, select
+
+from benchmarks.common import parse_args, report, seed_parties, setup_database
+from src.db.models.customer import Customer as CustomerModel
+from src.db.models.merchant import Merchant as MerchantModel
+from src.db.models.transaction import Transaction as TransactionModel
+from src.db.operations import CUSTOMER_ROWS, MERCHANT_ROWS, TRANSACTION_ROWS
+from src.db.schemas.customer import Customer
+from src.db.schemas.merchant import Merchant
+from src.db.schemas.page import Page
+from src.db.schemas.transaction import Transaction
+
+ENDPOINTS = [
+    ("GET /customer/", CustomerModel, Customer, CUSTOMER_ROWS),
+    ("GET /merchant/", MerchantModel, Merchant, MERCHANT_ROWS),
+    ("GET /merchant/{id}/transactions", TransactionModel, Transaction, TRANSACTION_ROWS),
+]
+
+
+async def seed(session_factory, rows: int):
+    merchant_id, customer_id = await seed_parties(session_factory)
+    async with session_factory() as db:
+        card = await db.scalar(select(CustomerModel.hash_credit_card).where(CustomerModel.id == customer_id))
+        await db.execute(insert(CustomerModel), [
+            {"name": f"Customer {n}", "email": f"customer-{uuid.uuid4().hex}@example.com",
+             "hash_credit_card": f"card-{uuid.uuid4().hex}"}
+            for n in range(rows)
+        ])
+        await db.execute(insert(MerchantModel), [
+            {"name": f"Merchant {n}", "email": f"merchant-{uuid.uuid4().hex}@example.com", "amount_account": n,
+             "authentication_key": uuid.uuid4().hex}
+            for n in range(rows)
+        ])
+        await db.execute(insert(TransactionModel), [
+            {"merchant_id": merchant_id, "customer_id": customer_id, "amount": n + 0.5, "currency": "USD",
+             "hash_credit_card": card, "token": str(uuid.uuid4()), "state": "pending"}
+            for n in range(rows)
+        ])
+        await db.commit()
+
+
+def validated(adapter: TypeAdapter, objects) -> bytes:
+    page = adapter.validate_python({"items": objects, "next_cursor": None}, from_attributes=True)
+    content = adapter.dump_python(page, mode="json")
+    return json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()
+
+
+async def main():
+    args = parse_args(__doc__, rows=500, pages=200)
+    engine, session_factory = await setup_database(args.url)
+    await seed(session_factory, args.rows)
+
+    async with session_factory() as db:
+        for name, model, schema, serializer in ENDPOINTS:
+            adapter = TypeAdapter(Page[schema])
+            objects_statement = select(model).limit(args.rows)
+            rows_statement = select(*serializer.columns(model)).limit(args.rows)
+            objects = (await db.scalars(objects_statement)).all()
+            rows = (await db.execute(rows_statement)).all()
+
+            started = time.perf_counter()
+            for _ in range(args.pages):
+                validated(adapter, objects)
+            report(f"{name} validated", args.pages, started)
+            started = time.perf_counter()
+            for _ in range(args.pages):
+                serializer.page(rows, None).body
+            report(f"{name} rows", args.pages, started)
+
+            started = time.perf_counter()
+            for _ in range(args.pages // 10):
+                db.expunge_all()
+                validated(adapter, (await db.scalars(objects_statement)).all())
+            report(f"{name} validated with query", args.pages // 10, started)
+            started = time.perf_counter()
+            for _ in range(args.pages // 10):
+                serializer.page((await db.execute(rows_statement)).all(), None).body
+            report(f"{name} rows with query", args.pages // 10, started)
+
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+from main import app
+from src.db.connection import AsyncSessionLocal, Base, async_engine
+from src.db.operations import customer_cache, merchant_cache
+from src.utils.query_stats import instrument
+from src.utils.rate_limit import rate_limiter
+from src.db.models import (audit_log, customer, idempotency_key, ledger, merchant,  # noqa: F401
+                           merchant_balance_slot, token, transaction, user, webhook_event)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    """SQLite engine bound to the application session factory for the duration of a test."""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}", poolclass=NullPool)
+    instrument(engine.sync_engine)
+
+    async def create_tables():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    asyncio.run(create_tables())
+    AsyncSessionLocal.configure(bind=engine)
+    yield engine
+    AsyncSessionLocal.configure(bind=async_engine)
+    customer_cache.clear()
+    merchant_cache.clear()
+    rate_limiter.reset()
+
+
+@pytest.fixture
+def client(engine):
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def auth_headers(client):
+    client.post("/api/v1/auth", json={"username": "tester", "password": "secret"})
+    response = client.post("/api/v1/token", data={"username": "tester", "password": "secret"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+@pytest.fixture
+def customer_id(client, auth_headers):
+    response = client.post("/api/v1/customer/", headers=auth_headers,
+                           json={"name": "Customer", "email": "customer@example.com", "hash_credit_card": "card"})
+    return response.json()["id"]
+
+
+@pytest.fixture
+def merchant_id(client, auth_headers):
+    response = client.post("/api/v1/merchant/", headers=auth_headers,
+                           json={"name": "Merchant", "email": "merchant@example.com", "amount_account": 0,
+                                 "authentication_key": "key"})
+    return response.json()["id"]
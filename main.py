@@ -1,3 +1,5 @@
+from contextlib import asynccontextmanager
+
 import uvicorn
 from fastapi import FastAPI
 from src.routes.customer import router as customer_router
@@ -5,7 +7,47 @@ from src.routes.merchant import router as merchant_router
 from src.routes.transaction import router as transaction_router
 from src.routes.auth import router as auth_router
 from src.routes.root import router as root_router
-from src.utils.audit import audit_log_middleware
+from src.db.balance_slots import balance_compactor
+from src.db.connection import db_session_middleware, replica_router
+from src.db.ledger import ledger_checkpointer
+from src.routes.auth import password_hasher
+from src.utils.audit import audit_log_middleware, audit_writer
+from src.utils.event_stream import transaction_events
+from src.utils.idempotency import idempotency_middleware, idempotency_store
+from src.utils.load_shedding import load_shedding_middleware, loop_monitor
+from src.utils.metrics import metrics, metrics_middleware
+from src.utils.processor import processor_client
+from src.utils.query_stats import query_stats_middleware
+from src.utils.rate_limit import rate_limit_middleware
+from src.utils.webhooks import webhook_dispatcher
+from src.utils.responses import ORJSONResponse
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await replica_router.start()
+    await audit_writer.start()
+    await idempotency_store.start()
+    await ledger_checkpointer.start()
+    await balance_compactor.start()
+    await metrics.start()
+    await loop_monitor.start()
+    await processor_client.start()
+    await webhook_dispatcher.start()
+    await transaction_events.start()
+    yield
+    await transaction_events.stop()
+    await webhook_dispatcher.stop()
+    await processor_client.stop()
+    await loop_monitor.stop()
+    await metrics.stop()
+    await balance_compactor.stop()
+    await ledger_checkpointer.stop()
+    await idempotency_store.stop()
+    await audit_writer.stop()
+    await replica_router.stop()
+    password_hasher.shutdown()
+
 
 app = FastAPI(
     title="Payment Gateway API",
@@ -13,11 +55,19 @@ app = FastAPI(
     version="0.1.0",
     openapi_url="/api/v1/openapi.json",
     docs_url="/api/v1/docs",
-    redoc_url="/api/v1/redoc"
+    redoc_url="/api/v1/redoc",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
 
+app.middleware("http")(db_session_middleware)
+app.middleware("http")(idempotency_middleware)
 app.middleware("http")(audit_log_middleware)
+app.middleware("http")(query_stats_middleware)
+app.middleware("http")(rate_limit_middleware)
+app.middleware("http")(load_shedding_middleware)
+app.middleware("http")(metrics_middleware)
 
 app.include_router(auth_router)
 app.include_router(root_router)
@@ -0,0 +1,95 @@
+"""Baseline schema, matching the tables created by scripts/*.sql
+
+Databases created with scripts/execute_sql.sh should be marked with
+`alembic stamp 0001` instead of running this revision.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 09:12:41.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0001'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def timestamps():
+    return [
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.current_timestamp()),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.func.current_timestamp()),
+    ]
+
+
+def upgrade() -> None:
+    op.create_table(
+        'users',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('username', sa.String(255), nullable=False, unique=True),
+        sa.Column('password', sa.String(255), nullable=False, unique=True),
+        *timestamps(),
+    )
+    op.create_table(
+        'tokens',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('access_token', sa.String(255), nullable=False, unique=True),
+        sa.Column('token_type', sa.String(255), nullable=False),
+        *timestamps(),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id')),
+    )
+    op.create_table(
+        'customers',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('name', sa.String(255), nullable=False),
+        sa.Column('email', sa.String(255), nullable=False, unique=True),
+        sa.Column('address', sa.String(255)),
+        sa.Column('hash_credit_card', sa.String(255), nullable=False),
+        sa.Column('is_active', sa.Boolean(), server_default=sa.true()),
+        *timestamps(),
+    )
+    op.create_table(
+        'merchants',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('name', sa.String(255), nullable=False),
+        sa.Column('email', sa.String(255), nullable=False, unique=True),
+        sa.Column('is_active', sa.Boolean(), server_default=sa.true()),
+        sa.Column('amount_account', sa.Integer(), nullable=False, server_default='0'),
+        *timestamps(),
+        sa.Column('authentication_key', sa.String(), nullable=False),
+        sa.UniqueConstraint('authentication_key', name='merchants_unique'),
+    )
+    op.create_table(
+        'transactions',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('merchant_id', sa.Integer(), sa.ForeignKey('merchants.id'), nullable=False),
+        sa.Column('customer_id', sa.Integer(), sa.ForeignKey('customers.id'), nullable=False),
+        sa.Column('amount', sa.Numeric(10, 2), nullable=False),
+        sa.Column('currency', sa.CHAR(3), nullable=False),
+        sa.Column('state', sa.String(255), nullable=False, server_default='pending'),
+        sa.Column('hash_credit_card', sa.String(255), nullable=False),
+        *timestamps(),
+        sa.Column('token', sa.String(), nullable=False),
+        sa.UniqueConstraint('token', name='transactions_unique'),
+    )
+    op.create_table(
+        'audit_log',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('user_id', sa.Integer()),
+        sa.Column('activity_type', sa.String(), nullable=False),
+        sa.Column('bearer_token', sa.String()),
+        sa.Column('ip_address', sa.String()),
+        sa.Column('path', sa.String(), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    for table in ('audit_log', 'transactions', 'merchants', 'customers', 'tokens', 'users'):
+        op.drop_table(table)
@@ -0,0 +1,48 @@
+"""Indexes for the per-merchant, per-customer, state and audit time queries
+
+The indexes are built with CREATE INDEX CONCURRENTLY so the migration can run
+against a live database without blocking writes.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 10:03:57.532917
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+INDEXES = [
+    # Keyset pages of a merchant's or customer's transactions: equality on the owner, then (created_at, id).
+    ('ix_transactions_merchant_id_created_at', 'transactions', ['merchant_id', 'created_at', 'id'], {}),
+    ('ix_transactions_customer_id_created_at', 'transactions', ['customer_id', 'created_at', 'id'], {}),
+    # Only pending rows are looked up by state; the partial index stays small as transactions settle.
+    ('ix_transactions_state_pending', 'transactions', ['state'],
+     {'postgresql_where': sa.text("state = 'pending'")}),
+    ('ix_customers_created_at', 'customers', ['created_at', 'id'], {}),
+    ('ix_merchants_created_at', 'merchants', ['created_at', 'id'], {}),
+    # Audit rows are appended in time order, so a BRIN index covers time ranges at a fraction of the size.
+    ('ix_audit_log_timestamp', 'audit_log', ['timestamp'], {'postgresql_using': 'brin'}),
+    # Covers the token to user lookup so it is answered from the index alone.
+    ('ix_tokens_access_token_user_id', 'tokens', ['access_token'], {'postgresql_include': ['user_id']}),
+]
+
+
+def upgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, columns, options in INDEXES:
+            op.create_index(name, table, columns, if_not_exists=True, postgresql_concurrently=True, **options)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        for name, table, _, _ in reversed(INDEXES):
+            op.drop_index(name, table_name=table, if_exists=True, postgresql_concurrently=True)
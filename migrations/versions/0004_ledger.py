@@ -0,0 +1,51 @@
+"""Append-only ledger of merchant balance changes and its balance checkpoints
+
+Existing settled transactions are copied into the ledger with
+`python -m src.db.ledger rebuild` once the migration has run.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 12:41:19.273550
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0004'
+down_revision: Union[str, None] = '0003'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'ledger_entries',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('merchant_id', sa.Integer(), sa.ForeignKey('merchants.id'), nullable=False),
+        sa.Column('transaction_id', sa.Integer(), sa.ForeignKey('transactions.id'), nullable=False),
+        sa.Column('entry_type', sa.String(16), nullable=False),
+        sa.Column('amount', sa.Numeric(12, 2), nullable=False),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.func.current_timestamp(), nullable=False),
+    )
+    op.create_index('ix_ledger_entries_merchant_id_id', 'ledger_entries', ['merchant_id', 'id'])
+    op.create_index('ix_ledger_entries_transaction_id', 'ledger_entries', ['transaction_id'])
+    op.create_table(
+        'balance_checkpoints',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('merchant_id', sa.Integer(), sa.ForeignKey('merchants.id'), nullable=False),
+        sa.Column('balance', sa.Numeric(14, 2), nullable=False),
+        sa.Column('last_entry_id', sa.Integer(), nullable=False),
+        sa.Column('as_of', sa.DateTime(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.func.current_timestamp(), nullable=False),
+    )
+    op.create_index('ix_balance_checkpoints_merchant_id_last_entry_id', 'balance_checkpoints',
+                    ['merchant_id', 'last_entry_id'])
+
+
+def downgrade() -> None:
+    op.drop_table('balance_checkpoints')
+    op.drop_table('ledger_entries')
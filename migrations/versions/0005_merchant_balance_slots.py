@@ -0,0 +1,33 @@
+"""Sharded sub-balances for merchants with many concurrent captures
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 13:52:07.614208
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0005'
+down_revision: Union[str, None] = '0004'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('merchants', sa.Column('balance_shards', sa.Integer(), server_default='0', nullable=False))
+    op.create_table(
+        'merchant_balance_slots',
+        sa.Column('merchant_id', sa.Integer(), sa.ForeignKey('merchants.id'), primary_key=True),
+        sa.Column('slot', sa.Integer(), primary_key=True),
+        sa.Column('amount', sa.Numeric(14, 2), server_default='0', nullable=False),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('merchant_balance_slots')
+    op.drop_column('merchants', 'balance_shards')
@@ -0,0 +1,45 @@
+"""Webhook endpoints of the merchants and the outbox of transaction state changes
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 16:04:51.302117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0006'
+down_revision: Union[str, None] = '0005'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('merchants', sa.Column('webhook_url', sa.String(2048), nullable=True))
+    op.create_table(
+        'webhook_events',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('merchant_id', sa.Integer(), sa.ForeignKey('merchants.id'), nullable=False),
+        sa.Column('transaction_id', sa.Integer(), sa.ForeignKey('transactions.id'), nullable=False),
+        sa.Column('event_type', sa.String(64), nullable=False),
+        sa.Column('payload', sa.Text(), nullable=False),
+        sa.Column('status', sa.String(16), server_default='pending', nullable=False),
+        sa.Column('attempts', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('next_attempt_at', sa.DateTime(), server_default=sa.func.current_timestamp(), nullable=False),
+        sa.Column('last_error', sa.String(255)),
+        sa.Column('created_at', sa.DateTime(), server_default=sa.func.current_timestamp(), nullable=False),
+        sa.Column('delivered_at', sa.DateTime()),
+    )
+    op.create_index('ix_webhook_events_status_next_attempt_at', 'webhook_events', ['status', 'next_attempt_at'])
+    op.create_index('ix_webhook_events_merchant_id_id', 'webhook_events', ['merchant_id', 'id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_webhook_events_merchant_id_id', table_name='webhook_events')
+    op.drop_index('ix_webhook_events_status_next_attempt_at', table_name='webhook_events')
+    op.drop_table('webhook_events')
+    op.drop_column('merchants', 'webhook_url')
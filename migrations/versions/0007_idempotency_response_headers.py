@@ -0,0 +1,26 @@
+"""Headers of the responses replayed for idempotency keys
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 18:12:40.617203
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0007'
+down_revision: Union[str, None] = '0006'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('idempotency_keys', sa.Column('response_headers', sa.Text()))
+
+
+def downgrade() -> None:
+    op.drop_column('idempotency_keys', 'response_headers')
@@ -0,0 +1,33 @@
+"""Store the merchant balance with cents, like the balance slots and the ledger
+
+merchants.amount_account was an INTEGER, so folding Numeric(14, 2) slot
+amounts into it, or adding a transaction amount to it, rounded the cents away
+on PostgreSQL.
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 18:47:09.114820
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0008'
+down_revision: Union[str, None] = '0007'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.alter_column('merchants', 'amount_account', type_=sa.Numeric(14, 2), existing_type=sa.Integer(),
+                    existing_nullable=False, existing_server_default='0')
+
+
+def downgrade() -> None:
+    op.alter_column('merchants', 'amount_account', type_=sa.Integer(), existing_type=sa.Numeric(14, 2),
+                    existing_nullable=False, existing_server_default='0',
+                    postgresql_using='round(amount_account)::integer')
@@ -0,0 +1,216 @@
+import asyncio
+import logging
+import os
+import random
+from collections import defaultdict
+from typing import Iterable, Optional
+
+from sqlalchemy import bindparam, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm.attributes import set_committed_value
+
+from src.db.connection import AsyncSessionLocal
+from src.db.models.merchant import Merchant as MerchantModel
+from src.db.models.merchant_balance_slot import MerchantBalanceSlot as MerchantBalanceSlotModel
+
+logger = logging.getLogger(__name__)
+
+BALANCE_COMPACTION_INTERVAL = float(os.getenv("BALANCE_COMPACTION_INTERVAL") or 10.0)
+
+
+def slots_total(merchant_id):
+    """Builds the sum of the balance slots of a merchant, for use inside a query.
+
+    Args:
+        merchant_id: The merchant id column or value the slots are correlated with.
+
+    Returns:
+        ScalarSelect: The total of the slots, 0 when the merchant has none.
+    """
+    return (select(func.coalesce(func.sum(MerchantBalanceSlotModel.amount), 0))
+            .where(MerchantBalanceSlotModel.merchant_id == merchant_id)
+            .scalar_subquery())
+
+
+async def add_to_balance(db: AsyncSession, merchant_id: int, balance_shards: int, delta):
+    """Adds a signed amount to a merchant balance without committing.
+
+    Sharded merchants get the change on a random slot, so concurrent captures lock
+    different rows; the others get it on merchants.amount_account.
+
+    Args:
+        db (Session): The database session.
+        merchant_id (int): The ID of the merchant.
+        balance_shards (int): The number of balance slots of the merchant.
+        delta: The signed amount, as a value or a bound SQL expression.
+    """
+    if balance_shards:
+        result = await db.execute(
+            update(MerchantBalanceSlotModel)
+            .where(MerchantBalanceSlotModel.merchant_id == merchant_id,
+                   MerchantBalanceSlotModel.slot == random.randrange(balance_shards))
+            .values(amount=MerchantBalanceSlotModel.amount + delta)
+        )
+        if result.rowcount:
+            return
+    await db.execute(
+        update(MerchantModel)
+        .where(MerchantModel.id == merchant_id)
+        .values(amount_account=MerchantModel.amount_account + delta)
+    )
+
+
+async def create_slots(db: AsyncSession, merchant_id: int, balance_shards: int):
+    """Creates the missing balance slots of a merchant without committing.
+
+    Slots above a reduced shard count are kept; they no longer receive changes and
+    are emptied by the next compaction.
+
+    Args:
+        db (Session): The database session.
+        merchant_id (int): The ID of the merchant.
+        balance_shards (int): The number of slots the merchant should have.
+    """
+    existing = set((await db.scalars(
+        select(MerchantBalanceSlotModel.slot).where(MerchantBalanceSlotModel.merchant_id == merchant_id)
+    )).all())
+    missing = [{"merchant_id": merchant_id, "slot": slot, "amount": 0}
+               for slot in range(balance_shards) if slot not in existing]
+    if missing:
+        await db.execute(insert(MerchantBalanceSlotModel), missing)
+
+
+async def include_slots(db: AsyncSession, merchants: Iterable[MerchantModel]):
+    """Adds the pending slot amounts to the amount_account of loaded merchants.
+
+    The value is set as if it had been loaded, so the merchants are not marked as
+    modified. Merchants without balance slots cost no query.
+
+    Args:
+        db (Session): The database session.
+        merchants (Iterable[MerchantModel]): The loaded merchants.
+    """
+    sharded = {merchant.id: merchant for merchant in merchants if merchant is not None and merchant.balance_shards}
+    if not sharded:
+        return
+    totals = await db.execute(
+        select(MerchantBalanceSlotModel.merchant_id, func.sum(MerchantBalanceSlotModel.amount))
+        .where(MerchantBalanceSlotModel.merchant_id.in_(sharded))
+        .group_by(MerchantBalanceSlotModel.merchant_id)
+    )
+    for merchant_id, total in totals:
+        merchant = sharded[merchant_id]
+        set_committed_value(merchant, "amount_account", merchant.amount_account + total)
+
+
+async def compact(db: AsyncSession, merchant_id: Optional[int] = None) -> int:
+    """Folds the balance slots back into merchants.amount_account.
+
+    The non-empty slots are locked and read, the amount read is subtracted from
+    each slot and added to its merchant, all in one database transaction, so no
+    concurrent change is lost.
+
+    Args:
+        db (Session): The database session.
+        merchant_id (int, optional): Only compact this merchant.
+
+    Returns:
+        int: The number of slots emptied.
+    """
+    statement = (select(MerchantBalanceSlotModel.merchant_id, MerchantBalanceSlotModel.slot,
+                        MerchantBalanceSlotModel.amount)
+                 .where(MerchantBalanceSlotModel.amount != 0)
+                 .order_by(MerchantBalanceSlotModel.merchant_id, MerchantBalanceSlotModel.slot)
+                 .with_for_update())
+    if merchant_id is not None:
+        statement = statement.where(MerchantBalanceSlotModel.merchant_id == merchant_id)
+    slots = (await db.execute(statement)).all()
+    if not slots:
+        await db.rollback()
+        return 0
+
+    totals = defaultdict(int)
+    for slot_merchant_id, _, amount in slots:
+        totals[slot_merchant_id] += amount
+    # Core table UPDATE, so the parameter list runs as an executemany of the WHERE clause.
+    table = MerchantBalanceSlotModel.__table__
+    await db.execute(
+        update(table)
+        .where(table.c.merchant_id == bindparam("slot_merchant_id"), table.c.slot == bindparam("slot_number"))
+        .values(amount=table.c.amount - bindparam("taken", type_=table.c.amount.type)),
+        [{"slot_merchant_id": slot_merchant_id, "slot_number": slot, "taken": amount}
+         for slot_merchant_id, slot, amount in slots],
+    )
+    for slot_merchant_id in sorted(totals):
+        await db.execute(
+            update(MerchantModel)
+            .where(MerchantModel.id == slot_merchant_id)
+            .values(amount_account=MerchantModel.amount_account + bindparam(
+                "total", totals[slot_merchant_id], type_=MerchantBalanceSlotModel.amount.type))
+        )
+    await db.commit()
+    return len(slots)
+
+
+class BalanceCompactor:
+    """Background task that periodically folds the balance slots into the merchant balances.
+
+    Args:
+        session_factory (async_sessionmaker): Factory for the sessions used to compact.
+        interval (float): Seconds between two compactions.
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal, interval: float = BALANCE_COMPACTION_INTERVAL):
+        self.session_factory = session_factory
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.slots = 0
+        self.failed = 0
+
+    async def start(self):
+        """Starts the background compaction task."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops the background compaction task."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        """Returns the compaction counters.
+
+        Returns:
+            dict: The current counters of the compactor.
+        """
+        return {"runs": self.runs, "slots": self.slots, "failed": self.failed}
+
+    async def run_once(self) -> int:
+        """Compacts every merchant once.
+
+        Returns:
+            int: The number of slots emptied.
+        """
+        async with self.session_factory() as db:
+            compacted = await compact(db)
+        self.runs += 1
+        self.slots += compacted
+        return compacted
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Error compacting merchant balance slots: {e}")
+
+
+balance_compactor = BalanceCompactor()
@@ -1,11 +1,25 @@
-from sqlalchemy import create_engine
+from fastapi import Request
+from sqlalchemy import Select, create_engine, event, text
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+import asyncio
+import logging
 import os
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
 from dotenv import load_dotenv
 
+from src.utils.cache import LRUCache
+from src.utils.metrics import metrics
+from src.utils.query_stats import instrument
+
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 user = os.getenv("DB_USER") or "root"
 password = os.getenv("DB_PASSWORD") or "postgres"
 host = os.getenv("DB_HOST") or "localhost"
@@ -14,10 +28,343 @@ db = os.getenv("DB_NAME") or "payment"
 
 
 SQLALCHEMY_DATABASE_URL = f"postgresql://{user}:{password}@{host}:{port}/{db}"
+ASYNC_SQLALCHEMY_DATABASE_URL = f"postgresql+asyncpg://{user}:{password}@{host}:{port}/{db}"
 
+# Synchronous engine, kept for scripts and migrations.
 engine = create_engine(
     SQLALCHEMY_DATABASE_URL, pool_pre_ping=True, pool_size=10, max_overflow=20
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+instrument(engine)
+
+# Comma-separated host[:port] of streaming replicas, reached with the primary credentials and database name.
+DB_REPLICA_HOSTS = [host.strip() for host in (os.getenv("DB_REPLICA_HOSTS") or "").split(",") if host.strip()]
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG") or 5.0)
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL") or 5.0)
+DB_REPLICA_CHECK_TIMEOUT = float(os.getenv("DB_REPLICA_CHECK_TIMEOUT") or 2.0)
+# Seconds the reads of a client go to the primary after it wrote, so it reads its own writes.
+DB_REPLICA_STICKY_SECONDS = float(os.getenv("DB_REPLICA_STICKY_SECONDS") or 10.0)
+
+# Replay delay of a replica, 0 when it has replayed everything it received.
+REPLICA_LAG_QUERY = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+POOL_WAIT = metrics.histogram("payment_db_pool_wait_seconds", "Time spent waiting for a pooled connection.",
+                              ("target",), buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0))
+POOL_CHECKED_OUT = metrics.gauge("payment_db_pool_checked_out", "Connections checked out of the pool.", ("target",))
+POOL_OVERFLOW = metrics.gauge("payment_db_pool_overflow", "Connections open beyond the pool size.", ("target",))
+POOL_SIZE = metrics.gauge("payment_db_pool_size", "Configured size of the connection pool.", ("target",))
+REPLICA_LAG = metrics.gauge("payment_db_replica_lag_seconds", "Replay lag of a read replica.", ("target",))
+REPLICA_HEALTHY = metrics.gauge("payment_db_replica_healthy", "Whether a read replica receives reads.", ("target",))
+STATEMENTS_ROUTED = metrics.counter("payment_db_statements_total", "Statements sent to each database.", ("target",))
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    """Connection pool that records how long each checkout waited for a connection."""
+    target = "primary"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._waiting: Dict[int, float] = {}
+        self._next_waiter = 0
+
+    def longest_wait(self) -> float:
+        """Returns how long the oldest checkout still in progress has been waiting.
+
+        Returns:
+            float: The wait in seconds, 0 when no checkout is waiting.
+        """
+        if not self._waiting:
+            return 0.0
+        return time.perf_counter() - min(self._waiting.values())
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.target = self.target
+        return pool
+
+    def _do_get(self):
+        started = time.perf_counter()
+        waiter = self._next_waiter = self._next_waiter + 1
+        self._waiting[waiter] = started
+        try:
+            return super()._do_get()
+        finally:
+            del self._waiting[waiter]
+            POOL_WAIT.observe(time.perf_counter() - started, self.target)
+
+
+def create_api_engine(url: str, target: str) -> AsyncEngine:
+    """Creates an instrumented engine for the API.
+
+    Args:
+        url (str): The async database URL.
+        target (str): The name of the database in the pool metrics.
+
+    Returns:
+        AsyncEngine: The engine.
+    """
+    api_engine = create_async_engine(url, poolclass=TimedQueuePool, pool_pre_ping=True, pool_size=10, max_overflow=20)
+    api_engine.pool.target = target
+    instrument(api_engine.sync_engine)
+    return api_engine
+
+
+class Replica:
+    """A read replica and its last known state.
+
+    Args:
+        name (str): The host[:port] of the replica.
+        engine (AsyncEngine): The engine connected to the replica.
+    """
+
+    def __init__(self, name: str, engine: AsyncEngine):
+        self.name = name
+        self.engine = engine
+        self.healthy = False
+        self.lag: Optional[float] = None
+        self.error: Optional[str] = None
+        event.listen(engine.sync_engine, "handle_error", self._handle_error)
+
+    def _handle_error(self, context):
+        # A lost connection takes the replica out of rotation until the next successful check.
+        if context.is_disconnect or isinstance(context.original_exception, (OSError, asyncio.TimeoutError)):
+            self.healthy = False
+            self.error = type(context.original_exception).__name__
+
+
+class ReplicaRouter:
+    """Chooses the database that serves the reads of a session.
+
+    Replicas are checked in the background and only receive reads while they
+    answer and lag less than max_lag behind the primary; without a healthy
+    replica every read goes to the primary. Clients that wrote in the last
+    sticky_seconds read from the primary, so they see their own writes. The
+    sticky clients are tracked per worker.
+
+    Args:
+        replicas (List[Replica]): The read replicas.
+        max_lag (float): Maximum replay lag, in seconds, of a replica that receives reads.
+        check_interval (float): Seconds between two checks of the replicas.
+        sticky_seconds (float): Seconds a client reads from the primary after a write.
+    """
+
+    def __init__(self, replicas: List[Replica], max_lag: float = DB_REPLICA_MAX_LAG,
+                 check_interval: float = DB_REPLICA_CHECK_INTERVAL, sticky_seconds: float = DB_REPLICA_STICKY_SECONDS):
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._writers = LRUCache(ttl=sticky_seconds)
+        self._next = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def choose(self) -> Optional[Replica]:
+        """Returns the next healthy replica in round-robin order.
+
+        Returns:
+            Optional[Replica]: The replica, None when no replica is healthy.
+        """
+        healthy = [replica for replica in self.replicas if replica.healthy]
+        if not healthy:
+            return None
+        self._next += 1
+        return healthy[self._next % len(healthy)]
+
+    def reads_from_replica(self, client: Optional[str]) -> bool:
+        """Tells whether the reads of a client may go to a replica.
+
+        Args:
+            client (str, optional): The credentials identifying the client.
+
+        Returns:
+            bool: False when there is no replica or the client wrote recently.
+        """
+        return bool(self.replicas) and (client is None or self._writers.get(client) is None)
+
+    def wrote(self, client: Optional[str]):
+        """Sends the reads of a client to the primary for the sticky period.
+
+        Args:
+            client (str, optional): The credentials identifying the client.
+        """
+        if client is not None and self.replicas:
+            self._writers.set(client, True)
+
+    async def check(self):
+        """Measures the lag of every replica and updates which ones receive reads."""
+        for replica in self.replicas:
+            try:
+                async with replica.engine.connect() as conn:
+                    lag = await asyncio.wait_for(conn.scalar(REPLICA_LAG_QUERY), DB_REPLICA_CHECK_TIMEOUT)
+                replica.lag = float(lag or 0)
+                replica.healthy = replica.lag <= self.max_lag
+                replica.error = None if replica.healthy else "lagging"
+            except Exception as e:
+                replica.healthy = False
+                replica.error = type(e).__name__
+                logger.warning(f"Read replica {replica.name} failed its check: {e}")
+            REPLICA_LAG.set(replica.lag or 0.0, replica.name)
+            REPLICA_HEALTHY.set(1 if replica.healthy else 0, replica.name)
+
+    async def start(self):
+        """Starts checking the replicas in the background."""
+        if self.replicas and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops checking the replicas."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        """Returns the state of every replica.
+
+        Returns:
+            dict: The health, lag and last error of each replica, by name.
+        """
+        return {
+            replica.name: {"healthy": replica.healthy, "lag": replica.lag, "error": replica.error}
+            for replica in self.replicas
+        }
+
+    async def _run(self):
+        while True:
+            await self.check()
+            await asyncio.sleep(self.check_interval)
+
+
+def is_plain_select(clause) -> bool:
+    # Lambda statements wrap the Select they build.
+    clause = getattr(clause, "_resolved", clause)
+    return isinstance(clause, Select) and clause._for_update_arg is None
+
+
+class RoutingSession(Session):
+    """Session that sends plain SELECTs to a read replica when marked read-only.
+
+    get_db marks the sessions of GET requests read-only. The replica is chosen on
+    the first read and kept for the whole session, so its reads are consistent
+    with each other. Writes, locking reads and flushes always use the primary,
+    and a session that wrote is flagged in info["wrote"].
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        if self.info.get("read_only") and not self._flushing and is_plain_select(clause):
+            replica = self.info.get("replica")
+            if replica is None:
+                replica = self.info["replica"] = replica_router.choose()
+            if replica is not None:
+                STATEMENTS_ROUTED.inc(replica.name)
+                return replica.engine.sync_engine
+        if self._flushing or (clause is not None and not clause.is_select):
+            self.info["wrote"] = True
+        STATEMENTS_ROUTED.inc("primary")
+        return super().get_bind(mapper, clause=clause, **kw)
+
+
+@contextmanager
+def primary_reads(db: AsyncSession):
+    """Sends the reads of a session to the primary inside the block.
+
+    Used when the rows read are cached, so a lagging replica cannot put stale
+    values in the cache.
+
+    Args:
+        db (Session): The database session.
+    """
+    read_only = db.info.pop("read_only", False)
+    try:
+        yield db
+    finally:
+        if read_only:
+            db.info["read_only"] = True
+
+
+# Asynchronous engine used by the API so database round trips don't block the event loop.
+async_engine = create_api_engine(ASYNC_SQLALCHEMY_DATABASE_URL, "primary")
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, sync_session_class=RoutingSession,
+                                       autoflush=False, expire_on_commit=False)
+replica_router = ReplicaRouter([
+    Replica(replica_host, create_api_engine(f"postgresql+asyncpg://{user}:{password}@{replica_host}"
+                                            f"{'' if ':' in replica_host else ':' + port}/{db}", replica_host))
+    for replica_host in DB_REPLICA_HOSTS
+])
 
 Base = declarative_base()
+
+
+def pool_status(api_engine: AsyncEngine = async_engine) -> dict:
+    """Reports the usage of an API connection pool.
+
+    Args:
+        api_engine (AsyncEngine): The engine of the pool, the primary by default.
+
+    Returns:
+        dict: The connections checked out, the overflow, the pool size, the utilization
+        of the size plus overflow capacity, and the longest current checkout wait in seconds.
+    """
+    pool = api_engine.pool
+    capacity = pool.size() + pool._max_overflow
+    return {
+        "checked_out": pool.checkedout(),
+        "overflow": max(pool.overflow(), 0),
+        "size": pool.size(),
+        "utilization": round(pool.checkedout() / capacity, 3) if capacity else 0.0,
+        "longest_wait": round(pool.longest_wait(), 3),
+    }
+
+
+def collect_pool_metrics():
+    for target, api_engine in [("primary", async_engine)] + [(r.name, r.engine) for r in replica_router.replicas]:
+        status = pool_status(api_engine)
+        POOL_CHECKED_OUT.set(status["checked_out"], target)
+        POOL_OVERFLOW.set(status["overflow"], target)
+        POOL_SIZE.set(status["size"], target)
+
+
+metrics.on_collect(collect_pool_metrics)
+
+
+async def db_session_middleware(request: Request, call_next):
+    """Closes the session opened for the request, if any, once the response is ready.
+
+    A client whose request wrote reads from the primary for the next DB_REPLICA_STICKY_SECONDS.
+    """
+    try:
+        return await call_next(request)
+    finally:
+        db = getattr(request.state, "db", None)
+        if db is not None:
+            if db.info.get("wrote"):
+                replica_router.wrote(request.headers.get("Authorization"))
+            await db.close()
+
+
+def get_db(request: Request) -> AsyncSession:
+    """Returns the session of the current request.
+
+    The session is created on first use and shared by every middleware and
+    dependency handling the request. A pooled connection is only checked out
+    when the first statement runs, and is released by db_session_middleware.
+    Sessions of GET requests read from a replica when one is configured and the
+    client did not write recently.
+
+    Args:
+        request (Request): The current request.
+
+    Returns:
+        AsyncSession: The request-scoped database session.
+    """
+    db = getattr(request.state, "db", None)
+    if db is None:
+        db = request.state.db = AsyncSessionLocal()
+        if request.method in ("GET", "HEAD"):
+            db.info["read_only"] = replica_router.reads_from_replica(request.headers.get("Authorization"))
+    return db
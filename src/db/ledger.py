@@ -0,0 +1,313 @@
+"""Balances computed from the merchant ledger.
+
+Usage:
+    python -m src.db.ledger check
+    python -m src.db.ledger rebuild [--merchant-id ID] [--sync-balances]
+"""
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from sqlalchemy import and_, delete, exists, func, insert, literal, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.db.balance_slots import slots_total
+from src.db.connection import AsyncSessionLocal
+from src.db.models.ledger import BalanceCheckpoint as BalanceCheckpointModel, LedgerEntry as LedgerEntryModel
+from src.db.models.merchant import Merchant as MerchantModel
+from src.db.models.merchant_balance_slot import MerchantBalanceSlot as MerchantBalanceSlotModel
+from src.db.models.transaction import Transaction as TransactionModel
+
+logger = logging.getLogger(__name__)
+
+LEDGER_CHECKPOINT_INTERVAL = float(os.getenv("LEDGER_CHECKPOINT_INTERVAL") or 300.0)
+LEDGER_CHECKPOINT_MIN_ENTRIES = int(os.getenv("LEDGER_CHECKPOINT_MIN_ENTRIES") or 100)
+# Entries younger than this may belong to transactions that have not committed yet.
+LEDGER_CHECKPOINT_LAG = float(os.getenv("LEDGER_CHECKPOINT_LAG") or 60.0)
+
+# Ledger entry type and sign of each settled transaction state.
+SETTLED_STATES = {
+    'success': ('capture', 1),
+    'refunded': ('refund', -1),
+}
+
+
+async def merchant_balance(db: AsyncSession, merchant_id: int, as_of: Optional[datetime] = None) -> Decimal:
+    """Computes a merchant balance from its latest checkpoint and the entries written after it.
+
+    Args:
+        db (Session): The database session.
+        merchant_id (int): The ID of the merchant.
+        as_of (datetime, optional): Compute the balance at this time instead of now.
+
+    Returns:
+        Decimal: The balance of the merchant.
+    """
+    statement = (select(BalanceCheckpointModel).where(BalanceCheckpointModel.merchant_id == merchant_id)
+                 .order_by(BalanceCheckpointModel.last_entry_id.desc()).limit(1))
+    if as_of is not None:
+        statement = statement.where(BalanceCheckpointModel.as_of <= as_of)
+    checkpoint = await db.scalar(statement)
+
+    statement = select(func.coalesce(func.sum(LedgerEntryModel.amount), 0)).where(
+        LedgerEntryModel.merchant_id == merchant_id,
+        LedgerEntryModel.id > (checkpoint.last_entry_id if checkpoint else 0),
+    )
+    if as_of is not None:
+        statement = statement.where(LedgerEntryModel.created_at <= as_of)
+    delta = await db.scalar(statement)
+    return Decimal(checkpoint.balance if checkpoint else 0) + Decimal(delta)
+
+
+async def create_checkpoints(db: AsyncSession, min_entries: int = LEDGER_CHECKPOINT_MIN_ENTRIES,
+                             lag: float = LEDGER_CHECKPOINT_LAG, merchant_id: Optional[int] = None) -> int:
+    """Writes a new checkpoint for every merchant with enough entries since its last one.
+
+    Every merchant is handled by a single INSERT ... SELECT. Checkpoints stop at the
+    last entry older than the lag, so entries of transactions that are still
+    running when the checkpoint is taken are not skipped.
+
+    Args:
+        db (Session): The database session.
+        min_entries (int): The minimum number of new entries for a merchant to get a checkpoint.
+        lag (float): Only entries at least this many seconds old are included.
+        merchant_id (int, optional): Only checkpoint this merchant.
+
+    Returns:
+        int: The number of checkpoints written.
+    """
+    now = datetime.utcnow()
+    bound = await db.scalar(
+        select(LedgerEntryModel.id).where(LedgerEntryModel.created_at < now - timedelta(seconds=lag))
+        .order_by(LedgerEntryModel.id.desc()).limit(1)
+    )
+    if bound is None:
+        return 0
+
+    latest = (select(BalanceCheckpointModel.merchant_id,
+                     func.max(BalanceCheckpointModel.last_entry_id).label("last_entry_id"))
+              .group_by(BalanceCheckpointModel.merchant_id).subquery())
+    previous = (select(BalanceCheckpointModel.merchant_id, BalanceCheckpointModel.balance,
+                       BalanceCheckpointModel.last_entry_id)
+                .join(latest, and_(latest.c.merchant_id == BalanceCheckpointModel.merchant_id,
+                                   latest.c.last_entry_id == BalanceCheckpointModel.last_entry_id))
+                .subquery())
+    statement = (
+        select(LedgerEntryModel.merchant_id,
+               func.coalesce(previous.c.balance, 0) + func.sum(LedgerEntryModel.amount),
+               func.max(LedgerEntryModel.id), func.max(LedgerEntryModel.created_at), literal(now))
+        .outerjoin(previous, previous.c.merchant_id == LedgerEntryModel.merchant_id)
+        .where(LedgerEntryModel.id > func.coalesce(previous.c.last_entry_id, 0), LedgerEntryModel.id <= bound)
+        .group_by(LedgerEntryModel.merchant_id, previous.c.balance)
+        .having(func.count() >= min_entries)
+    )
+    if merchant_id is not None:
+        statement = statement.where(LedgerEntryModel.merchant_id == merchant_id)
+    result = await db.execute(insert(BalanceCheckpointModel).from_select(
+        ["merchant_id", "balance", "last_entry_id", "as_of", "created_at"], statement
+    ))
+    await db.commit()
+    return result.rowcount
+
+
+async def backfill_ledger(db: AsyncSession, merchant_id: Optional[int] = None) -> int:
+    """Writes the missing ledger entries of settled transactions.
+
+    Args:
+        db (Session): The database session.
+        merchant_id (int, optional): Only backfill the transactions of this merchant.
+
+    Returns:
+        int: The number of entries written.
+    """
+    written = 0
+    for state, (entry_type, sign) in SETTLED_STATES.items():
+        statement = select(
+            TransactionModel.merchant_id, TransactionModel.id, literal(entry_type), sign * TransactionModel.amount,
+            func.coalesce(TransactionModel.updated_at, TransactionModel.created_at),
+        ).where(
+            TransactionModel.state == state,
+            ~exists().where(LedgerEntryModel.transaction_id == TransactionModel.id),
+        ).order_by(TransactionModel.id)
+        if merchant_id is not None:
+            statement = statement.where(TransactionModel.merchant_id == merchant_id)
+        result = await db.execute(insert(LedgerEntryModel).from_select(
+            ["merchant_id", "transaction_id", "entry_type", "amount", "created_at"], statement
+        ))
+        written += result.rowcount
+    await db.commit()
+    return written
+
+
+async def rebuild(db: AsyncSession, merchant_id: Optional[int] = None, sync_balances: bool = False) -> dict:
+    """Backfills the ledger and recomputes the checkpoints from scratch.
+
+    Args:
+        db (Session): The database session.
+        merchant_id (int, optional): Only rebuild this merchant.
+        sync_balances (bool): Also overwrite merchants.amount_account with the ledger balance
+            and empty the balance slots.
+
+    Returns:
+        dict: The number of entries backfilled, checkpoints written and balances synced.
+    """
+    backfilled = await backfill_ledger(db, merchant_id)
+    statement = delete(BalanceCheckpointModel)
+    if merchant_id is not None:
+        statement = statement.where(BalanceCheckpointModel.merchant_id == merchant_id)
+    await db.execute(statement)
+    checkpoints = await create_checkpoints(db, min_entries=1, lag=0, merchant_id=merchant_id)
+
+    synced = 0
+    if sync_balances:
+        ledger_balance = (select(func.coalesce(func.sum(LedgerEntryModel.amount), 0))
+                          .where(LedgerEntryModel.merchant_id == MerchantModel.id).scalar_subquery())
+        statement = update(MerchantModel).values(amount_account=ledger_balance)
+        if merchant_id is not None:
+            statement = statement.where(MerchantModel.id == merchant_id)
+        synced = (await db.execute(statement)).rowcount
+        statement = update(MerchantBalanceSlotModel).values(amount=0)
+        if merchant_id is not None:
+            statement = statement.where(MerchantBalanceSlotModel.merchant_id == merchant_id)
+        await db.execute(statement)
+        await db.commit()
+    return {"backfilled": backfilled, "checkpoints": checkpoints, "synced": synced}
+
+
+async def check(db: AsyncSession) -> Dict[str, List[dict]]:
+    """Checks the ledger against the merchant balances, the checkpoints and the transactions.
+
+    Each check is a single aggregate query over every merchant.
+
+    Args:
+        db (Session): The database session.
+
+    Returns:
+        Dict[str, List[dict]]: The inconsistencies found by each check, empty lists when consistent.
+    """
+    ledger_balance = func.coalesce(func.sum(LedgerEntryModel.amount), 0)
+    amount_account = MerchantModel.amount_account + slots_total(MerchantModel.id)
+    # Balances, slots, checkpoints and entries are all NUMERIC with cents; the differences are rounded
+    # to cents because SQLite sums NUMERIC columns as floats.
+    balances = await db.execute(
+        select(MerchantModel.id, amount_account, ledger_balance)
+        .outerjoin(LedgerEntryModel, LedgerEntryModel.merchant_id == MerchantModel.id)
+        .group_by(MerchantModel.id, MerchantModel.amount_account)
+        .having(func.round(amount_account - ledger_balance, 2) != 0)
+        .order_by(MerchantModel.id)
+    )
+    checkpoints = await db.execute(
+        select(BalanceCheckpointModel.id, BalanceCheckpointModel.merchant_id, BalanceCheckpointModel.balance,
+               ledger_balance)
+        .outerjoin(LedgerEntryModel, and_(LedgerEntryModel.merchant_id == BalanceCheckpointModel.merchant_id,
+                                          LedgerEntryModel.id <= BalanceCheckpointModel.last_entry_id))
+        .group_by(BalanceCheckpointModel.id, BalanceCheckpointModel.merchant_id, BalanceCheckpointModel.balance)
+        .having(func.round(BalanceCheckpointModel.balance - ledger_balance, 2) != 0)
+        .order_by(BalanceCheckpointModel.id)
+    )
+    missing = await db.execute(
+        select(TransactionModel.id, TransactionModel.merchant_id, TransactionModel.state)
+        .where(TransactionModel.state.in_(SETTLED_STATES),
+               ~exists().where(LedgerEntryModel.transaction_id == TransactionModel.id))
+        .order_by(TransactionModel.id)
+    )
+    return {
+        "balances": [{"merchant_id": merchant_id, "amount_account": amount_account, "ledger": ledger}
+                     for merchant_id, amount_account, ledger in balances],
+        "checkpoints": [{"checkpoint_id": checkpoint_id, "merchant_id": merchant_id, "balance": balance,
+                         "ledger": ledger} for checkpoint_id, merchant_id, balance, ledger in checkpoints],
+        "missing_entries": [{"transaction_id": transaction_id, "merchant_id": merchant_id, "state": state}
+                            for transaction_id, merchant_id, state in missing],
+    }
+
+
+class LedgerCheckpointer:
+    """Background task that periodically checkpoints the merchant balances.
+
+    Args:
+        session_factory (async_sessionmaker): Factory for the sessions used to write checkpoints.
+        interval (float): Seconds between two checkpoint runs.
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal, interval: float = LEDGER_CHECKPOINT_INTERVAL):
+        self.session_factory = session_factory
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+        self.runs = 0
+        self.checkpoints = 0
+        self.failed = 0
+
+    async def start(self):
+        """Starts the background checkpoint task."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops the background checkpoint task."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        """Returns the checkpoint counters.
+
+        Returns:
+            dict: The current counters of the checkpointer.
+        """
+        return {"runs": self.runs, "checkpoints": self.checkpoints, "failed": self.failed}
+
+    async def run_once(self) -> int:
+        """Writes the checkpoints that are due.
+
+        Returns:
+            int: The number of checkpoints written.
+        """
+        async with self.session_factory() as db:
+            written = await create_checkpoints(db)
+        self.runs += 1
+        self.checkpoints += written
+        return written
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Error checkpointing merchant balances: {e}")
+
+
+ledger_checkpointer = LedgerCheckpointer()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Rebuild or check the merchant ledger.")
+    parser.add_argument("command", choices=["check", "rebuild"])
+    parser.add_argument("--merchant-id", type=int, default=None, help="Only rebuild this merchant.")
+    parser.add_argument("--sync-balances", action="store_true",
+                        help="Overwrite merchants.amount_account with the ledger balance.")
+    args = parser.parse_args()
+
+    async with AsyncSessionLocal() as db:
+        if args.command == "rebuild":
+            print(await rebuild(db, args.merchant_id, args.sync_balances))
+            return 0
+        problems = await check(db)
+    for name, rows in problems.items():
+        print(f"{name}: {len(rows)} inconsistencies")
+        for row in rows:
+            print(f"  {row}")
+    return 1 if any(problems.values()) else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(asyncio.run(main()))
@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy import Column, Integer, String, DateTime, Index
 
 from src.db.connection import Base
 
@@ -21,6 +21,7 @@ class AuditLogModel(Base):
         __tablename__ (str): The name of the database table.
     """
     __tablename__ = 'audit_log'
+    __table_args__ = (Index('ix_audit_log_timestamp', 'timestamp', postgresql_using='brin'),)
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, nullable=True)
     activity_type = Column(String, nullable=False)
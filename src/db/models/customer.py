@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlalchemy import Column, Integer, String, ForeignKey, Numeric, DateTime, Boolean
+from sqlalchemy import Column, Integer, String, ForeignKey, Numeric, DateTime, Boolean, Index
 
 from src.db.connection import Base
 
@@ -18,6 +18,7 @@ class Customer(Base):
         updated_at (datetime): The timestamp when the customer was last updated.
     """
     __tablename__ = "customers"
+    __table_args__ = (Index("ix_customers_created_at", "created_at", "id"),)
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     name = Column(String(255), nullable=False)
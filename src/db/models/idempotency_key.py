@@ -0,0 +1,36 @@
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, String, Text, DateTime, Index, UniqueConstraint
+
+from src.db.connection import Base
+
+
+class IdempotencyKey(Base):
+    """Represents the outcome of a request sent with an Idempotency-Key header.
+
+    Attributes:
+        id (int): The unique identifier of the entry.
+        user_id (int): The user that sent the request; keys are scoped per user.
+        key (str): The Idempotency-Key header value.
+        fingerprint (str): SHA-256 of the method, path and body of the request.
+        status_code (int, optional): The status of the stored response, None while the request is running.
+        response_headers (str, optional): The replayed response headers, as a JSON list of name and value pairs.
+        response_body (str, optional): The serialized response body.
+        created_at (datetime): The timestamp when the key was first seen.
+        expires_at (datetime): The timestamp after which the entry is ignored and swept.
+    """
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (
+        UniqueConstraint("user_id", "key", name="uq_idempotency_keys_user_id_key"),
+        Index("ix_idempotency_keys_expires_at", "expires_at"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    user_id = Column(Integer, nullable=False)
+    key = Column(String(255), nullable=False)
+    fingerprint = Column(String(64), nullable=False)
+    status_code = Column(Integer, nullable=True)
+    response_headers = Column(Text, nullable=True)
+    response_body = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False)
@@ -0,0 +1,52 @@
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, String, Numeric, DateTime, ForeignKey, Index
+
+from src.db.connection import Base
+
+
+class LedgerEntry(Base):
+    """Represents a signed change of a merchant balance. Entries are never updated or deleted.
+
+    Attributes:
+        id (int): The unique identifier of the entry, increasing in insertion order.
+        merchant_id (int): The merchant whose balance changes.
+        transaction_id (int): The transaction that caused the change.
+        entry_type (str): The operation, either "capture" or "refund".
+        amount (Decimal): The signed amount added to the balance.
+        created_at (datetime): The timestamp when the entry was written.
+    """
+    __tablename__ = "ledger_entries"
+    __table_args__ = (
+        Index("ix_ledger_entries_merchant_id_id", "merchant_id", "id"),
+        Index("ix_ledger_entries_transaction_id", "transaction_id"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    merchant_id = Column(Integer, ForeignKey('merchants.id'), nullable=False)
+    transaction_id = Column(Integer, ForeignKey('transactions.id'), nullable=False)
+    entry_type = Column(String(16), nullable=False)
+    amount = Column(Numeric(12, 2), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class BalanceCheckpoint(Base):
+    """Represents the balance of a merchant after a prefix of its ledger entries.
+
+    Attributes:
+        id (int): The unique identifier of the checkpoint.
+        merchant_id (int): The merchant of the balance.
+        balance (Decimal): The sum of the merchant entries up to last_entry_id.
+        last_entry_id (int): The last ledger entry included in the balance.
+        as_of (datetime): The latest created_at of the included entries.
+        created_at (datetime): The timestamp when the checkpoint was written.
+    """
+    __tablename__ = "balance_checkpoints"
+    __table_args__ = (Index("ix_balance_checkpoints_merchant_id_last_entry_id", "merchant_id", "last_entry_id"),)
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    merchant_id = Column(Integer, ForeignKey('merchants.id'), nullable=False)
+    balance = Column(Numeric(14, 2), nullable=False)
+    last_entry_id = Column(Integer, nullable=False)
+    as_of = Column(DateTime, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
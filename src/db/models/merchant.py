@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlalchemy import Column, Integer, String, Boolean, DateTime
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Index, Numeric
 
 from src.db.connection import Base
 
@@ -13,18 +13,24 @@ class Merchant(Base):
         name (str): The name of the merchant.
         email (str): The email address of the merchant.
         is_active (bool, optional): Indicates if the merchant is active.
-        authentication_key (str): The authentication key of the merchant.
-        amount_account (int): The amount in the merchant's account.
+        authentication_key (str): The authentication key of the merchant, which also signs its webhooks.
+        webhook_url (str, optional): The endpoint receiving the transaction state changes of the merchant.
+        amount_account (Decimal): The amount in the merchant's account, without the pending balance slots.
+        balance_shards (int): The number of balance slots receiving the balance changes, 0 when not sharded.
         created_at (datetime): The timestamp when the merchant was created.
         updated_at (datetime): The timestamp when the merchant was last updated.
     """
     __tablename__ = "merchants"
+    __table_args__ = (Index("ix_merchants_created_at", "created_at", "id"),)
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String(255), nullable=False)
     email = Column(String(255), nullable=False, unique=True)
     is_active = Column(Boolean, default=True)
-    amount_account = Column(Integer, default=0, nullable=False)
+    # Same type as the balance slots and ledger entries, so folding them in never rounds away cents.
+    amount_account = Column(Numeric(14, 2), default=0, nullable=False)
+    balance_shards = Column(Integer, default=0, nullable=False)
     authentication_key = Column(String, nullable=False, unique=True)
+    webhook_url = Column(String(2048), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, onupdate=datetime.utcnow, default=datetime.utcnow)
@@ -0,0 +1,20 @@
+from sqlalchemy import Column, Integer, Numeric, ForeignKey
+
+from src.db.connection import Base
+
+
+class MerchantBalanceSlot(Base):
+    """Represents one sub-balance of a merchant whose balance changes are sharded.
+
+    The balance of the merchant is its amount_account plus the amount of all its slots.
+
+    Attributes:
+        merchant_id (int): The merchant owning the slot.
+        slot (int): The number of the slot, from 0 to balance_shards - 1.
+        amount (Decimal): The balance changes accumulated since the slot was last compacted.
+    """
+    __tablename__ = "merchant_balance_slots"
+
+    merchant_id = Column(Integer, ForeignKey('merchants.id'), primary_key=True)
+    slot = Column(Integer, primary_key=True)
+    amount = Column(Numeric(14, 2), nullable=False, default=0)
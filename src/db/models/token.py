@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 
 from src.db.connection import Base
@@ -19,6 +19,7 @@ class Token(Base):
         customer (relationship): The relationship to the associated user.
     """
     __tablename__ = "tokens"
+    __table_args__ = (Index("ix_tokens_access_token_user_id", "access_token", postgresql_include=["user_id"]),)
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     access_token = Column(String(255), nullable=False, unique=True)
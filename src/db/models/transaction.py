@@ -1,4 +1,4 @@
-from sqlalchemy import DateTime, Column, String, Integer, ForeignKey, Numeric
+from sqlalchemy import DateTime, Column, String, Integer, ForeignKey, Numeric, Index, text
 from datetime import datetime
 
 from sqlalchemy.orm import relationship
@@ -25,6 +25,11 @@ class Transaction(Base):
         customer (Customer): The customer associated with the transaction.
     """
     __tablename__ = "transactions"
+    __table_args__ = (
+        Index("ix_transactions_merchant_id_created_at", "merchant_id", "created_at", "id"),
+        Index("ix_transactions_customer_id_created_at", "customer_id", "created_at", "id"),
+        Index("ix_transactions_state_pending", "state", postgresql_where=text("state = 'pending'")),
+    )
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     merchant_id = Column(Integer, ForeignKey('merchants.id'))
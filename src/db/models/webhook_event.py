@@ -0,0 +1,43 @@
+from datetime import datetime
+
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Index
+
+from src.db.connection import Base
+
+
+class WebhookEvent(Base):
+    """Represents a transaction state change to deliver to the webhook endpoint of its merchant.
+
+    Events are written in the database transaction of the state change, so an
+    event exists if and only if the change was committed.
+
+    Attributes:
+        id (int): The unique identifier of the event, sent as the Webhook-Id header.
+        merchant_id (int): The merchant the event is delivered to.
+        transaction_id (int): The transaction whose state changed.
+        event_type (str): The type of the event, such as "transaction.completed".
+        payload (str): The JSON of the transaction after the change.
+        status (str): "pending" until delivered, then "delivered", or "dead" after the last failed attempt.
+        attempts (int): The number of failed delivery attempts.
+        next_attempt_at (datetime): The time the next delivery attempt is due.
+        last_error (str, optional): The reason of the last failed attempt.
+        created_at (datetime): The timestamp of the state change.
+        delivered_at (datetime, optional): The timestamp of the successful delivery.
+    """
+    __tablename__ = "webhook_events"
+    __table_args__ = (
+        Index("ix_webhook_events_status_next_attempt_at", "status", "next_attempt_at"),
+        Index("ix_webhook_events_merchant_id_id", "merchant_id", "id"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    merchant_id = Column(Integer, ForeignKey('merchants.id'), nullable=False)
+    transaction_id = Column(Integer, ForeignKey('transactions.id'), nullable=False)
+    event_type = Column(String(64), nullable=False)
+    payload = Column(Text, nullable=False)
+    status = Column(String(16), default="pending", nullable=False)
+    attempts = Column(Integer, default=0, nullable=False)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    last_error = Column(String(255), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    delivered_at = Column(DateTime, nullable=True)
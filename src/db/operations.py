@@ -1,24 +1,70 @@
+import asyncio
+import os
 import uuid
-from typing import List
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple
 
 from fastapi import HTTPException
+from pydantic import ValidationError
+from sqlalchemy import Row, Select, and_, case, insert, lambda_stmt, literal, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.db.models.customer import Customer as CustomerModel
+from src.db.models.ledger import LedgerEntry as LedgerEntryModel
 from src.db.models.merchant import Merchant as MerchantModel
+from src.db.models.merchant_balance_slot import MerchantBalanceSlot as MerchantBalanceSlotModel
 from src.db.models.transaction import Transaction as TransactionModel
+from src.db.models.webhook_event import WebhookEvent as WebhookEventModel
 
 from src.db.schemas.transaction import Transaction, TransactionCreate, TransactionUpdate
 from src.db.schemas.customer import Customer, CustomerCreate, CustomerUpdate
 from src.db.schemas.merchant import Merchant, MerchantCreate, MerchantUpdate
-from src.db.connection import SessionLocal
+from src.db.balance_slots import add_to_balance, create_slots, include_slots, slots_total
+from src.db.connection import AsyncSessionLocal, primary_reads
+from src.db.pagination import DEFAULT_PAGE_SIZE, paginate
 from src.utils.bank import BankUtils
+from src.utils.processor import PaymentDeclined, ProcessorError, ProcessorUnavailable, processor_client
+from src.utils.cache import ReadThroughCache, Snapshot
+from src.utils.event_stream import transaction_events
+from src.utils.metrics import metrics
+from src.utils.responses import RowSerializer, dumps
+from src.utils.webhooks import WEBHOOK_EVENT_TYPES, webhook_dispatcher
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE") or 1000)
+# Seconds after which a payment reserved for the processor may be claimed again, by a retry of the request
+# that reserved it; the processor deduplicates the payment on the transaction token.
+PAYMENT_RESERVATION_TIMEOUT = float(os.getenv("PAYMENT_RESERVATION_TIMEOUT") or 300.0)
+# Columns of an exported transaction, in the order of the Transaction schema.
+EXPORT_COLUMNS = (
+    TransactionModel.id, TransactionModel.merchant_id, TransactionModel.customer_id, TransactionModel.amount,
+    TransactionModel.currency, TransactionModel.state, TransactionModel.hash_credit_card, TransactionModel.token,
+    TransactionModel.created_at, TransactionModel.updated_at,
+)
+
+# Listings select the columns of their response schema and are serialized from the rows as they are,
+# without building ORM objects or validating trusted database output.
+CUSTOMER_ROWS = RowSerializer(Customer)
+MERCHANT_ROWS = RowSerializer(Merchant)
+TRANSACTION_ROWS = RowSerializer(Transaction)
+
+# Detached snapshots of customers and merchants, keyed by id. Writes through update_customer and
+# update_merchant invalidate them. The merchant snapshot leaves out the columns every capture and
+# refund changes, so balance changes never invalidate it.
+customer_cache = ReadThroughCache("customer")
+merchant_cache = ReadThroughCache("merchant")
+MERCHANT_UNCACHED_COLUMNS = ("amount_account", "updated_at")
+
+STATE_TRANSITIONS = metrics.counter("payment_transaction_transitions_total",
+                                    "Committed transaction state changes; new transactions come from 'none'.",
+                                    ("from_state", "to_state"))
 
 
 # CREATE
 
 ## CUSTOMER
 
-def create_customer(db: SessionLocal, customer: CustomerCreate) -> Customer:
+async def create_customer(db: AsyncSession, customer: CustomerCreate) -> Customer:
     """Creates a new customer in the database.
 
     Args:
@@ -29,21 +75,19 @@ def create_customer(db: SessionLocal, customer: CustomerCreate) -> Customer:
         Customer: The customer created in the database.
     """
     try:
-        db_customer = CustomerModel(**customer.dict())
+        db_customer = CustomerModel(**customer.model_dump())
         db.add(db_customer)
-        db.commit()
-        db.refresh(db_customer)
+        await db.commit()
+        await db.refresh(db_customer)
         return db_customer
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail=str(e)) from e
-    finally:
-        db.close()
 
 
 ## MERCHANT
 
-def create_merchant(db: SessionLocal, merchant: MerchantCreate) -> Merchant:
+async def create_merchant(db: AsyncSession, merchant: MerchantCreate) -> Merchant:
     """Creates a new merchant in the database.
 
     Args:
@@ -54,21 +98,19 @@ def create_merchant(db: SessionLocal, merchant: MerchantCreate) -> Merchant:
         Merchant: The merchant created in the database.
     """
     try:
-        db_merchant = MerchantModel(**merchant.dict())
+        db_merchant = MerchantModel(**merchant.model_dump())
         db.add(db_merchant)
-        db.commit()
-        db.refresh(db_merchant)
+        await db.commit()
+        await db.refresh(db_merchant)
         return db_merchant
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail=str(e)) from e
-    finally:
-        db.close()
 
 
 ## TRANSACTION
 
-def create_transaction(db: SessionLocal, transaction: TransactionCreate) -> TransactionModel:
+async def create_transaction(db: AsyncSession, transaction: TransactionCreate) -> TransactionModel:
     """Crea una nueva transacción en la base de datos.
 
     Args:
@@ -79,29 +121,111 @@ def create_transaction(db: SessionLocal, transaction: TransactionCreate) -> Tran
         TransactionModel: La transacción creada en la base de datos.
     """
     try:
-        transaction_data = transaction.dict()
-        transaction_data['token'] = str(uuid.uuid4())
-        transaction_data['state'] = 'pending'
-        db_transaction = TransactionModel(**transaction_data)
-
-        db.add(db_transaction)
-        db.commit()
-        db.refresh(db_transaction)
-
+        db_transaction = await db.scalar(
+            insert(TransactionModel).values(**new_transaction_values(transaction)).returning(TransactionModel)
+        )
+        await db.commit()
+        STATE_TRANSITIONS.inc('none', 'pending')
         return db_transaction
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail=str(e)) from e
-    finally:
-        db.close()
+
+
+async def create_transactions_bulk(db: AsyncSession, items: List[dict]) -> List[Dict[str, Any]]:
+    """Creates several transactions with a single multi-row INSERT ... RETURNING.
+
+    Each item is validated on its own and checked against the existing merchants and
+    customers, so invalid items are reported without aborting the rest of the batch.
+
+    Args:
+        db (Session): The database session.
+        items (List[dict]): The raw transaction payloads to create.
+
+    Returns:
+        List[Dict[str, Any]]: One result per item, in request order, with the created
+            transaction or the reason the item was rejected.
+    """
+    results = [{"index": index, "transaction": None, "detail": None} for index in range(len(items))]
+    valid = {}
+    for index, item in enumerate(items):
+        try:
+            valid[index] = TransactionCreate.model_validate(item)
+        except ValidationError as e:
+            results[index]["detail"] = "; ".join(
+                f"{'.'.join(str(part) for part in error['loc'])}: {error['msg']}" for error in e.errors()
+            )
+
+    if valid:
+        existing = set((await db.execute(
+            select(literal('merchant'), MerchantModel.id)
+            .where(MerchantModel.id.in_({transaction.merchant_id for transaction in valid.values()}))
+            .union_all(
+                select(literal('customer'), CustomerModel.id)
+                .where(CustomerModel.id.in_({transaction.customer_id for transaction in valid.values()}))
+            )
+        )).all())
+        for index, transaction in list(valid.items()):
+            if ('merchant', transaction.merchant_id) not in existing:
+                results[index]["detail"] = "Merchant not found"
+            elif ('customer', transaction.customer_id) not in existing:
+                results[index]["detail"] = "Customer not found"
+            else:
+                continue
+            del valid[index]
+
+    if valid:
+        try:
+            created = (await db.scalars(
+                insert(TransactionModel).returning(TransactionModel, sort_by_parameter_order=True),
+                [new_transaction_values(transaction) for transaction in valid.values()],
+            )).all()
+            await db.commit()
+        except Exception as e:
+            await db.rollback()
+            raise HTTPException(status_code=400, detail=str(e)) from e
+        STATE_TRANSITIONS.inc('none', 'pending', amount=len(created))
+        for index, db_transaction in zip(valid, created):
+            results[index]["transaction"] = db_transaction
+    return results
+
+
+def new_transaction_values(transaction: TransactionCreate) -> dict:
+    """Builds the column values of a new pending transaction.
+
+    Args:
+        transaction (TransactionCreate): The transaction to create.
+
+    Returns:
+        dict: The column values, including a freshly generated token.
+    """
+    transaction_data = transaction.model_dump()
+    transaction_data['token'] = str(uuid.uuid4())
+    transaction_data['state'] = 'pending'
+    return transaction_data
 
 
 # RETRIEVE
 
+def row_snapshot(row, exclude: Sequence[str] = ()) -> Optional[dict]:
+    """Copies the column values of a row so it can be cached outside of its session.
+
+    Args:
+        row: The ORM object, or None.
+        exclude (Sequence[str]): Columns left out of the snapshot.
+
+    Returns:
+        Optional[dict]: The column values by name, or None if there is no row.
+    """
+    if row is None:
+        return None
+    return {column.key: getattr(row, column.key) for column in row.__mapper__.column_attrs
+            if column.key not in exclude}
+
 
 ## CUSTOMER
 
-def get_customer(db: SessionLocal, customer_id: int) -> Customer:
+async def get_customer(db: AsyncSession, customer_id: int) -> Customer:
     """Retrieves a customer from the database.
 
     Args:
@@ -111,26 +235,49 @@ def get_customer(db: SessionLocal, customer_id: int) -> Customer:
     Returns:
         Customer: The customer retrieved from the database.
     """
-    return db.query(CustomerModel).filter(CustomerModel.id == customer_id).first()
+    # The lambda is analyzed once and its statement cached; later calls only bind the new customer_id,
+    # skipping the construction and cache key of the select on the hot lookups.
+    return await db.scalar(lambda_stmt(lambda: select(CustomerModel).where(CustomerModel.id == customer_id)))
 
 
-def get_customers(db: SessionLocal, skip: int = 0, limit: int = 10) -> List[Customer]:
-    """Retrieves all customers from the database.
+async def get_cached_customer(db: AsyncSession, customer_id: int) -> Optional[Snapshot]:
+    """Retrieves a customer through the customer cache.
+
+    Misses are read from the primary, so a lagging replica cannot fill the cache.
+
+    Args:
+        db (Session): The database session, used on a cache miss.
+        customer_id (int): The ID of the customer to retrieve.
+
+    Returns:
+        Optional[Snapshot]: A read-only snapshot of the customer, or None if it does not exist.
+    """
+    async def load():
+        with primary_reads(db):
+            return row_snapshot(await get_customer(db, customer_id))
+
+    return await customer_cache.get_or_load(customer_id, load)
+
+
+async def get_customers(db: AsyncSession, limit: int = DEFAULT_PAGE_SIZE,
+                        cursor: Optional[str] = None) -> Tuple[List[Row], Optional[str]]:
+    """Retrieves a page of customers from the database.
 
     Args:
         db (Session): The database session.
-        skip (int): The number of records to skip.
         limit (int): The number of records to retrieve.
+        cursor (str, optional): The cursor returned with the previous page.
 
     Returns:
-        List[Customer]: The list of customers retrieved from the database.
+        Tuple[List[Row], Optional[str]]: The customers of the page, with the columns of the Customer
+            schema, and the cursor of the next page.
     """
-    return db.query(CustomerModel).offset(skip).limit(limit).all()
+    return await paginate(db, select(*CUSTOMER_ROWS.columns(CustomerModel)), CustomerModel, limit, cursor)
 
 
 ## MERCHANT
 
-def get_merchant_by_id(db: SessionLocal, merchant_id: int) -> Merchant:
+async def get_merchant_by_id(db: AsyncSession, merchant_id: int) -> Merchant:
     """Retrieves a merchant from the database.
 
     Args:
@@ -138,28 +285,63 @@ def get_merchant_by_id(db: SessionLocal, merchant_id: int) -> Merchant:
         merchant_id (int): The ID of the merchant to retrieve.
 
     Returns:
-        Merchant: The merchant retrieved from the database.
+        Merchant: The merchant retrieved from the database, with its balance slots included in amount_account.
     """
-    return db.query(MerchantModel).filter(MerchantModel.id == merchant_id).first()
+    merchant = await db.scalar(lambda_stmt(lambda: select(MerchantModel).where(MerchantModel.id == merchant_id)))
+    await include_slots(db, [merchant])
+    return merchant
+
 
+async def get_cached_merchant(db: AsyncSession, merchant_id: int) -> Optional[Snapshot]:
+    """Retrieves a merchant through the merchant cache.
 
-def get_merchants(db: SessionLocal, skip: int = 0, limit: int = 10) -> List[Merchant]:
-    """Retrieves all merchants from the database.
+    The snapshot has no amount_account nor updated_at, which change with every
+    capture and refund. The other columns only change through update_merchant,
+    which drops the snapshot of this process at once; other workers keep theirs
+    until it expires, so for up to CACHE_TTL seconds they may still accept the
+    payments of a deactivated merchant, send its webhooks to its previous URL or
+    add to its previous balance slots, which compaction folds into its balance
+    either way. Misses are read from the primary.
+
+    Args:
+        db (Session): The database session, used on a cache miss.
+        merchant_id (int): The ID of the merchant to retrieve.
+
+    Returns:
+        Optional[Snapshot]: A read-only snapshot of the merchant, or None if it does not exist.
+    """
+    async def load():
+        with primary_reads(db):
+            merchant = await db.scalar(
+                lambda_stmt(lambda: select(MerchantModel).where(MerchantModel.id == merchant_id)))
+            return row_snapshot(merchant, exclude=MERCHANT_UNCACHED_COLUMNS)
+
+    return await merchant_cache.get_or_load(merchant_id, load)
+
+
+async def get_merchants(db: AsyncSession, limit: int = DEFAULT_PAGE_SIZE,
+                        cursor: Optional[str] = None) -> Tuple[List[Row], Optional[str]]:
+    """Retrieves a page of merchants from the database.
 
     Args:
         db (Session): The database session.
-        skip (int): The number of records to skip.
         limit (int): The number of records to retrieve.
+        cursor (str, optional): The cursor returned with the previous page.
 
     Returns:
-        List[Merchant]: The list of merchants retrieved from the database.
+        Tuple[List[Row], Optional[str]]: The merchants of the page, with the columns of the Merchant
+            schema, and the cursor of the next page.
     """
-    return db.query(MerchantModel).offset(skip).limit(limit).all()
+    balance = case((MerchantModel.balance_shards > 0, MerchantModel.amount_account + slots_total(MerchantModel.id)),
+                   else_=MerchantModel.amount_account).label("amount_account")
+    columns = [balance if column is MerchantModel.amount_account else column
+               for column in MERCHANT_ROWS.columns(MerchantModel)]
+    return await paginate(db, select(*columns), MerchantModel, limit, cursor)
 
 
 ## TRANSACTION
 
-def get_transaction_by_id(db: SessionLocal, transaction_id: int) -> Transaction:
+async def get_transaction_by_id(db: AsyncSession, transaction_id: int) -> Transaction:
     """Retrieves a transaction from the database.
 
     Args:
@@ -169,10 +351,10 @@ def get_transaction_by_id(db: SessionLocal, transaction_id: int) -> Transaction:
     Returns:
         Transaction: The transaction retrieved from the database.
     """
-    return db.query(TransactionModel).filter(TransactionModel.id == transaction_id).first()
+    return await db.scalar(select(TransactionModel).where(TransactionModel.id == transaction_id))
 
 
-def get_transaction_by_token(db: SessionLocal, token: str) -> Transaction:
+async def get_transaction_by_token(db: AsyncSession, token: str) -> Transaction:
     """Retrieves a transaction from the database by token.
 
     Args:
@@ -182,40 +364,121 @@ def get_transaction_by_token(db: SessionLocal, token: str) -> Transaction:
     Returns:
         Transaction: The transaction retrieved from the database.
     """
-    return db.query(TransactionModel).filter(TransactionModel.token == token).first()
+    return await db.scalar(lambda_stmt(lambda: select(TransactionModel).where(TransactionModel.token == token)))
 
 
-def get_transactions_by_merchant_id(db: SessionLocal, merchant_id: int) -> List[Transaction]:
-    """Retrieves all transactions associated with a merchant.
+def filter_transactions(statement: Select, state: Optional[str] = None, created_from: Optional[datetime] = None,
+                        created_to: Optional[datetime] = None) -> Select:
+    """Applies the optional listing filters to a transaction query.
+
+    Args:
+        statement (Select): The transaction query.
+        state (str, optional): Only include transactions in this state.
+        created_from (datetime, optional): Only include transactions created at or after this time.
+        created_to (datetime, optional): Only include transactions created before this time.
+
+    Returns:
+        Select: The filtered query.
+    """
+    if state is not None:
+        statement = statement.where(TransactionModel.state == state)
+    if created_from is not None:
+        statement = statement.where(TransactionModel.created_at >= created_from)
+    if created_to is not None:
+        statement = statement.where(TransactionModel.created_at < created_to)
+    return statement
+
+
+async def get_transactions_by_merchant_id(db: AsyncSession, merchant_id: int, limit: int = DEFAULT_PAGE_SIZE,
+                                          cursor: Optional[str] = None, state: Optional[str] = None,
+                                          created_from: Optional[datetime] = None,
+                                          created_to: Optional[datetime] = None
+                                          ) -> Tuple[List[Row], Optional[str]]:
+    """Retrieves a page of the transactions associated with a merchant.
 
     Args:
         db (Session): The database session.
         merchant_id (int): The ID of the merchant.
+        limit (int): The number of records to retrieve.
+        cursor (str, optional): The cursor returned with the previous page.
+        state (str, optional): Only include transactions in this state.
+        created_from (datetime, optional): Only include transactions created at or after this time.
+        created_to (datetime, optional): Only include transactions created before this time.
 
     Returns:
-        List[Transaction]: The list of transactions associated with the merchant.
+        Tuple[List[Row], Optional[str]]: The transactions of the page, with the columns of the Transaction
+            schema, and the cursor of the next page.
     """
-    return db.query(TransactionModel).filter(TransactionModel.merchant_id == merchant_id).all()
+    statement = filter_transactions(select(*TRANSACTION_ROWS.columns(TransactionModel))
+                                    .where(TransactionModel.merchant_id == merchant_id),
+                                    state, created_from, created_to)
+    return await paginate(db, statement, TransactionModel, limit, cursor)
 
 
-def get_transactions_by_customer_id(db: SessionLocal, customer_id: int) -> List[Transaction]:
-    """Retrieves all transactions associated with a customer.
+async def get_transactions_by_customer_id(db: AsyncSession, customer_id: int, limit: int = DEFAULT_PAGE_SIZE,
+                                          cursor: Optional[str] = None, state: Optional[str] = None,
+                                          created_from: Optional[datetime] = None,
+                                          created_to: Optional[datetime] = None
+                                          ) -> Tuple[List[Row], Optional[str]]:
+    """Retrieves a page of the transactions associated with a customer.
 
     Args:
         db (Session): The database session.
         customer_id (int): The ID of the customer.
+        limit (int): The number of records to retrieve.
+        cursor (str, optional): The cursor returned with the previous page.
+        state (str, optional): Only include transactions in this state.
+        created_from (datetime, optional): Only include transactions created at or after this time.
+        created_to (datetime, optional): Only include transactions created before this time.
 
     Returns:
-        List[Transaction]: The list of transactions associated with the customer.
+        Tuple[List[Row], Optional[str]]: The transactions of the page, with the columns of the Transaction
+            schema, and the cursor of the next page.
     """
-    return db.query(TransactionModel).filter(TransactionModel.customer_id == customer_id).all()
+    statement = filter_transactions(select(*TRANSACTION_ROWS.columns(TransactionModel))
+                                    .where(TransactionModel.customer_id == customer_id),
+                                    state, created_from, created_to)
+    return await paginate(db, statement, TransactionModel, limit, cursor)
+
+
+async def stream_transactions_by_merchant_id(merchant_id: int, state: Optional[str] = None,
+                                             created_from: Optional[datetime] = None,
+                                             created_to: Optional[datetime] = None,
+                                             batch_size: int = EXPORT_BATCH_SIZE) -> AsyncIterator[Sequence[Row]]:
+    """Streams every transaction of a merchant, oldest first, in batches of plain rows.
+
+    The rows come from a server-side cursor that fetches batch_size rows at a time,
+    and only the EXPORT_COLUMNS are selected, so no ORM objects are built and memory
+    does not grow with the number of transactions. The generator owns its session
+    because it keeps running after the request session has been closed, while the
+    response is being sent.
+
+    Args:
+        merchant_id (int): The ID of the merchant.
+        state (str, optional): Only include transactions in this state.
+        created_from (datetime, optional): Only include transactions created at or after this time.
+        created_to (datetime, optional): Only include transactions created before this time.
+        batch_size (int): The number of rows fetched per round trip.
+
+    Yields:
+        Sequence[Row]: The next batch of rows, with the EXPORT_COLUMNS in order.
+    """
+    statement = filter_transactions(select(*EXPORT_COLUMNS).where(TransactionModel.merchant_id == merchant_id),
+                                    state, created_from, created_to)
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(
+            statement.order_by(TransactionModel.created_at, TransactionModel.id)
+            .execution_options(yield_per=batch_size)
+        )
+        async for rows in result.partitions():
+            yield rows
 
 
 # UPDATE
 
 ## CUSTOMER
 
-def update_customer(db: SessionLocal, customer: Customer, customer_update: CustomerUpdate) -> Customer:
+async def update_customer(db: AsyncSession, customer: Customer, customer_update: CustomerUpdate) -> Customer:
     """Updates a customer in the database.
 
     Args:
@@ -226,21 +489,25 @@ def update_customer(db: SessionLocal, customer: Customer, customer_update: Custo
     Returns:
         Customer: The updated customer.
     """
-    customer_update_dict = {k: v for k, v in customer_update.dict().items() if v is not None}
+    customer_update_dict = {k: v for k, v in customer_update.model_dump().items() if v is not None}
 
     for field, value in customer_update_dict.items():
         if hasattr(customer, field):
             setattr(customer, field, value)
-    db.commit()
-    db.refresh(customer)
+    await db.commit()
+    await customer_cache.invalidate(customer.id)
+    await db.refresh(customer)
     return customer
 
 
 ## MERCHANT
 
-def update_merchant(db: SessionLocal, merchant: Merchant, merchant_update: MerchantUpdate) -> Merchant:
+async def update_merchant(db: AsyncSession, merchant: Merchant, merchant_update: MerchantUpdate) -> Merchant:
     """Updates a merchant in the database.
 
+    Setting amount_account empties the balance slots of the merchant, and a
+    positive balance_shards creates its missing slots.
+
     Args:
         db (Session): The database session.
         merchant (Merchant): The merchant to update.
@@ -249,16 +516,26 @@ def update_merchant(db: SessionLocal, merchant: Merchant, merchant_update: Merch
     Returns:
         Merchant: The updated merchant.
     """
-    merchant_update_dict = {k: v for k, v in merchant_update.dict().items() if v is not None}
+    merchant_update_dict = {k: v for k, v in merchant_update.model_dump().items() if v is not None}
     for field, value in merchant_update_dict.items():
         setattr(merchant, field, value)
-    db.commit()
-    db.refresh(merchant)
+    if "amount_account" in merchant_update_dict:
+        # The new balance replaces whatever the slots still hold.
+        await db.execute(
+            update(MerchantBalanceSlotModel)
+            .where(MerchantBalanceSlotModel.merchant_id == merchant.id)
+            .values(amount=0)
+        )
+    if merchant_update_dict.get("balance_shards"):
+        await create_slots(db, merchant.id, merchant_update_dict["balance_shards"])
+    await db.commit()
+    await merchant_cache.invalidate(merchant.id)
+    await db.refresh(merchant)
     return merchant
 
 
 ## TRANSACTION
-def update_transaction(db: SessionLocal, transaction: Transaction,
+async def update_transaction(db: AsyncSession, transaction: Transaction,
                        transaction_update: TransactionUpdate) -> Transaction:
     """Updates a transaction in the database.
 
@@ -270,11 +547,11 @@ def update_transaction(db: SessionLocal, transaction: Transaction,
     Returns:
         Transaction: The updated transaction.
     """
-    transaction_update_dict = {k: v for k, v in transaction_update.dict().items() if v is not None}
+    transaction_update_dict = {k: v for k, v in transaction_update.model_dump().items() if v is not None}
     for field, value in transaction_update_dict.items():
         setattr(transaction, field, value)
-    db.commit()
-    db.refresh(transaction)
+    await db.commit()
+    await db.refresh(transaction)
     return transaction
 
 
@@ -312,10 +589,169 @@ def merchant_validation(merchant: Merchant):
         raise HTTPException(status_code=400, detail="Merchant is not active")
 
 
-def process_transaction(db: SessionLocal, transaction_token: str, type: str) -> Transaction:
+# Source state, resulting state and sign of the merchant balance change for each operation type.
+TRANSACTION_TRANSITIONS = {
+    'capture': ('pending', 'success', 1),
+    'refund': ('pending', 'refunded', -1),
+}
+# State of the transactions whose payment is being sent to the processor, for each operation type.
+RESERVED_STATES = {
+    'capture': 'capturing',
+    'refund': 'refunding',
+}
+
+
+def claimable(type: str):
+    """Builds the condition of the transactions an operation may process.
+
+    With a payment processor, a reservation older than PAYMENT_RESERVATION_TIMEOUT
+    is claimable too: the request that made it crashed or failed to settle it.
+
+    Args:
+        type (str): The operation, capture or refund.
+
+    Returns:
+        ColumnElement: The condition on the transaction state.
+    """
+    source_state = TRANSACTION_TRANSITIONS[type][0]
+    if not processor_client.enabled:
+        return TransactionModel.state == source_state
+    return or_(TransactionModel.state == source_state,
+               and_(TransactionModel.state == RESERVED_STATES[type],
+                    TransactionModel.updated_at <= reservation_cutoff()))
+
+
+def reservation_cutoff() -> datetime:
+    return datetime.utcnow() - timedelta(seconds=PAYMENT_RESERVATION_TIMEOUT)
+
+
+async def release_reservations(db: AsyncSession, transaction_ids: List[int], type: str):
+    """Returns reserved transactions whose payment was not approved to their source state.
+
+    Args:
+        db (Session): The database session.
+        transaction_ids (List[int]): The IDs of the reserved transactions.
+        type (str): The operation, capture or refund.
+    """
+    await db.execute(
+        update(TransactionModel)
+        .where(TransactionModel.id.in_(transaction_ids), TransactionModel.state == RESERVED_STATES[type])
+        .values(state=TRANSACTION_TRANSITIONS[type][0])
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+
+
+def unprocessable(state: str, type: str) -> str:
+    """Explains why a transaction in the given state cannot be processed.
+
+    Args:
+        state (str): The current state of the transaction.
+        type (str): The operation, capture or refund.
+
+    Returns:
+        str: The reason the transaction is not processed.
+    """
+    if state == RESERVED_STATES[type]:
+        return "Transaction is being processed."
+    return "Transaction already processed."
+
+
+def balance_delta(amount, sign: int):
+    """Builds the bound amount added to a merchant balance.
+
+    Args:
+        amount (Decimal): The transaction amount.
+        sign (int): 1 to credit the merchant, -1 to debit it.
+
+    Returns:
+        BindParameter: The signed amount typed as a transaction amount.
+    """
+    return literal(sign * amount, TransactionModel.amount.type)
+
+
+def transaction_event(transaction: TransactionModel, type: str, state: str) -> dict:
+    """Builds the event announcing a transaction state change to its merchant.
+
+    The event is both the row of the webhook outbox and the message of the event streams.
+
+    Args:
+        transaction (TransactionModel): The processed transaction.
+        type (str): The operation, capture or refund.
+        state (str): The new state of the transaction.
+
+    Returns:
+        dict: The webhook event column values, with the transaction as its payload.
+    """
+    payload = TRANSACTION_ROWS.dump(transaction)
+    payload["state"] = state
+    return {"merchant_id": transaction.merchant_id, "transaction_id": transaction.id,
+            "event_type": WEBHOOK_EVENT_TYPES[type], "payload": dumps(payload).decode()}
+
+
+def transaction_rejection(transaction: TransactionModel, customer: CustomerModel,
+                          merchant: MerchantModel) -> Optional[str]:
+    """Checks whether a pending transaction can be processed.
+
+    Args:
+        transaction (TransactionModel): The transaction to process.
+        customer (CustomerModel): The customer of the transaction, or None if it does not exist.
+        merchant (MerchantModel): The merchant of the transaction, or None if it does not exist.
+
+    Returns:
+        Optional[str]: The reason the transaction must be rejected, or None if it can be processed.
+    """
+    if not customer or not customer.is_active:
+        return "Customer not found or not active."
+    if not merchant or not merchant.is_active:
+        return "Merchant not found or not active."
+    if not BankUtils.verify_hash_credit_card(transaction.hash_credit_card, customer.hash_credit_card):
+        return "Invalid credit card."
+    return None
+
+
+def processor_failure(error: ProcessorError) -> HTTPException:
+    """Builds the error returned when the processor did not approve a payment.
+
+    Args:
+        error (ProcessorError): The error of the processor client.
+
+    Returns:
+        HTTPException: 402 for a declined payment, 503 with Retry-After while the processor
+            is unavailable, 502 when it refused the call.
+    """
+    if isinstance(error, PaymentDeclined):
+        return HTTPException(status_code=402, detail=f"Payment declined: {error}")
+    if isinstance(error, ProcessorUnavailable):
+        return HTTPException(status_code=503, detail=str(error), headers={"Retry-After": "1"})
+    return HTTPException(status_code=502, detail=str(error))
+
+
+async def process_transaction(db: AsyncSession, transaction_token: str, type: str) -> Transaction:
     """
     Process a transaction.
 
+    The state change is applied first with a conditional UPDATE, which locks the
+    transaction row and makes concurrent attempts on the same token fail as already
+    processed. The customer and merchant are validated against their cached
+    snapshots, which may lag an update_merchant of another worker by up to
+    CACHE_TTL seconds. The merchant balance, or one of its balance slots when
+    the merchant is sharded, is then incremented in place, so concurrent captures
+    for the same merchant never lose updates and the cached balance is never
+    read. The state change, the balance change and its ledger entry are
+    committed together, or rolled back when a validation fails, along with the
+    webhook event of merchants that have a webhook URL. The change is then
+    published to the event streams of the merchant.
+
+    When a payment processor is configured, it is called before the balance is
+    written. The transaction is first moved to its reserved state (capturing or
+    refunding) and committed, so no row lock nor pooled connection is held while
+    the processor answers. An approved payment is then settled as above, and a
+    refused one returns the transaction to pending. If the settlement cannot be
+    committed, the transaction stays reserved, as the record of a payment the
+    processor may have made, until a retry claims it after
+    PAYMENT_RESERVATION_TIMEOUT seconds.
+
     Args:
         db: The database session.
         transaction_token: The token of the transaction.
@@ -325,51 +761,225 @@ def process_transaction(db: SessionLocal, transaction_token: str, type: str) ->
         The processed transaction.
 
     Raises:
-        HTTPException: If the transaction is not found, the customer is not found or not active,
-            the merchant is not found or not active, or the credit card is invalid.
+        HTTPException: If the transaction is not found, already processed or being processed, the
+            customer is not found or not active, the merchant is not found or not active, the credit
+            card is invalid, or the processor did not approve the payment.
     """
-    transaction = db.query(TransactionModel).filter(TransactionModel.token == transaction_token).first()
-
-    if not transaction:
-        raise HTTPException(status_code=404, detail="Transaction not found.")
-    if transaction.state != 'pending':
-        raise HTTPException(status_code=400, detail="Transaction already processed.")
+    if type not in TRANSACTION_TRANSITIONS:
+        raise HTTPException(status_code=400, detail="Invalid transaction type.")
+    source_state, target_state, sign = TRANSACTION_TRANSITIONS[type]
+    reserved_state = RESERVED_STATES[type]
+
+    transaction = await db.scalar(
+        update(TransactionModel)
+        .where(TransactionModel.token == transaction_token, claimable(type))
+        .values(state=reserved_state if processor_client.enabled else target_state)
+        .returning(TransactionModel)
+    )
+    if transaction is None:
+        state = await db.scalar(select(TransactionModel.state).where(TransactionModel.token == transaction_token))
+        await db.rollback()
+        if state is None:
+            raise HTTPException(status_code=404, detail="Transaction not found.")
+        if state == reserved_state:
+            raise HTTPException(status_code=409, detail=unprocessable(state, type))
+        raise HTTPException(status_code=400, detail=unprocessable(state, type))
+
+    customer = await get_cached_customer(db, transaction.customer_id)
+    merchant = await get_cached_merchant(db, transaction.merchant_id)
+
+    rejection = transaction_rejection(transaction, customer, merchant)
+    if rejection:
+        await db.rollback()
+        raise HTTPException(status_code=400, detail=rejection)
+    if processor_client.enabled:
+        await db.commit()
+        try:
+            await BankUtils.process_payment(transaction, type)
+        except ProcessorError as e:
+            await release_reservations(db, [transaction.id], type)
+            raise processor_failure(e) from e
+        transaction = await db.scalar(
+            update(TransactionModel)
+            .where(TransactionModel.id == transaction.id, TransactionModel.state == reserved_state)
+            .values(state=target_state)
+            .returning(TransactionModel)
+        )
+        if transaction is None:
+            # A retry claimed the reservation after it expired and settles it.
+            await db.rollback()
+            raise HTTPException(status_code=409, detail="Transaction is being processed.")
 
-    customer = get_customer(db, transaction.customer_id)
-    merchant = get_merchant_by_id(db, transaction.merchant_id)
-
-    if not customer or not customer.is_active:
-        transaction.state = 'failed'
-        raise HTTPException(status_code=400, detail="Customer not found or not active.")
-    elif not merchant or not merchant.is_active:
-        transaction.state = 'failed'
-        raise HTTPException(status_code=400, detail="Merchant not found or not active.")
-    else:
-        if BankUtils.verify_hash_credit_card(transaction.hash_credit_card, customer.hash_credit_card):
-            if type == 'capture':
-                transaction.state = 'success'
-                merchant.amount_account += transaction.amount
-            elif type == 'refund':
-                transaction.state = 'refunded'
-                merchant.amount_account -= transaction.amount
-        else:
-            raise HTTPException(status_code=400, detail="Invalid credit card.")
     try:
-        db.add(transaction)
-        db.commit()
-        db.refresh(transaction)
+        await add_to_balance(db, merchant.id, merchant.balance_shards, balance_delta(transaction.amount, sign))
+        await db.execute(insert(LedgerEntryModel).values(
+            merchant_id=merchant.id, transaction_id=transaction.id, entry_type=type,
+            amount=balance_delta(transaction.amount, sign),
+        ))
+        event = None
+        streamed = transaction_events.wants(merchant.id)
+        if merchant.webhook_url or streamed:
+            event = transaction_event(transaction, type, target_state)
+        if merchant.webhook_url:
+            await db.execute(insert(WebhookEventModel).values(**event))
+        await db.commit()
+        STATE_TRANSITIONS.inc(source_state, target_state)
+        if merchant.webhook_url:
+            webhook_dispatcher.notify()
+        if streamed:
+            transaction_events.publish([event])
         return transaction
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail=str(e)) from e
 
+
+async def process_transactions_batch(db: AsyncSession, transaction_tokens: List[str],
+                                     type: str) -> List[Dict[str, Optional[str]]]:
+    """Process several transactions in a single database transaction.
+
+    Transactions, customers and merchants are loaded with one joined query that locks
+    the transaction rows in id order. Valid transactions change state with one
+    conditional UPDATE, the balance change of each merchant is applied with a
+    single UPDATE per merchant, and the ledger entries and webhook events are
+    written with one multi-row INSERT each; the changes are then published to
+    the event streams of the merchants. When a payment processor is
+    configured, the valid transactions are first moved to their reserved state
+    and committed, then sent to it concurrently without holding any row lock nor
+    pooled connection, and only the approved ones are settled; the others return
+    to pending in the settling transaction. Tokens that cannot be processed are
+    reported without affecting the rest of the batch.
+
+    Args:
+        db (Session): The database session.
+        transaction_tokens (List[str]): The tokens of the transactions.
+        type (str): The type of the transactions.
+
+    Returns:
+        List[Dict[str, Optional[str]]]: One result per token, in request order, with the new state
+            of the transaction or the reason it was not processed.
+
+    Raises:
+        HTTPException: If the type is invalid or the batch cannot be committed.
+    """
+    if type not in TRANSACTION_TRANSITIONS:
+        raise HTTPException(status_code=400, detail="Invalid transaction type.")
+    source_state, target_state, sign = TRANSACTION_TRANSITIONS[type]
+    reserved_state = RESERVED_STATES[type]
+
+    rows = (await db.execute(
+        select(TransactionModel, CustomerModel, MerchantModel)
+        .outerjoin(CustomerModel, CustomerModel.id == TransactionModel.customer_id)
+        .outerjoin(MerchantModel, MerchantModel.id == TransactionModel.merchant_id)
+        .where(TransactionModel.token.in_(set(transaction_tokens)))
+        .order_by(TransactionModel.id)
+        .with_for_update(of=TransactionModel)
+    )).all()
+
+    cutoff = reservation_cutoff()
+    details = {}
+    candidates = {}
+    balance_shards = {}
+    webhooks = set()
+    for transaction, customer, merchant in rows:
+        expired = (processor_client.enabled and transaction.state == reserved_state
+                   and transaction.updated_at <= cutoff)
+        if transaction.state != source_state and not expired:
+            details[transaction.token] = unprocessable(transaction.state, type)
+        elif rejection := transaction_rejection(transaction, customer, merchant):
+            details[transaction.token] = rejection
+        else:
+            candidates[transaction.id] = transaction
+            balance_shards[merchant.id] = merchant.balance_shards
+            if merchant.webhook_url:
+                webhooks.add(merchant.id)
+
+    claimed_state = source_state
+    if processor_client.enabled and candidates:
+        # The rows are locked, so every candidate is reserved; the commit releases the locks and the
+        # connection before the processor is called.
+        claimed_state = reserved_state
+        await db.execute(
+            update(TransactionModel)
+            .where(TransactionModel.id.in_(candidates))
+            .values(state=reserved_state)
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+        # Sent concurrently, the payments are coalesced into processor batch calls.
+        outcomes = await asyncio.gather(*(BankUtils.process_payment(transaction, type)
+                                          for transaction in candidates.values()), return_exceptions=True)
+        refused = []
+        for transaction, outcome in zip(list(candidates.values()), outcomes):
+            if isinstance(outcome, BaseException):
+                # Only the failed payment is released: the approved ones of the batch are settled.
+                if not isinstance(outcome, ProcessorError):
+                    outcome = ProcessorError(f"Payment processor call failed: {outcome!r}")
+                details[transaction.token] = processor_failure(outcome).detail
+                refused.append(transaction.id)
+                del candidates[transaction.id]
+        if refused:
+            await db.execute(
+                update(TransactionModel)
+                .where(TransactionModel.id.in_(refused), TransactionModel.state == reserved_state)
+                .values(state=source_state)
+                .execution_options(synchronize_session=False)
+            )
+
     try:
-        db.add(merchant)
-        db.commit()
-        db.refresh(merchant)
+        processed = set()
+        if candidates:
+            processed = set((await db.scalars(
+                update(TransactionModel)
+                .where(TransactionModel.id.in_(candidates), TransactionModel.state == claimed_state)
+                .values(state=target_state)
+                .returning(TransactionModel.token)
+                .execution_options(synchronize_session=False)
+            )).all())
+
+        deltas = defaultdict(int)
+        entries = []
+        events = []
+        streamed = []
+        for transaction in candidates.values():
+            if transaction.token in processed:
+                deltas[transaction.merchant_id] += transaction.amount
+                entries.append({"merchant_id": transaction.merchant_id, "transaction_id": transaction.id,
+                                "entry_type": type, "amount": sign * transaction.amount})
+                webhook = transaction.merchant_id in webhooks
+                stream = transaction_events.wants(transaction.merchant_id)
+                if webhook or stream:
+                    event = transaction_event(transaction, type, target_state)
+                    if webhook:
+                        events.append(event)
+                    if stream:
+                        streamed.append(event)
+            else:
+                details[transaction.token] = "Transaction already processed."
+        for merchant_id in sorted(deltas):
+            await add_to_balance(db, merchant_id, balance_shards[merchant_id],
+                                 balance_delta(deltas[merchant_id], sign))
+        if entries:
+            await db.execute(insert(LedgerEntryModel), entries)
+        if events:
+            await db.execute(insert(WebhookEventModel), events)
+        await db.commit()
+        STATE_TRANSITIONS.inc(source_state, target_state, amount=len(processed))
+        if events:
+            webhook_dispatcher.notify()
+        transaction_events.publish(streamed)
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail=str(e)) from e
-    finally:
-        db.close()
-    return transaction
+
+    results = []
+    seen = set()
+    for token in transaction_tokens:
+        if token in seen:
+            results.append({"token": token, "state": None, "detail": "Duplicate token in batch."})
+        elif token in processed:
+            results.append({"token": token, "state": target_state, "detail": None})
+        else:
+            results.append({"token": token, "state": None, "detail": details.get(token, "Transaction not found.")})
+        seen.add(token)
+    return results
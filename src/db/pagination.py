@@ -0,0 +1,74 @@
+import base64
+import json
+import os
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import Select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE") or 10)
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE") or 500)
+
+
+def encode_cursor(created_at: datetime, id: int) -> str:
+    """Encodes the position of a row as an opaque cursor.
+
+    Args:
+        created_at (datetime): The creation timestamp of the last row of a page.
+        id (int): The ID of the last row of a page.
+
+    Returns:
+        str: The URL-safe cursor.
+    """
+    position = json.dumps([created_at.isoformat(), id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(position.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Decodes a cursor created by encode_cursor.
+
+    Args:
+        cursor (str): The opaque cursor.
+
+    Returns:
+        Tuple[datetime, int]: The creation timestamp and ID of the last row of the previous page.
+
+    Raises:
+        HTTPException: If the cursor is malformed.
+    """
+    try:
+        created_at, id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(created_at), int(id)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail="Invalid cursor.") from e
+
+
+async def paginate(db: AsyncSession, statement: Select, model, limit: int = DEFAULT_PAGE_SIZE,
+                   cursor: Optional[str] = None) -> Tuple[List, Optional[str]]:
+    """Retrieves one page of a query, newest first, with keyset pagination on (created_at, id).
+
+    Unlike OFFSET, the cost of a page does not grow with its position: the cursor is
+    turned into a range condition the (created_at, id) ordering can seek to.
+
+    Args:
+        db (Session): The database session.
+        statement (Select): The query selecting columns of the model, including created_at and id,
+            with its filters applied.
+        model: The model class being listed. It must have created_at and id columns.
+        limit (int): The maximum number of rows in the page.
+        cursor (str, optional): The cursor returned with the previous page.
+
+    Returns:
+        Tuple[List, Optional[str]]: The rows of the page and the cursor of the next page,
+            or None if this is the last page.
+    """
+    if cursor:
+        statement = statement.where(tuple_(model.created_at, model.id) < tuple_(*decode_cursor(cursor)))
+    statement = statement.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1)
+    rows = (await db.execute(statement)).all()
+    if len(rows) <= limit:
+        return rows, None
+    last = rows[limit - 1]
+    return rows[:limit], encode_cursor(last.created_at, last.id)
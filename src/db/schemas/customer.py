@@ -1,4 +1,4 @@
-from pydantic import BaseModel, EmailStr, Field
+from pydantic import BaseModel, ConfigDict, EmailStr, Field
 from typing import Optional
 from datetime import datetime
 
@@ -60,11 +60,10 @@ class Customer(CustomerBase):
         updated_at (datetime, optional): The timestamp when the customer was last updated.
 
     Attributes:
-        Config (class): Configuration options for the customer schema.
+        model_config (ConfigDict): Reads the fields from the attributes of ORM objects.
     """
     id: int
     created_at: datetime
     updated_at: Optional[datetime] = None
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
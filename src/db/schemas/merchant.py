@@ -1,7 +1,14 @@
-from pydantic import BaseModel, EmailStr, Field
+import os
+
+from pydantic import BaseModel, ConfigDict, EmailStr, Field, condecimal
+from decimal import Decimal
 from typing import Optional
 from datetime import datetime
 
+BALANCE_SHARDS_MAX = int(os.getenv("BALANCE_SHARDS_MAX") or 64)
+# An http(s) URL, or empty to remove the endpoint.
+WEBHOOK_URL_PATTERN = r"^(https?://\S+)?$"
+
 
 class MerchantBase(BaseModel):
     """Base model for a merchant.
@@ -10,15 +17,16 @@ class MerchantBase(BaseModel):
         name (str): The name of the merchant.
         email (EmailStr): The email address of the merchant.
         is_active (bool, optional): Indicates if the merchant is active.
-        amount_account (int): The amount in the merchant's account.
-
-    Attributes:
-        Config (class): Configuration options for the merchant schema.
+        amount_account (Decimal): The amount in the merchant's account.
+        webhook_url (str, optional): The endpoint receiving the transaction state changes of the merchant.
     """
     name: str = Field(..., description="The name of the merchant.")
     email: EmailStr = Field(..., description="The email address of the merchant.")
     is_active: Optional[bool] = Field(True, description="Indicates if the merchant is active.")
-    amount_account: int = Field(..., description="The amount in the merchant's account.", ge=0)
+    amount_account: condecimal(max_digits=14, decimal_places=2) = Field(
+        ..., description="The amount in the merchant's account.", ge=0)
+    webhook_url: Optional[str] = Field(None, max_length=2048, pattern=WEBHOOK_URL_PATTERN,
+                                       description="The endpoint receiving the transaction state changes.")
 
 
 class MerchantCreate(MerchantBase):
@@ -31,7 +39,7 @@ class MerchantCreate(MerchantBase):
         name (str): The name of the merchant.
         email (EmailStr): The email address of the merchant.
         is_active (bool, optional): Indicates if the merchant is active.
-        amount_account (int): The amount in the merchant's account.
+        amount_account (Decimal): The amount in the merchant's account.
 
     """
     authentication_key: str = Field(..., description="The authentication key of the merchant.")
@@ -44,16 +52,21 @@ class MerchantUpdate(BaseModel):
         name (str, optional): The updated name of the merchant.
         email (EmailStr, optional): The updated email address of the merchant.
         is_active (bool, optional): The updated active status of the merchant.
-        amount_account (int, optional): The updated amount in the merchant's account.
-
-    Attributes:
-        Config (class): Configuration options for the merchant update schema.
+        amount_account (Decimal, optional): The updated amount in the merchant's account.
+        balance_shards (int, optional): The number of balance slots receiving the balance changes,
+            0 to stop sharding.
+        webhook_url (str, optional): The updated webhook endpoint, an empty string to stop the webhooks.
     """
     name: Optional[str] = Field(None, description="The name of the merchant.")
     email: Optional[EmailStr] = Field(None, description="The email address of the merchant.")
     is_active: Optional[bool] = Field(None, description="Indicates if the merchant is active.")
-    amount_account: Optional[int] = Field(None, description="The amount in the merchant's account.", ge=0)
+    amount_account: Optional[condecimal(max_digits=14, decimal_places=2)] = Field(
+        None, description="The amount in the merchant's account.", ge=0)
     authentication_key: Optional[str] = Field(None, description="The authentication key of the merchant.")
+    balance_shards: Optional[int] = Field(None, description="The number of balance slots of the merchant.",
+                                          ge=0, le=BALANCE_SHARDS_MAX)
+    webhook_url: Optional[str] = Field(None, max_length=2048, pattern=WEBHOOK_URL_PATTERN,
+                                       description="The endpoint receiving the transaction state changes.")
 
 
 class Merchant(MerchantBase):
@@ -61,15 +74,29 @@ class Merchant(MerchantBase):
 
     Args:
         id (int): The unique identifier of the merchant.
+        balance_shards (int): The number of balance slots receiving the balance changes.
         created_at (datetime): The timestamp when the merchant was created.
         updated_at (datetime, optional): The timestamp when the merchant was last updated.
 
     Attributes:
-        Config (class): Configuration options for the merchant schema.
+        model_config (ConfigDict): Reads the fields from the attributes of ORM objects.
     """
     id: int
+    balance_shards: int = 0
     created_at: datetime
     updated_at: Optional[datetime] = None
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+
+class MerchantBalance(BaseModel):
+    """Represents a merchant balance computed from the ledger.
+
+    Args:
+        merchant_id (int): The ID of the merchant.
+        balance (Decimal): The balance of the merchant.
+        as_of (datetime, optional): The time of the balance, None for the current balance.
+    """
+    merchant_id: int
+    balance: Decimal
+    as_of: Optional[datetime] = None
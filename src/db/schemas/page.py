@@ -0,0 +1,16 @@
+from typing import Generic, List, Optional, TypeVar
+
+from pydantic import BaseModel, Field
+
+T = TypeVar("T")
+
+
+class Page(BaseModel, Generic[T]):
+    """Represents one page of a listing.
+
+    Args:
+        items (List[T]): The items of the page, newest first.
+        next_cursor (str, optional): The cursor to request the next page, or None on the last page.
+    """
+    items: List[T]
+    next_cursor: Optional[str] = Field(None, description="The cursor to request the next page.")
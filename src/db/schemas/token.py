@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from datetime import datetime
 from typing import Optional
 
@@ -23,10 +23,9 @@ class TokenResponse(TokenBase):
             Defaults to None.
 
     Config:
-        orm_mode (bool): Enables ORM mode for the schema.
+        from_attributes (bool): Reads the fields from the attributes of ORM objects.
     """
     created_at: datetime
     updated_at: Optional[datetime] = None
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
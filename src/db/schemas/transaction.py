@@ -1,7 +1,12 @@
-from pydantic import BaseModel, condecimal, Field
-from typing import Optional
+import os
+
+from pydantic import BaseModel, ConfigDict, condecimal, Field
+from typing import Any, Dict, List, Optional
 from datetime import datetime
 
+TRANSACTION_BATCH_MAX_SIZE = int(os.getenv("TRANSACTION_BATCH_MAX_SIZE") or 1000)
+TRANSACTION_BULK_MAX_SIZE = int(os.getenv("TRANSACTION_BULK_MAX_SIZE") or 1000)
+
 
 class TransactionBase(BaseModel):
     """Base model for a transaction.
@@ -61,7 +66,7 @@ class Transaction(BaseModel):
         updated_at (datetime, optional): The timestamp when the transaction was last updated.
 
     Attributes:
-        Config (class): Configuration options for the transaction schema.
+        model_config (ConfigDict): Reads the fields from the attributes of ORM objects.
     """
     id: int
     merchant_id: int
@@ -74,5 +79,53 @@ class Transaction(BaseModel):
     created_at: datetime
     updated_at: Optional[datetime] = None
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+
+class TransactionBatchRequest(BaseModel):
+    """Represents a request to capture or refund several transactions at once.
+
+    Args:
+        tokens (List[str]): The tokens of the transactions to process.
+    """
+    tokens: List[str] = Field(..., min_length=1, max_length=TRANSACTION_BATCH_MAX_SIZE,
+                              description="The tokens of the transactions to process.")
+
+
+class TransactionBatchResult(BaseModel):
+    """Represents the outcome of one token of a batch request.
+
+    Args:
+        token (str): The token of the transaction.
+        state (str, optional): The new state of the transaction, if it was processed.
+        detail (str, optional): The reason the transaction was not processed.
+    """
+    token: str
+    state: Optional[str] = None
+    detail: Optional[str] = None
+
+
+class TransactionBulkRequest(BaseModel):
+    """Represents a request to create several transactions at once.
+
+    Items are validated one by one when processed, so a malformed item does not
+    reject the whole request.
+
+    Args:
+        items (List[Dict[str, Any]]): The transactions to create, each shaped like TransactionCreate.
+    """
+    items: List[Dict[str, Any]] = Field(..., min_length=1, max_length=TRANSACTION_BULK_MAX_SIZE,
+                                        description="The transactions to create.")
+
+
+class TransactionBulkResult(BaseModel):
+    """Represents the outcome of one item of a bulk creation request.
+
+    Args:
+        index (int): The position of the item in the request.
+        transaction (Transaction, optional): The created transaction.
+        detail (str, optional): The reason the item was rejected.
+    """
+    index: int
+    transaction: Optional[Transaction] = None
+    detail: Optional[str] = None
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from datetime import datetime
 from typing import Optional
 
@@ -32,13 +32,12 @@ class UserResponse(UserBase):
             Defaults to None.
 
     Config:
-        orm_mode (bool): Enables ORM mode for the schema.
+        from_attributes (bool): Reads the fields from the attributes of ORM objects.
     """
     created_at: datetime
     updated_at: Optional[datetime] = None
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class UserUpdate(BaseModel):
@@ -51,10 +50,9 @@ class UserUpdate(BaseModel):
             Defaults to None.
 
     Config:
-        orm_mode (bool): Enables ORM mode for the schema.
+        from_attributes (bool): Reads the fields from the attributes of ORM objects.
     """
     username: Optional[str] = None
     password: Optional[str] = None
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
@@ -1,9 +1,10 @@
 import os
-from typing import Annotated
+from typing import Annotated, Optional, Tuple
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
 from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from starlette import status
 from passlib.context import CryptContext
@@ -11,23 +12,17 @@ from jose import JWTError, jwt
 from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 
-from src.db.connection import SessionLocal
+from src.db.connection import get_db
 from src.db.schemas.user import UserResponse, UserCreate, UserUpdate
 from src.db.schemas.token import TokenResponse
 from src.db.models.user import User as UserModel, User
 from src.db.models.token import Token as TokenModel
+from src.utils.hashing import HashingPoolSaturated, PasswordHasher
+from src.utils.token_cache import TokenCache
 
 load_dotenv()
 
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
 router = APIRouter(
     prefix="/api/v1",
     tags=["auth"],
@@ -37,7 +32,6 @@ router = APIRouter(
         500: {"description": "Internal Server Error"},
         400: {"description": "Bad Request"}
     },
-    dependencies=[Depends(get_db)],
 )
 
 SECRET_KEY = os.getenv("SECRET_KEY") or "thisisavery"  # change this to a more secure key
@@ -46,9 +40,42 @@ ACCESS_TOKEN_EXPIRE_MINUTES = 720  # 12 hours
 
 bcrypt_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_bearer = OAuth2PasswordBearer(tokenUrl="token")
+token_cache = TokenCache(lambda token: jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM]))
+password_hasher = PasswordHasher(bcrypt_context)
+
+
+def password_pool_busy() -> HTTPException:
+    """Builds the error returned when the password hashing pool is saturated.
+
+    Returns:
+        HTTPException: A 503 error asking the client to retry shortly.
+    """
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many password operations in progress, try again later.",
+        headers={"Retry-After": "1"},
+    )
 
 
-def authenticate_user(username: str, password: str, db: Session):
+async def hash_password(password: str) -> str:
+    """Hash a password on the password worker pool.
+
+    Args:
+        password (str): The plain password.
+
+    Returns:
+        str: The password hash.
+
+    Raises:
+        HTTPException: If the password worker pool is saturated.
+    """
+    try:
+        return await password_hasher.hash(password)
+    except HashingPoolSaturated as e:
+        raise password_pool_busy() from e
+
+
+async def authenticate_user(username: str, password: str, db: AsyncSession):
     """Authenticate a user.
 
     Args:
@@ -58,12 +85,18 @@ def authenticate_user(username: str, password: str, db: Session):
 
     Returns:
         Union[UserModel, bool]: The authenticated user if successful, False otherwise.
+
+    Raises:
+        HTTPException: If the password worker pool is saturated.
     """
-    user = db.query(UserModel).filter(UserModel.username == username).first()
+    user = await db.scalar(select(UserModel).where(UserModel.username == username))
     if not user:
         return False
-    if not bcrypt_context.verify(password, user.password):
-        return False
+    try:
+        if not await password_hasher.verify(password, user.password):
+            return False
+    except HashingPoolSaturated as e:
+        raise password_pool_busy() from e
     return user
 
 
@@ -83,9 +116,39 @@ def create_access_token(data: dict):
     return encoded_jwt
 
 
+def bearer_identity(request: Request) -> Tuple[Optional[str], Optional[int]]:
+    """Reads the bearer token of a request and the user id it was issued to.
+
+    Authenticated routes have already verified the token, so outside of the first
+    request of a token this is a cache hit. The identity is kept in the request
+    state, so the middlewares of a request read the token once.
+
+    Args:
+        request (Request): The incoming request.
+
+    Returns:
+        Tuple[Optional[str], Optional[int]]: The bearer token and the user id, None when absent or invalid.
+    """
+    identity = getattr(request.state, "bearer_identity", None)
+    if identity is not None:
+        return identity
+    bearer_token = None
+    user_id = None
+    authorization = request.headers.get("Authorization")
+    if authorization:
+        _, _, bearer_token = authorization.partition(" ")
+    if bearer_token:
+        try:
+            user_id = token_cache.claims(bearer_token).get("id")
+        except JWTError:
+            pass
+    request.state.bearer_identity = (bearer_token or None, user_id)
+    return request.state.bearer_identity
+
+
 async def get_current_user(token: Annotated[str, Depends(oauth2_bearer)]):
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = token_cache.claims(token)
         username: str = payload.get("sub")
         user_id: int = payload.get("id")
         if username is None or user_id is None:
@@ -103,7 +166,7 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_bearer)]):
 
 
 @router.post("/auth", status_code=status.HTTP_201_CREATED, response_model=UserResponse)
-async def create_user(user: UserCreate, db: Session = Depends(get_db)):
+async def create_user(user: UserCreate, db: AsyncSession = Depends(get_db)):
     """Create a new user.
 
     Args:
@@ -111,14 +174,15 @@ async def create_user(user: UserCreate, db: Session = Depends(get_db)):
     Returns:
         UserResponse: The created user.
     """
+    password = await hash_password(user.password)
     try:
         db_user = UserModel(
             username=user.username,
-            password=bcrypt_context.hash(user.password)
+            password=password
         )
         db.add(db_user)
-        db.commit()
-        db.refresh(db_user)
+        await db.commit()
+        await db.refresh(db_user)
         return db_user
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e)) from e
@@ -127,7 +191,7 @@ async def create_user(user: UserCreate, db: Session = Depends(get_db)):
 @router.put("/auth/{user_id}", response_model=UserResponse)
 async def update_user(user_id: int, user: UserUpdate,
                       current_user: User = Depends(get_current_user),
-                      db: Session = Depends(get_db)):
+                      db: AsyncSession = Depends(get_db)):
     """Update a user.
 
     Args:
@@ -136,29 +200,28 @@ async def update_user(user_id: int, user: UserUpdate,
     Returns:
         UserResponse: The updated user.
     """
+    password = await hash_password(user.password)
     try:
-        db_user = db.query(UserModel).filter(UserModel.id == user_id).first()
+        db_user = await db.scalar(select(UserModel).where(UserModel.id == user_id))
         if not db_user:
             raise HTTPException(status_code=404, detail="User not found")
         db_user.username = user.username
-        db_user.password = bcrypt_context.hash(user.password)
-        db.commit()
-        db.refresh(db_user)
+        db_user.password = password
+        await db.commit()
+        await db.refresh(db_user)
         return db_user
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e)) from e
-    finally:
-        db.close()
 
 
 @router.get("/auth/me", response_model=UserResponse)
 async def user_me(
         current_user: Annotated[dict, Depends(get_current_user)],
-        db: Session = Depends(get_db)):
+        db: AsyncSession = Depends(get_db)):
     if (
-            user := db.query(UserModel)
-                    .filter(UserModel.id == current_user["id"])
-                    .first()
+            user := await db.scalar(
+                select(UserModel).where(UserModel.id == current_user["id"])
+            )
     ):
         return user
     else:
@@ -166,7 +229,8 @@ async def user_me(
 
 
 @router.post("/token", response_model=TokenResponse)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(),
+                                 db: AsyncSession = Depends(get_db)):
     """Login to get an access token.
 
     Args:
@@ -174,7 +238,9 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     Returns:
         TokenResponse: The access token.
     """
-    user = authenticate_user(form_data.username, form_data.password, db)
+    if password_hasher.saturated():
+        raise password_pool_busy()
+    user = await authenticate_user(form_data.username, form_data.password, db)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -189,10 +255,8 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
             user_id=user.id
         )
         db.add(db_token)
-        db.commit()
-        db.refresh(db_token)
+        await db.commit()
+        await db.refresh(db_token)
         return db_token
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e)) from e
-    finally:
-        db.close()
@@ -1,27 +1,27 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from datetime import datetime
+from typing import Optional
 
-from src.db.connection import SessionLocal
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.db.connection import get_db
 from src.db.models.user import User
+from src.db.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from src.db.schemas.page import Page
+from src.db.schemas.transaction import Transaction
 from src.db.schemas.customer import Customer, CustomerCreate, CustomerUpdate
-from src.db.operations import (get_customer,
+from src.db.operations import (get_cached_customer, get_customer,
                                create_customer as create,
                                update_customer as update,
                                get_customers,
-                               customer_validation
+                               get_transactions_by_customer_id,
+                               customer_validation,
+                               CUSTOMER_ROWS,
+                               TRANSACTION_ROWS
                                )
 from src.routes.auth import get_current_user
 
 
-# Dependency
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
 router = APIRouter(
     prefix="/api/v1/customer",
     tags=["customers"],
@@ -30,24 +30,53 @@ router = APIRouter(
         500: {"description": "Internal Server Error"},
         400: {"description": "Bad Request"}
     },
-    dependencies=[Depends(get_db)],
 )
 
 
-@router.get("/", response_model=list[Customer])
-async def read_customers(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    """Retrieve a list of customers.
+@router.get("/", response_model=Page[Customer])
+async def read_customers(limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                         cursor: Optional[str] = None,
+                         current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """Retrieve a page of customers, newest first.
 
+    Args:
+        limit (int): The maximum number of customers in the page.
+        cursor (str, optional): The cursor returned with the previous page.
+    Returns:
+        Page[Customer]: The customers of the page and the cursor of the next one.
+    """
+    items, next_cursor = await get_customers(db, limit, cursor)
+    return CUSTOMER_ROWS.page(items, next_cursor)
+
+
+@router.get("/{customer_id}/transactions", response_model=Page[Transaction])
+async def read_customer_transactions(customer_id: int, state: Optional[str] = None,
+                                     created_from: Optional[datetime] = None, created_to: Optional[datetime] = None,
+                                     limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                                     cursor: Optional[str] = None,
+                                     current_user: User = Depends(get_current_user),
+                                     db: AsyncSession = Depends(get_db)):
+    """Retrieve a page of the transactions of a customer, newest first.
+
+    Args:
+        customer_id (int): The ID of the customer.
+        state (str, optional): Only include transactions in this state.
+        created_from (datetime, optional): Only include transactions created at or after this time.
+        created_to (datetime, optional): Only include transactions created before this time.
+        limit (int): The maximum number of transactions in the page.
+        cursor (str, optional): The cursor returned with the previous page.
     Returns:
-        List[Customer]: A list of customer objects.
+        Page[Transaction]: The transactions of the page and the cursor of the next one.
     """
-    return get_customers(db)
+    items, next_cursor = await get_transactions_by_customer_id(db, customer_id, limit, cursor, state,
+                                                              created_from, created_to)
+    return TRANSACTION_ROWS.page(items, next_cursor)
 
 
 @router.get("/{customer_id}")
 async def read_customer(customer_id: int,
                         current_user: User = Depends(get_current_user),
-                        db: Session = Depends(get_db)):
+                        db: AsyncSession = Depends(get_db)):
     """Retrieve a customer by ID.
 
     Args:
@@ -58,7 +87,7 @@ async def read_customer(customer_id: int,
     Returns:
         Customer: The customer object.
     """
-    customer = get_customer(db, customer_id)
+    customer = await get_cached_customer(db, customer_id)
     validations = customer_validation(customer)
     if validations:
         raise HTTPException(status_code=400, detail=validations)
@@ -68,7 +97,7 @@ async def read_customer(customer_id: int,
 @router.put("/{customer_id}")
 async def update_customer(customer_id: int, customer: CustomerUpdate,
                           current_user: User = Depends(get_current_user),
-                          db: Session = Depends(get_db)):
+                          db: AsyncSession = Depends(get_db)):
     """Update a customer.
 
     Args:
@@ -78,15 +107,15 @@ async def update_customer(customer_id: int, customer: CustomerUpdate,
     Returns:
         Customer: The updated customer object.
     """
-    customer_old = get_customer(db, customer_id)
+    customer_old = await get_customer(db, customer_id)
     if not customer_old:
         raise HTTPException(status_code=404, detail="Customer not found")
-    return update(db, customer_old, customer)
+    return await update(db, customer_old, customer)
 
 
 @router.post("/")
 async def create_customer(customer: CustomerCreate, current_user: User = Depends(get_current_user),
-                          db: Session = Depends(get_db)):
+                          db: AsyncSession = Depends(get_db)):
     """Create a new customer.
 
     Args:
@@ -95,4 +124,4 @@ async def create_customer(customer: CustomerCreate, current_user: User = Depends
     Returns:
         Customer: The created customer object.
     """
-    return create(db, customer)
+    return await create(db, customer)
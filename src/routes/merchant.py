@@ -1,24 +1,31 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from datetime import datetime, timezone
+from typing import Literal, Optional
 
-from src.db.connection import SessionLocal
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.db.connection import get_db
 from src.db.models.user import User
-from src.db.schemas.merchant import Merchant, MerchantCreate, MerchantUpdate
-from src.db.operations import (get_merchant_by_id,
+from src.db.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from src.db.schemas.page import Page
+from src.db.schemas.transaction import Transaction
+from src.db.ledger import merchant_balance
+from src.db.schemas.merchant import Merchant, MerchantBalance, MerchantCreate, MerchantUpdate
+from src.db.operations import (get_cached_merchant, get_merchant_by_id,
                                create_merchant as create,
                                update_merchant as update,
                                get_merchants,
-                               merchant_validation
+                               get_transactions_by_merchant_id,
+                               stream_transactions_by_merchant_id,
+                               merchant_validation,
+                               EXPORT_COLUMNS,
+                               MERCHANT_ROWS,
+                               TRANSACTION_ROWS
                                )
 from src.routes.auth import get_current_user
-
-
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+from src.utils.event_stream import transaction_events
+from src.utils.export import EXPORT_ENCODERS, EXPORT_MEDIA_TYPES
 
 
 router = APIRouter(
@@ -29,23 +36,133 @@ router = APIRouter(
         500: {"description": "Internal Server Error"},
         400: {"description": "Bad Request"}
     },
-    dependencies=[Depends(get_db)],
 )
 
 
-@router.get("/", response_model=list[Merchant])
-async def read_merchants(current_user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    """Retrieve a list of merchants.
+@router.get("/", response_model=Page[Merchant])
+async def read_merchants(limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                         cursor: Optional[str] = None,
+                         current_user: User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """Retrieve a page of merchants, newest first.
+
+    Args:
+        limit (int): The maximum number of merchants in the page.
+        cursor (str, optional): The cursor returned with the previous page.
+    Returns:
+        Page[Merchant]: The merchants of the page and the cursor of the next one.
+    """
+    items, next_cursor = await get_merchants(db, limit, cursor)
+    return MERCHANT_ROWS.page(items, next_cursor)
+
+
+@router.get("/{merchant_id}/transactions", response_model=Page[Transaction])
+async def read_merchant_transactions(merchant_id: int, state: Optional[str] = None,
+                                     created_from: Optional[datetime] = None, created_to: Optional[datetime] = None,
+                                     limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+                                     cursor: Optional[str] = None,
+                                     current_user: User = Depends(get_current_user),
+                                     db: AsyncSession = Depends(get_db)):
+    """Retrieve a page of the transactions of a merchant, newest first.
+
+    Args:
+        merchant_id (int): The ID of the merchant.
+        state (str, optional): Only include transactions in this state.
+        created_from (datetime, optional): Only include transactions created at or after this time.
+        created_to (datetime, optional): Only include transactions created before this time.
+        limit (int): The maximum number of transactions in the page.
+        cursor (str, optional): The cursor returned with the previous page.
+    Returns:
+        Page[Transaction]: The transactions of the page and the cursor of the next one.
+    """
+    items, next_cursor = await get_transactions_by_merchant_id(db, merchant_id, limit, cursor, state,
+                                                              created_from, created_to)
+    return TRANSACTION_ROWS.page(items, next_cursor)
+
+
+@router.get("/{merchant_id}/balance", response_model=MerchantBalance)
+async def read_merchant_balance(merchant_id: int, as_of: Optional[datetime] = None,
+                                current_user: User = Depends(get_current_user),
+                                db: AsyncSession = Depends(get_db)):
+    """Retrieve the balance of a merchant from its ledger, now or at a point in time.
+
+    Args:
+        merchant_id (int): The ID of the merchant.
+        as_of (datetime, optional): Compute the balance at this time, in UTC when it has no timezone.
+    Raises:
+        HTTPException: If the merchant is not found.
+    Returns:
+        MerchantBalance: The balance of the merchant.
+    """
+    if await get_cached_merchant(db, merchant_id) is None:
+        raise HTTPException(status_code=404, detail="Merchant not found")
+    if as_of is not None and as_of.tzinfo is not None:
+        # The ledger stores naive UTC times.
+        as_of = as_of.astimezone(timezone.utc).replace(tzinfo=None)
+    return {"merchant_id": merchant_id, "balance": await merchant_balance(db, merchant_id, as_of), "as_of": as_of}
+
+
+@router.get("/{merchant_id}/transactions/export", response_class=StreamingResponse)
+async def export_merchant_transactions(merchant_id: int, format: Literal["csv", "ndjson"] = "csv",
+                                       state: Optional[str] = None, created_from: Optional[datetime] = None,
+                                       created_to: Optional[datetime] = None,
+                                       current_user: User = Depends(get_current_user),
+                                       db: AsyncSession = Depends(get_db)):
+    """Download every transaction of a merchant, oldest first.
+
+    The rows are streamed from the database and encoded batch by batch, so the
+    export is sent as a chunked response without being held in memory.
+
+    Args:
+        merchant_id (int): The ID of the merchant.
+        format (str): Either "csv" or "ndjson".
+        state (str, optional): Only include transactions in this state.
+        created_from (datetime, optional): Only include transactions created at or after this time.
+        created_to (datetime, optional): Only include transactions created before this time.
+    Raises:
+        HTTPException: If the merchant is not found.
+    Returns:
+        StreamingResponse: The transactions in the requested format.
+    """
+    if await get_cached_merchant(db, merchant_id) is None:
+        raise HTTPException(status_code=404, detail="Merchant not found")
+    batches = stream_transactions_by_merchant_id(merchant_id, state, created_from, created_to)
+    return StreamingResponse(
+        EXPORT_ENCODERS[format]([column.key for column in EXPORT_COLUMNS], batches),
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="merchant-{merchant_id}-transactions.{format}"'},
+    )
+
+
+@router.get("/{merchant_id}/events", response_class=StreamingResponse)
+async def stream_merchant_events(merchant_id: int, current_user: User = Depends(get_current_user),
+                                 db: AsyncSession = Depends(get_db)):
+    """Stream the state changes of the transactions of a merchant as Server-Sent Events.
 
+    Each capture or refund is sent as a "transaction.captured" or
+    "transaction.refunded" event whose data is the transaction. The stream only
+    carries the changes made while it is open; clients reconcile with the
+    transactions listing after reconnecting.
+
+    Args:
+        merchant_id (int): The ID of the merchant.
+    Raises:
+        HTTPException: If the merchant is not found, or the worker has too many streams open.
     Returns:
-        List[Merchant]: A list of merchant objects.
+        StreamingResponse: The text/event-stream of the merchant.
     """
-    return get_merchants(db)
+    if await get_cached_merchant(db, merchant_id) is None:
+        raise HTTPException(status_code=404, detail="Merchant not found")
+    subscription = transaction_events.subscribe(merchant_id)
+    if subscription is None:
+        raise HTTPException(status_code=503, detail="Too many event streams open, retry later.",
+                            headers={"Retry-After": "1"})
+    return StreamingResponse(transaction_events.stream(subscription), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @router.get("/{merchant_id}")
 async def read_merchant(merchant_id: int, current_user: User = Depends(get_current_user),
-                        db: Session = Depends(get_db)):
+                        db: AsyncSession = Depends(get_db)):
     """Retrieve a merchant by ID.
 
     Args:
@@ -56,7 +173,8 @@ async def read_merchant(merchant_id: int, current_user: User = Depends(get_curre
     Returns:
         Merchant: The merchant object.
     """
-    merchant = get_merchant_by_id(db, merchant_id)
+    # Read from the database rather than the cache, whose snapshots have no balance.
+    merchant = await get_merchant_by_id(db, merchant_id)
     validations = merchant_validation(merchant)
     if validations:
         raise HTTPException(status_code=400, detail=validations)
@@ -66,7 +184,7 @@ async def read_merchant(merchant_id: int, current_user: User = Depends(get_curre
 
 @router.post("/", response_model=Merchant)
 async def create_merchant(merchant: MerchantCreate, current_user: User = Depends(get_current_user),
-                          db: Session = Depends(get_db)):
+                          db: AsyncSession = Depends(get_db)):
     """Create a new merchant.
 
     Args:
@@ -81,13 +199,13 @@ async def create_merchant(merchant: MerchantCreate, current_user: User = Depends
     if validations:
         raise HTTPException(status_code=400, detail=validations)
 
-    return create(db, merchant)
+    return await create(db, merchant)
 
 
 @router.put("/{merchant_id}", response_model=Merchant)
 async def update_merchant(merchant_id: int, merchant: MerchantUpdate,
                           current_user: User = Depends(get_current_user),
-                          db: Session = Depends(get_db)):
+                          db: AsyncSession = Depends(get_db)):
     """Update a merchant.
 
     Args:
@@ -97,7 +215,7 @@ async def update_merchant(merchant_id: int, merchant: MerchantUpdate,
     Returns:
         Merchant: The updated merchant object.
     """
-    merchant_old = get_merchant_by_id(db, merchant_id)
+    merchant_old = await get_merchant_by_id(db, merchant_id)
     if not merchant_old:
         raise HTTPException(status_code=404, detail="Merchant not found")
-    return update(db, merchant_old, merchant)
+    return await update(db, merchant_old, merchant)
@@ -1,4 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import JSONResponse, Response
+
+from src.db.balance_slots import balance_compactor
+from src.db.connection import pool_status, replica_router
+from src.db.ledger import ledger_checkpointer
+from src.db.models.user import User
+from src.db.operations import customer_cache, merchant_cache
+from src.routes.auth import get_current_user, password_hasher, token_cache
+from src.utils.audit import audit_writer
+from src.utils.event_stream import transaction_events
+from src.utils.idempotency import idempotency_store
+from src.utils.load_shedding import LOAD_SHED_RETRY_AFTER, database_status, loop_monitor, overload_reason
+from src.utils.metrics import CONTENT_TYPE, metrics
+from src.utils.processor import processor_client
+from src.utils.query_stats import slowest_statements
+from src.utils.rate_limit import rate_limiter
+from src.utils.webhooks import webhook_dispatcher
 
 router = APIRouter(
     tags=["root"],
@@ -28,3 +45,80 @@ async def health():
         dict: A dictionary with a health status message.
     """
     return {"message": "Healthy"}
+
+
+@router.get("/ready")
+async def ready():
+    """Check whether the worker can take traffic.
+
+    The worker is ready when the database answers within READINESS_DB_TIMEOUT and
+    neither the pool wait nor the event loop lag crosses the load shedding thresholds.
+
+    Returns:
+        JSONResponse: The database, pool and event loop status, with 200 when ready and 503 otherwise.
+    """
+    database = await database_status()
+    overloaded = overload_reason()
+    is_ready = database["reachable"] and overloaded is None
+    body = {
+        "status": "ready" if is_ready else "unavailable",
+        "reason": None if is_ready else overloaded or "database",
+        "database": database,
+        "pool": pool_status(),
+        "event_loop": loop_monitor.stats(),
+        "replicas": replica_router.stats(),
+    }
+    if is_ready:
+        return JSONResponse(body)
+    return JSONResponse(body, status_code=503, headers={"Retry-After": str(LOAD_SHED_RETRY_AFTER)})
+
+
+@router.get("/health/stats")
+async def health_stats():
+    """Report internal queue and cache counters.
+
+    Returns:
+        dict: A dictionary with the counters of each background component.
+    """
+    return {
+        "audit": audit_writer.stats(),
+        "token_cache": token_cache.stats(),
+        "password_hasher": password_hasher.stats(),
+        "customer_cache": customer_cache.stats(),
+        "merchant_cache": merchant_cache.stats(),
+        "idempotency": idempotency_store.stats(),
+        "ledger_checkpointer": ledger_checkpointer.stats(),
+        "balance_compactor": balance_compactor.stats(),
+        "event_loop": loop_monitor.stats(),
+        "replicas": replica_router.stats(),
+        "processor": processor_client.stats(),
+        "rate_limiter": rate_limiter.stats(),
+        "webhooks": webhook_dispatcher.stats(),
+        "event_streams": transaction_events.stats(),
+    }
+
+
+@router.get("/metrics")
+async def read_metrics():
+    """Expose the application metrics in the Prometheus text format.
+
+    Returns:
+        Response: The metrics of this worker, or of every worker when METRICS_MULTIPROC_DIR is set.
+    """
+    return Response(metrics.render(), media_type=CONTENT_TYPE)
+
+
+@router.get("/debug/queries")
+async def read_slowest_queries(limit: int = Query(20, ge=1, le=100), current_user: User = Depends(get_current_user)):
+    """List the SQL statements that took the most database time in this worker.
+
+    Statements are grouped by fingerprint, with their literals and parameters replaced by ?.
+
+    Args:
+        limit (int): The number of statements to return.
+        current_user (User): The authenticated user.
+
+    Returns:
+        list: The statements with their execution count and total, mean and max time in ms.
+    """
+    return slowest_statements.top(limit)
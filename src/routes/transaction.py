@@ -1,26 +1,25 @@
+from typing import List
+
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.db.connection import SessionLocal
+from src.db.connection import get_db
 from src.db.models.user import User
-from src.db.schemas.transaction import Transaction, TransactionCreate, TransactionUpdate
+from src.db.schemas.transaction import (Transaction, TransactionCreate, TransactionUpdate,
+                                        TransactionBatchRequest, TransactionBatchResult,
+                                        TransactionBulkRequest, TransactionBulkResult)
 from src.db.operations import (get_transaction_by_id,
                                create_transaction as create,
+                               create_transactions_bulk,
                                update_transaction as update,
                                get_transaction_by_token,
-                                process_transaction
+                               process_transaction,
+                               process_transactions_batch,
+                               TRANSACTION_ROWS
                                )
 from src.routes.auth import get_current_user
 
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
 router = APIRouter(
     prefix="/api/v1/transaction",
     tags=["transactions"],
@@ -29,13 +28,12 @@ router = APIRouter(
         500: {"description": "Internal Server Error"},
         400: {"description": "Bad Request"}
     },
-    dependencies=[Depends(get_db)],
 )
 
 
 @router.get("/{transaction_id}", response_model=Transaction)
 async def read_transaction(transaction_id: int, current_user: User = Depends(get_current_user),
-                           db: Session = Depends(get_db)):
+                           db: AsyncSession = Depends(get_db)):
     """Retrieve a transaction by ID.
 
     Args:
@@ -45,15 +43,15 @@ async def read_transaction(transaction_id: int, current_user: User = Depends(get
     Returns:
         Transaction: The transaction object.
     """
-    transaction = get_transaction_by_id(db, transaction_id)
+    transaction = await get_transaction_by_id(db, transaction_id)
     if transaction is None:
         raise HTTPException(status_code=404, detail="Transaction not found")
-    return transaction
+    return TRANSACTION_ROWS.response(transaction)
 
 
 @router.get("/token/{token}", response_model=Transaction)
 async def read_transaction_by_token(token: str, current_user: User = Depends(get_current_user),
-                                    db: Session = Depends(get_db)):
+                                    db: AsyncSession = Depends(get_db)):
     """Retrieve a transaction by token.
 
     Args:
@@ -63,15 +61,15 @@ async def read_transaction_by_token(token: str, current_user: User = Depends(get
     Returns:
         Transaction: The transaction object.
     """
-    transaction = get_transaction_by_token(db, token)
+    transaction = await get_transaction_by_token(db, token)
     if transaction is None:
         raise HTTPException(status_code=404, detail="Transaction not found")
-    return transaction
+    return TRANSACTION_ROWS.response(transaction)
 
 
 @router.post("/", response_model=Transaction)
 async def create_transaction(transaction: TransactionCreate, current_user: User = Depends(get_current_user),
-                             db: Session = Depends(get_db)):
+                             db: AsyncSession = Depends(get_db)):
     """Create a new transaction.
 
     Args:
@@ -79,13 +77,26 @@ async def create_transaction(transaction: TransactionCreate, current_user: User
     Returns:
         Transaction: The transaction created.
     """
-    return create(db, transaction)
+    return await create(db, transaction)
+
+
+@router.post("/bulk", response_model=List[TransactionBulkResult])
+async def create_transactions(bulk: TransactionBulkRequest, current_user: User = Depends(get_current_user),
+                              db: AsyncSession = Depends(get_db)):
+    """Create several transactions at once.
+
+    Args:
+        bulk (TransactionBulkRequest): The transactions to create.
+    Returns:
+        List[TransactionBulkResult]: The created transaction or the rejection reason of each item.
+    """
+    return await create_transactions_bulk(db, bulk.items)
 
 
 @router.put("/{transaction_id}", response_model=Transaction)
 async def update_transaction(transaction_id: int, transaction: TransactionUpdate,
                              current_user: User = Depends(get_current_user),
-                            db: Session = Depends(get_db)):
+                            db: AsyncSession = Depends(get_db)):
     """Update a transaction.
 
     Args:
@@ -96,15 +107,41 @@ async def update_transaction(transaction_id: int, transaction: TransactionUpdate
     Returns:
         Transaction: The updated transaction.
     """
-    db_transaction = get_transaction_by_id(db, transaction_id)
+    db_transaction = await get_transaction_by_id(db, transaction_id)
     if db_transaction is None:
         raise HTTPException(status_code=404, detail="Transaction not found")
-    return update(db, db_transaction, transaction)
+    return await update(db, db_transaction, transaction)
+
+
+@router.post("/process/batch", response_model=List[TransactionBatchResult])
+async def process_transactions(batch: TransactionBatchRequest, current_user: User = Depends(get_current_user),
+                               db: AsyncSession = Depends(get_db)):
+    """Process several transactions at once.
+
+    Args:
+        batch (TransactionBatchRequest): The tokens of the transactions to process.
+    Returns:
+        List[TransactionBatchResult]: The outcome of each token, in request order.
+    """
+    return await process_transactions_batch(db, batch.tokens, 'capture')
+
+
+@router.post("/refund/batch", response_model=List[TransactionBatchResult])
+async def refund_transactions(batch: TransactionBatchRequest, current_user: User = Depends(get_current_user),
+                              db: AsyncSession = Depends(get_db)):
+    """Refund several transactions at once.
+
+    Args:
+        batch (TransactionBatchRequest): The tokens of the transactions to refund.
+    Returns:
+        List[TransactionBatchResult]: The outcome of each token, in request order.
+    """
+    return await process_transactions_batch(db, batch.tokens, 'refund')
 
 
 @router.post("/process/{token}", response_model=Transaction)
 async def process_transaction_by_token(token: str, current_user: User = Depends(get_current_user),
-                                       db: Session = Depends(get_db)):
+                                       db: AsyncSession = Depends(get_db)):
     """Process a transaction.
 
     Args:
@@ -114,7 +151,7 @@ async def process_transaction_by_token(token: str, current_user: User = Depends(
     Returns:
         Transaction: The processed transaction.
     """
-    transaction = process_transaction(db, token, 'capture')
+    transaction = await process_transaction(db, token, 'capture')
     if transaction is None:
         raise HTTPException(status_code=404, detail="Transaction not found")
     return transaction
@@ -122,7 +159,7 @@ async def process_transaction_by_token(token: str, current_user: User = Depends(
 
 @router.post("/refund/{token}", response_model=Transaction)
 async def refund_transaction_by_token(token: str, current_user: User = Depends(get_current_user),
-                                      db: Session = Depends(get_db)):
+                                      db: AsyncSession = Depends(get_db)):
     """Refund a transaction.
 
     Args:
@@ -132,7 +169,7 @@ async def refund_transaction_by_token(token: str, current_user: User = Depends(g
     Returns:
         Transaction: The refunded transaction.
     """
-    transaction = process_transaction(db, token, 'refund')
+    transaction = await process_transaction(db, token, 'refund')
     if transaction is None:
         raise HTTPException(status_code=404, detail="Transaction not found")
     return transaction
@@ -1,58 +1,193 @@
+import asyncio
 import logging
-from fastapi import Request
-from sqlalchemy.orm import Session
+import os
 from datetime import datetime, timezone
+from typing import List, Optional
+
+from fastapi import Request
+from sqlalchemy import insert
 
-from src.db.connection import SessionLocal
+from src.db.connection import AsyncSessionLocal
 from src.db.models.audit_log import AuditLogModel
-from src.db.models.token import Token
+from src.routes.auth import bearer_identity
+from src.utils.metrics import metrics
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE") or 10000)
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE") or 500)
+AUDIT_FLUSH_INTERVAL = float(os.getenv("AUDIT_FLUSH_INTERVAL") or 1.0)
+AUDIT_DRAIN_TIMEOUT = float(os.getenv("AUDIT_DRAIN_TIMEOUT") or 10.0)
+
+AUDIT_QUEUE_DEPTH = metrics.gauge("payment_audit_queue_depth", "Audit records waiting to be written.")
+AUDIT_DROPPED = metrics.counter("payment_audit_dropped_total", "Audit records dropped because the queue was full.")
+
+
+class AuditLogWriter:
+    """Write-behind buffer for audit log entries.
+
+    Requests only enqueue a record in memory; a background worker flushes the
+    queue in batches with a single multi-row INSERT. When the queue is full new
+    records are dropped and counted instead of blocking the request.
+
+    Args:
+        session_factory (async_sessionmaker): Factory for the sessions used to flush batches.
+        queue_size (int): Maximum number of records waiting to be written.
+        batch_size (int): Maximum number of records written per INSERT.
+        flush_interval (float): Maximum seconds a record waits before being flushed.
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal, queue_size: int = AUDIT_QUEUE_SIZE,
+                 batch_size: int = AUDIT_BATCH_SIZE, flush_interval: float = AUDIT_FLUSH_INTERVAL):
+        self.session_factory = session_factory
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self.enqueued = 0
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+        self.batches = 0
+        self.max_depth = 0
+
+    def enqueue(self, record: dict) -> bool:
+        """Adds a record to the queue without blocking.
+
+        Args:
+            record (dict): The audit log column values.
+
+        Returns:
+            bool: True if the record was queued, False if it was dropped.
+        """
+        if self._stopping:
+            self.dropped += 1
+            AUDIT_DROPPED.inc()
+            return False
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            AUDIT_DROPPED.inc()
+            if self.dropped % 1000 == 1:
+                logger.warning(f"Audit log queue full, {self.dropped} records dropped so far")
+            return False
+        self.enqueued += 1
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+        return True
+
+    async def start(self):
+        """Starts the background flush worker."""
+        if self._task is None:
+            self._stopping = False
+            # Rebind the queue to the running loop, keeping anything enqueued before start.
+            queue = asyncio.Queue(maxsize=self.queue_size)
+            while not self._queue.empty():
+                queue.put_nowait(self._queue.get_nowait())
+            self._queue = queue
+            self._task = asyncio.create_task(self._run())
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+    async def stop(self, timeout: float = AUDIT_DRAIN_TIMEOUT):
+        """Stops accepting records and waits until the queue has been drained.
+
+        Args:
+            timeout (float): Maximum seconds to wait for the drain.
+        """
+        self._stopping = True
+        if self._task is None:
+            await self._drain()
+            return
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Audit log drain timed out, {self._queue.qsize()} records lost")
+        finally:
+            self._task = None
+
+    def stats(self) -> dict:
+        """Returns the queue and throughput counters.
+
+        Returns:
+            dict: The current counters of the writer.
+        """
+        return {
+            "queue_depth": self._queue.qsize(),
+            "queue_size": self.queue_size,
+            "max_depth": self.max_depth,
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "written": self.written,
+            "failed": self.failed,
+            "batches": self.batches,
+        }
+
+    async def _run(self):
+        while not (self._stopping and self._queue.empty()):
+            batch = await self._next_batch()
+            if batch:
+                await self._flush(batch)
+
+    async def _drain(self):
+        while not self._queue.empty():
+            await self._flush(self._take_available([]))
+
+    def _take_available(self, batch: List[dict]) -> List[dict]:
+        while len(batch) < self.batch_size and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _next_batch(self) -> List[dict]:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        batch = self._take_available([])
+        while len(batch) < self.batch_size and not self._stopping:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+            self._take_available(batch)
+        return batch
+
+    async def _flush(self, batch: List[dict]):
+        try:
+            await self._write(batch)
+            self.written += len(batch)
+            self.batches += 1
+        except Exception as e:
+            self.failed += len(batch)
+            logger.error(f"Error writing {len(batch)} audit log entries: {e}")
+
+    async def _write(self, batch: List[dict]):
+        async with self.session_factory() as db:
+            await db.execute(insert(AuditLogModel).values(batch))
+            await db.commit()
+
+
+audit_writer = AuditLogWriter()
+metrics.on_collect(lambda: AUDIT_QUEUE_DEPTH.set(audit_writer.stats()["queue_depth"]))
 
 
 async def audit_log_middleware(request: Request, call_next):
-    db: Session = next(get_db())
     response = await call_next(request)
 
-    user_id = None
-
-    activity_type = request.method
-    bearer_token = request.headers.get("Authorization", None)
-    if bearer_token:
-        bearer_token = bearer_token.split(" ")[1]
-        user_id = db.query(Token).filter(Token.access_token == bearer_token).first().user_id
+    bearer_token, user_id = bearer_identity(request)
 
-    client_ip = request.client.host
+    client_ip = request.client.host if request.client else None
     x_forwarded_for = request.headers.get("x-forwarded-for")
 
-    ip_address = x_forwarded_for or client_ip
-
-    path = request.url.path
-
-    try:
-        audit_log = AuditLogModel(
-            user_id=user_id,
-            activity_type=activity_type,
-            bearer_token=bearer_token,
-            ip_address=ip_address,
-            path=path,
-            timestamp=datetime.now(timezone.utc)
-        )
-        db.add(audit_log)
-        db.commit()
-    except Exception as e:
-        logger.error(f"Error creating audit log: {e}")
-        db.rollback()
-    finally:
-        db.close()
+    audit_writer.enqueue({
+        "user_id": user_id,
+        "activity_type": request.method,
+        "bearer_token": bearer_token,
+        "ip_address": x_forwarded_for or client_ip,
+        "path": request.url.path,
+        "timestamp": datetime.now(timezone.utc),
+    })
 
     return response
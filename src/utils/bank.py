@@ -1,3 +1,6 @@
+from typing import Optional
+
+from src.utils.processor import PaymentDeclined, processor_client
 
 
 class BankUtils:
@@ -6,6 +9,8 @@ class BankUtils:
     Methods:
         verify_hash_credit_card(hash_transaction, customer_hash): Verifies if
         the transaction hash matches the customer hash.
+        send_payment_details(transaction, type): Sends a capture or refund to the processor.
+        process_payment(transaction, type): Sends a payment and raises if the processor declines it.
     """
     @staticmethod
     def verify_hash_credit_card(hash_transaction, customer_hash):
@@ -20,20 +25,64 @@ class BankUtils:
         """
         return hash_transaction == customer_hash
 
-    def send_payment_details(amount, card_info, merchant_id):
-        """Sends payment details to the processing organization."""
-        print(f"Processing ${amount} payment from card {card_info['card_number']} to merchant {merchant_id}")
-        return {"status": "success", "transaction_id": "12345ABC"}
+    @staticmethod
+    def payment_details(transaction, type: str) -> dict:
+        """Builds the payment sent to the processor for a transaction.
+
+        The transaction token is the reference the processor deduplicates on.
+
+        Args:
+            transaction (TransactionModel): The transaction.
+            type (str): The operation, capture or refund.
+
+        Returns:
+            dict: The payment.
+        """
+        return {
+            "reference": transaction.token,
+            "type": type,
+            "amount": str(transaction.amount),
+            "currency": transaction.currency,
+            "card": transaction.hash_credit_card,
+            "merchant_id": transaction.merchant_id,
+        }
+
+    @staticmethod
+    async def send_payment_details(transaction, type: str, timeout: Optional[float] = None) -> dict:
+        """Sends payment details to the processing organization.
+
+        Concurrent calls are coalesced into batch calls by the processor client.
 
-    def process_payment(self, card_info, amount, merchant_id):
-        """Processes a payment."""
-        if not self.validate_card(card_info['card_number'], card_info['expiration_date'], card_info['cvv']):
-            raise ValueError("Invalid card details")
+        Args:
+            transaction (TransactionModel): The transaction.
+            type (str): The operation, capture or refund.
+            timeout (float, optional): Seconds to wait for the answer.
+
+        Returns:
+            dict: The answer of the processor, with its status and the processor transaction id.
 
-        result = self.send_payment_details(amount, card_info, merchant_id)
+        Raises:
+            ProcessorError: If the processor gave no answer.
+        """
+        return await processor_client.submit(BankUtils.payment_details(transaction, type), timeout)
+
+    @staticmethod
+    async def process_payment(transaction, type: str, timeout: Optional[float] = None) -> dict:
+        """Processes a payment.
 
-        if result['status'] == "success":
-            print(f"Payment successful. Transaction ID: {result['transaction_id']}")
-            return result
-        else:
-            raise Exception("Payment failed")
+        Args:
+            transaction (TransactionModel): The transaction.
+            type (str): The operation, capture or refund.
+            timeout (float, optional): Seconds to wait for the answer.
+
+        Returns:
+            dict: The answer of the processor for the approved payment.
+
+        Raises:
+            PaymentDeclined: If the processor declined the payment.
+            ProcessorError: If the processor gave no answer.
+        """
+        result = await BankUtils.send_payment_details(transaction, type, timeout)
+        if result["status"] != "approved":
+            raise PaymentDeclined(result.get("reason") or "Payment declined.")
+        return result
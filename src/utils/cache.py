@@ -0,0 +1,183 @@
+import asyncio
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+CACHE_TTL = float(os.getenv("CACHE_TTL") or 30)
+CACHE_SIZE = int(os.getenv("CACHE_SIZE") or 10000)
+
+
+class Snapshot(dict):
+    """Detached copy of a row, readable by attribute like the ORM object it was taken from."""
+
+    def __getattr__(self, name: str) -> Any:
+        try:
+            return self[name]
+        except KeyError as e:
+            raise AttributeError(name) from e
+
+
+class LRUCache:
+    """In-process LRU cache whose entries expire after a fixed time to live.
+
+    Args:
+        max_size (int): Maximum number of entries.
+        ttl (float): Seconds an entry stays valid.
+    """
+
+    def __init__(self, max_size: int = CACHE_SIZE, ttl: float = CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any):
+        self._entries[key] = (value, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def delete(self, key: Hashable):
+        self._entries.pop(key, None)
+
+
+class CacheBackend(ABC):
+    """Interface of a cache shared between workers, such as Redis or memcached.
+
+    Implementations own the serialization of the values, which are Snapshot
+    dictionaries of column values.
+    """
+
+    @abstractmethod
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    async def set(self, key: str, value: Dict[str, Any], ttl: float):
+        ...
+
+    @abstractmethod
+    async def delete(self, key: str):
+        ...
+
+
+class ReadThroughCache:
+    """Read-through cache with an in-process tier and an optional shared tier.
+
+    Concurrent misses on the same key are coalesced: the first caller runs the
+    loader and the others wait for its result, so a cold key costs one query no
+    matter how many requests ask for it. An invalidation that happens while a
+    load is in flight prevents that load from populating the cache.
+
+    Args:
+        name (str): Prefix of the keys in the shared backend.
+        local (LRUCache): The in-process tier.
+        shared (CacheBackend, optional): The tier shared between workers.
+    """
+
+    def __init__(self, name: str, local: Optional[LRUCache] = None, shared: Optional[CacheBackend] = None):
+        self.name = name
+        self.local = local or LRUCache()
+        self.shared = shared
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._versions: Dict[Hashable, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    async def get_or_load(self, key: Hashable,
+                          loader: Callable[[], Awaitable[Optional[Dict[str, Any]]]]) -> Optional[Snapshot]:
+        """Returns the cached value of a key, loading it on a miss.
+
+        Args:
+            key (Hashable): The key, usually a primary key.
+            loader (Callable[[], Awaitable[Optional[dict]]]): Loads the value from the database.
+                A None result is returned but not cached.
+
+        Returns:
+            Optional[Snapshot]: The value, or None if the loader found nothing.
+        """
+        value = self.local.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+        if key in self._inflight:
+            self.coalesced += 1
+            return await asyncio.shield(self._inflight[key])
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        version = self._versions.get(key, 0)
+        try:
+            value = await self._load(key, loader)
+            if value is not None and self._versions.get(key, 0) == version:
+                self.local.set(key, value)
+            future.set_result(value)
+            return value
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def invalidate(self, key: Hashable):
+        """Drops a key from every tier, including loads that are still in flight.
+
+        Args:
+            key (Hashable): The key to drop.
+        """
+        self.invalidations += 1
+        self._versions[key] = self._versions.get(key, 0) + 1
+        self.local.delete(key)
+        if self.shared is not None:
+            await self.shared.delete(f"{self.name}:{key}")
+
+    def clear(self):
+        """Drops every entry of the in-process tier."""
+        self.local = LRUCache(self.local.max_size, self.local.ttl)
+        self._versions.clear()
+
+    def stats(self) -> dict:
+        """Returns the size and hit counters of the cache.
+
+        Returns:
+            dict: The current counters of the cache.
+        """
+        return {
+            "size": len(self.local),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "invalidations": self.invalidations,
+        }
+
+    async def _load(self, key: Hashable, loader) -> Optional[Snapshot]:
+        if self.shared is not None:
+            value = await self.shared.get(f"{self.name}:{key}")
+            if value is not None:
+                return Snapshot(value)
+        value = await loader()
+        if value is None:
+            return None
+        value = Snapshot(value)
+        if self.shared is not None:
+            await self.shared.set(f"{self.name}:{key}", value, self.local.ttl)
+        return value
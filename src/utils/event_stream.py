@@ -0,0 +1,357 @@
+import asyncio
+import json
+import logging
+import os
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, List, Optional, Set
+
+import asyncpg
+
+from src.db.connection import SQLALCHEMY_DATABASE_URL
+from src.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# "local" fans the events out within the worker; "postgres" shares them between workers with LISTEN/NOTIFY.
+EVENT_STREAM_BACKEND = os.getenv("EVENT_STREAM_BACKEND") or "local"
+EVENT_STREAM_CHANNEL = os.getenv("EVENT_STREAM_CHANNEL") or "transaction_events"
+# Events a subscriber may have unread before it is evicted as a slow consumer.
+EVENT_STREAM_BUFFER = int(os.getenv("EVENT_STREAM_BUFFER") or 100)
+EVENT_STREAM_MAX_SUBSCRIBERS = int(os.getenv("EVENT_STREAM_MAX_SUBSCRIBERS") or 1000)
+EVENT_STREAM_HEARTBEAT = float(os.getenv("EVENT_STREAM_HEARTBEAT") or 15.0)
+# Streams are closed after this many seconds so the clients reconnect and spread over the workers.
+EVENT_STREAM_MAX_DURATION = float(os.getenv("EVENT_STREAM_MAX_DURATION") or 900.0)
+EVENT_STREAM_RETRY_MS = int(os.getenv("EVENT_STREAM_RETRY_MS") or 3000)
+EVENT_STREAM_QUEUE_SIZE = int(os.getenv("EVENT_STREAM_QUEUE_SIZE") or 10000)
+EVENT_STREAM_RECONNECT = float(os.getenv("EVENT_STREAM_RECONNECT") or 1.0)
+
+# NOTIFY payloads must stay under 8000 bytes.
+NOTIFY_PAYLOAD_MAX = 7900
+
+EVENT_STREAM_SUBSCRIBERS = metrics.gauge("payment_event_stream_subscribers", "Open transaction event streams.")
+EVENT_STREAM_EVICTED = metrics.counter("payment_event_stream_evicted_total",
+                                       "Event streams closed because the client read too slowly.")
+
+
+class Subscription:
+    """The buffer of the events of one merchant waiting to be sent on one stream.
+
+    Args:
+        merchant_id (int): The merchant whose events are received.
+        buffer_size (int): Maximum number of unread events.
+    """
+
+    def __init__(self, merchant_id: int, buffer_size: int = EVENT_STREAM_BUFFER):
+        self.merchant_id = merchant_id
+        self.buffer_size = buffer_size
+        self.messages: Deque[str] = deque()
+        self.evicted = False
+        self.closed = False
+        self._ready = asyncio.Event()
+
+    def push(self, message: str) -> bool:
+        """Adds an event without blocking, evicting the subscriber when its buffer is full.
+
+        Args:
+            message (str): The encoded event.
+
+        Returns:
+            bool: False if the subscriber was evicted.
+        """
+        if self.closed:
+            return False
+        if len(self.messages) >= self.buffer_size:
+            self.evicted = True
+            self.close()
+            return False
+        self.messages.append(message)
+        self._ready.set()
+        return True
+
+    def close(self):
+        self.closed = True
+        self._ready.set()
+
+    async def next(self, timeout: float) -> Optional[str]:
+        """Waits for the next event.
+
+        Args:
+            timeout (float): Maximum seconds to wait.
+
+        Returns:
+            Optional[str]: The event, or None on timeout or once the subscription is closed.
+        """
+        if not self.messages and not self.closed:
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return None
+        if self.closed:
+            return None
+        self._ready.clear()
+        message = self.messages.popleft()
+        if self.messages:
+            self._ready.set()
+        return message
+
+
+def encode(event: dict) -> str:
+    """Encodes a transaction event as a Server-Sent Event.
+
+    Args:
+        event (dict): The event, with its event_type and its JSON payload.
+
+    Returns:
+        str: The text/event-stream message.
+    """
+    return f"event: {event['event_type']}\ndata: {event['payload']}\n\n"
+
+
+def notify_payloads(events: List[dict]) -> List[str]:
+    """Groups events into JSON arrays that each fit in a NOTIFY payload.
+
+    Args:
+        events (List[dict]): The events.
+
+    Returns:
+        List[str]: The payloads.
+    """
+    payloads, chunk, size = [], [], 2
+    for event in events:
+        item = json.dumps(event, separators=(",", ":"))
+        if chunk and size + len(item) + 1 > NOTIFY_PAYLOAD_MAX:
+            payloads.append(f"[{','.join(chunk)}]")
+            chunk, size = [], 2
+        chunk.append(item)
+        size += len(item) + 1
+    if chunk:
+        payloads.append(f"[{','.join(chunk)}]")
+    return payloads
+
+
+class TransactionEventBroker:
+    """Fans the transaction state changes out to the event streams of the merchants.
+
+    Each worker holds the subscriptions of its open streams, by merchant, and
+    pushes each event to them without waiting: a subscriber whose buffer is full
+    is evicted instead of slowing down the others. With the local backend, the
+    events of the worker are the only ones fanned out. With the postgres backend,
+    published events are sent with NOTIFY, coalesced by a background task, on a
+    single connection per worker that also LISTENs on the channel, so every
+    worker receives the events of all of them.
+
+    Args:
+        backend (str): "local" or "postgres".
+        dsn (str): The PostgreSQL database of the postgres backend.
+        channel (str): The NOTIFY channel.
+        buffer_size (int): Maximum number of unread events of a subscriber.
+        max_subscribers (int): Maximum number of open streams of the worker.
+        queue_size (int): Maximum number of events waiting to be sent with NOTIFY.
+    """
+
+    def __init__(self, backend: str = EVENT_STREAM_BACKEND, dsn: str = SQLALCHEMY_DATABASE_URL,
+                 channel: str = EVENT_STREAM_CHANNEL, buffer_size: int = EVENT_STREAM_BUFFER,
+                 max_subscribers: int = EVENT_STREAM_MAX_SUBSCRIBERS, queue_size: int = EVENT_STREAM_QUEUE_SIZE):
+        if backend not in ("local", "postgres"):
+            raise ValueError(f"Unknown event stream backend {backend!r}, expected 'local' or 'postgres'")
+        self.backend = backend
+        self.dsn = dsn
+        self.channel = channel
+        self.buffer_size = buffer_size
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self._subscribers: Dict[int, Set[Subscription]] = {}
+        self._outgoing: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self.connected = False
+        self.published = 0
+        self.delivered = 0
+        self.evicted = 0
+        self.dropped = 0
+
+    async def start(self):
+        """Starts listening on the channel, with the postgres backend."""
+        if self.backend == "postgres" and self._task is None:
+            self._outgoing = asyncio.Queue(maxsize=self.queue_size)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops listening and closes the open streams."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._outgoing = None
+        for subscribers in list(self._subscribers.values()):
+            for subscription in list(subscribers):
+                subscription.close()
+
+    def stats(self) -> dict:
+        """Returns the number of open streams and the event counters.
+
+        Returns:
+            dict: The current counters of the broker.
+        """
+        return {
+            "backend": self.backend,
+            "connected": self.connected if self.backend == "postgres" else None,
+            "subscribers": sum(len(subscribers) for subscribers in self._subscribers.values()),
+            "merchants": len(self._subscribers),
+            "published": self.published,
+            "delivered": self.delivered,
+            "evicted": self.evicted,
+            "dropped": self.dropped,
+        }
+
+    def subscribe(self, merchant_id: int) -> Optional[Subscription]:
+        """Opens a subscription to the events of a merchant.
+
+        Args:
+            merchant_id (int): The merchant.
+
+        Returns:
+            Optional[Subscription]: The subscription, or None when the worker has too many streams open.
+        """
+        if sum(len(subscribers) for subscribers in self._subscribers.values()) >= self.max_subscribers:
+            return None
+        subscription = Subscription(merchant_id, self.buffer_size)
+        self._subscribers.setdefault(merchant_id, set()).add(subscription)
+        EVENT_STREAM_SUBSCRIBERS.inc()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subscribers = self._subscribers.get(subscription.merchant_id)
+        if subscribers is None or subscription not in subscribers:
+            return
+        subscribers.discard(subscription)
+        if not subscribers:
+            del self._subscribers[subscription.merchant_id]
+        EVENT_STREAM_SUBSCRIBERS.dec()
+
+    def wants(self, merchant_id: int) -> bool:
+        """Tells whether the events of a merchant may have a subscriber.
+
+        With the postgres backend, the subscribers of the other workers are unknown.
+
+        Args:
+            merchant_id (int): The merchant.
+
+        Returns:
+            bool: True if the events of the merchant must be published.
+        """
+        return self.backend == "postgres" or merchant_id in self._subscribers
+
+    def publish(self, events: List[dict]):
+        """Publishes committed transaction events without waiting.
+
+        Args:
+            events (List[dict]): The events, with their merchant_id, event_type and JSON payload.
+        """
+        if not events:
+            return
+        self.published += len(events)
+        if self.backend == "local":
+            self.fan_out(events)
+            return
+        if self._outgoing is None:
+            self.dropped += len(events)
+            return
+        for event in events:
+            try:
+                self._outgoing.put_nowait(event)
+            except asyncio.QueueFull:
+                self.dropped += 1
+
+    def fan_out(self, events: List[dict]):
+        """Pushes events to the subscribers of this worker.
+
+        Args:
+            events (List[dict]): The events.
+        """
+        for event in events:
+            subscribers = self._subscribers.get(event["merchant_id"])
+            if not subscribers:
+                continue
+            message = encode(event)
+            for subscription in list(subscribers):
+                if subscription.push(message):
+                    self.delivered += 1
+                else:
+                    self.evicted += 1
+                    EVENT_STREAM_EVICTED.inc()
+                    self.unsubscribe(subscription)
+
+    async def stream(self, subscription: Subscription, heartbeat: float = EVENT_STREAM_HEARTBEAT,
+                     max_duration: float = EVENT_STREAM_MAX_DURATION) -> AsyncIterator[str]:
+        """Writes the events of a subscription as a text/event-stream body.
+
+        A comment is sent when no event came for heartbeat seconds, so proxies keep
+        the connection open. The stream ends after max_duration seconds, when the
+        broker stops, or with an "evicted" event when the client read too slowly;
+        the client then reconnects after the advertised retry delay.
+
+        Args:
+            subscription (Subscription): The subscription to the events of a merchant.
+            heartbeat (float): Maximum seconds without sending anything.
+            max_duration (float): Seconds after which the stream is closed.
+
+        Yields:
+            str: The messages of the stream.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + max_duration
+        try:
+            yield f"retry: {EVENT_STREAM_RETRY_MS}\n\n"
+            while loop.time() < deadline:
+                message = await subscription.next(min(heartbeat, deadline - loop.time()))
+                if message is not None:
+                    yield message
+                elif subscription.evicted:
+                    yield 'event: evicted\ndata: {"detail": "The stream fell behind, reconnect."}\n\n'
+                    return
+                elif subscription.closed:
+                    return
+                else:
+                    yield ": keep-alive\n\n"
+        finally:
+            self.unsubscribe(subscription)
+
+    def _on_notify(self, connection, pid: int, channel: str, payload: str):
+        try:
+            self.fan_out(json.loads(payload))
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error(f"Invalid transaction event notification: {e}")
+
+    async def _run(self):
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(self.dsn)
+                await connection.add_listener(self.channel, self._on_notify)
+                self.connected = True
+                while True:
+                    try:
+                        events = [await asyncio.wait_for(self._outgoing.get(), EVENT_STREAM_HEARTBEAT)]
+                    except asyncio.TimeoutError:
+                        # Idle: check that the listening connection is still alive.
+                        await connection.execute("SELECT 1")
+                        continue
+                    while not self._outgoing.empty():
+                        events.append(self._outgoing.get_nowait())
+                    for payload in notify_payloads(events):
+                        await connection.execute("SELECT pg_notify($1, $2)", self.channel, payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Transaction event listener failed, reconnecting: {e}")
+                await asyncio.sleep(EVENT_STREAM_RECONNECT)
+            finally:
+                self.connected = False
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+
+
+transaction_events = TransactionEventBroker()
@@ -0,0 +1,86 @@
+import csv
+import io
+import json
+from datetime import datetime
+from decimal import Decimal
+from typing import AsyncIterator, Sequence
+
+from sqlalchemy import Row
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+}
+
+
+def json_value(value):
+    """Encodes the values json does not handle like the API responses do.
+
+    Args:
+        value: A Decimal or datetime column value.
+
+    Returns:
+        str: The amount as a string, or the timestamp in ISO 8601.
+    """
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Cannot encode {type(value).__name__}")
+
+
+def csv_value(value):
+    """Formats a column value for a CSV cell.
+
+    Args:
+        value: The column value.
+
+    Returns:
+        The value, with timestamps in ISO 8601 and NULL as an empty cell.
+    """
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+async def csv_chunks(columns: Sequence[str], batches: AsyncIterator[Sequence[Row]]) -> AsyncIterator[str]:
+    """Encodes batches of rows as CSV, one chunk per batch after the header.
+
+    Args:
+        columns (Sequence[str]): The column names, written as the header.
+        batches (AsyncIterator[Sequence[Row]]): The rows to encode.
+
+    Yields:
+        str: The header, then the lines of each batch.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    yield buffer.getvalue()
+    async for rows in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows([csv_value(value) for value in row] for row in rows)
+        yield buffer.getvalue()
+
+
+async def ndjson_chunks(columns: Sequence[str], batches: AsyncIterator[Sequence[Row]]) -> AsyncIterator[str]:
+    """Encodes batches of rows as newline-delimited JSON objects, one chunk per batch.
+
+    Args:
+        columns (Sequence[str]): The keys of each object.
+        batches (AsyncIterator[Sequence[Row]]): The rows to encode.
+
+    Yields:
+        str: The lines of each batch.
+    """
+    async for rows in batches:
+        yield "".join(json.dumps(dict(zip(columns, row)), default=json_value) + "\n" for row in rows)
+
+
+EXPORT_ENCODERS = {
+    "csv": csv_chunks,
+    "ndjson": ndjson_chunks,
+}
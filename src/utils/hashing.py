@@ -0,0 +1,116 @@
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from passlib.context import CryptContext
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS") or os.cpu_count() or 1)
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE") or 32)
+
+
+class HashingPoolSaturated(Exception):
+    """Raised when too many password operations are already waiting for a worker."""
+
+
+class PasswordHasher:
+    """Runs password hashing and verification on a bounded worker pool.
+
+    bcrypt releases the GIL while it works, so a thread pool keeps the event loop
+    free for other requests during login bursts. At most `workers` operations run at
+    once and `queue_limit` more may wait; beyond that callers are rejected right away
+    instead of piling up behind the pool.
+
+    Args:
+        context (CryptContext): The passlib context doing the actual work.
+        workers (int): Number of worker threads. 0 runs every operation inline on the event loop.
+        queue_limit (int): Maximum number of operations waiting for a worker.
+    """
+
+    def __init__(self, context: CryptContext, workers: int = PASSWORD_HASH_WORKERS,
+                 queue_limit: int = PASSWORD_HASH_QUEUE):
+        self.context = context
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def saturated(self) -> bool:
+        """Tells whether a new operation would be rejected.
+
+        Returns:
+            bool: True if every worker is busy and the wait queue is full.
+        """
+        return self.workers > 0 and self._pending >= self.workers + self.queue_limit
+
+    async def hash(self, password: str) -> str:
+        """Hashes a password on the worker pool.
+
+        Args:
+            password (str): The plain password.
+
+        Returns:
+            str: The password hash.
+
+        Raises:
+            HashingPoolSaturated: If the pool and its queue are full.
+        """
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        """Verifies a password against its hash on the worker pool.
+
+        Args:
+            password (str): The plain password.
+            hashed (str): The stored password hash.
+
+        Returns:
+            bool: True if the password matches.
+
+        Raises:
+            HashingPoolSaturated: If the pool and its queue are full.
+        """
+        return await self._run(self.context.verify, password, hashed)
+
+    def stats(self) -> dict:
+        """Returns the pool occupancy counters.
+
+        Returns:
+            dict: The current counters of the pool.
+        """
+        return {
+            "workers": self.workers,
+            "queue_limit": self.queue_limit,
+            "pending": self._pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self):
+        """Stops the worker threads once the running operations finish.
+
+        The pool is started again on the next operation.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    async def _run(self, function, *args):
+        if self.workers <= 0:
+            result = function(*args)
+            self.completed += 1
+            return result
+        if self.saturated():
+            self.rejected += 1
+            raise HashingPoolSaturated()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password-hash")
+        self._pending += 1
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+            self.completed += 1
+            return result
+        finally:
+            self._pending -= 1
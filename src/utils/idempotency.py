@@ -0,0 +1,291 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+
+from src.db.connection import AsyncSessionLocal
+from src.db.models.idempotency_key import IdempotencyKey as IdempotencyKeyModel
+from src.routes.auth import bearer_identity
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_KEY_TTL = int(os.getenv("IDEMPOTENCY_KEY_TTL") or 86400)
+IDEMPOTENCY_LOCK_TIMEOUT = int(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT") or 60)
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv("IDEMPOTENCY_WAIT_TIMEOUT") or 10.0)
+IDEMPOTENCY_POLL_INTERVAL = float(os.getenv("IDEMPOTENCY_POLL_INTERVAL") or 0.05)
+IDEMPOTENCY_SWEEP_INTERVAL = float(os.getenv("IDEMPOTENCY_SWEEP_INTERVAL") or 300.0)
+
+# Transaction create, capture and refund, single or batched.
+IDEMPOTENT_PATHS = re.compile(r"^/api/v1/transaction/(bulk|(process|refund)/[^/]+)?$")
+# Outcomes that a retry should re-execute instead of replaying.
+RETRYABLE_STATUS_CODES = {409, 429}
+# Headers recomputed for each response rather than replayed.
+UNSTORED_HEADERS = {"content-length", "date", "server"}
+
+Headers = List[Tuple[str, str]]
+
+
+class StoredResponse(NamedTuple):
+    fingerprint: str
+    status_code: int
+    headers: Headers
+    body: bytes
+
+    def response(self, replayed: bool) -> Response:
+        response = Response(self.body, status_code=self.status_code)
+        for name, value in self.headers or [("content-type", "application/json")]:
+            response.headers.append(name, value)
+        if replayed:
+            response.headers["Idempotent-Replayed"] = "true"
+        return response
+
+
+def stored_headers(response: Response) -> Headers:
+    """Selects the headers of a response that are replayed with it.
+
+    Args:
+        response (Response): The response of the first request.
+
+    Returns:
+        Headers: The header names and values, in order, without the ones computed per response.
+    """
+    return [(name, value) for name, value in response.headers.items() if name not in UNSTORED_HEADERS]
+
+
+def key_conflict(detail: str, status_code: int) -> Response:
+    return JSONResponse({"detail": detail}, status_code=status_code)
+
+
+class IdempotencyStore:
+    """Stores the response of requests sent with an Idempotency-Key header.
+
+    The first request with a key claims it with an INSERT and runs; the others read
+    the stored response with a single lookup on the (user_id, key) unique index.
+    Duplicates arriving in the same process while the first one runs wait on it
+    in memory, and duplicates in other workers poll the claim until the response
+    is stored. Claims of crashed requests expire after the lock timeout, and a
+    background sweep deletes expired keys.
+
+    Args:
+        session_factory (async_sessionmaker): Factory for the sessions used to read and write keys.
+        ttl (int): Seconds a stored response is replayed.
+        lock_timeout (int): Seconds a claim is held before another request may take it over.
+        wait_timeout (float): Maximum seconds a duplicate waits for the first request.
+        sweep_interval (float): Seconds between two sweeps of expired keys.
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal, ttl: int = IDEMPOTENCY_KEY_TTL,
+                 lock_timeout: int = IDEMPOTENCY_LOCK_TIMEOUT, wait_timeout: float = IDEMPOTENCY_WAIT_TIMEOUT,
+                 sweep_interval: float = IDEMPOTENCY_SWEEP_INTERVAL):
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self.wait_timeout = wait_timeout
+        self.sweep_interval = sweep_interval
+        self._inflight: Dict[Tuple[int, str], asyncio.Future] = {}
+        self._task: Optional[asyncio.Task] = None
+        self.executed = 0
+        self.replayed = 0
+        self.coalesced = 0
+        self.conflicts = 0
+        self.unstored = 0
+        self.swept = 0
+
+    async def run(self, user_id: int, key: str, fingerprint: str,
+                  execute: Callable[[], Awaitable[Tuple[int, Headers, bytes]]]) -> Response:
+        """Runs a request once per key and replays its response to the duplicates.
+
+        Args:
+            user_id (int): The user that sent the request.
+            key (str): The Idempotency-Key header value.
+            fingerprint (str): The fingerprint of the request.
+            execute (Callable[[], Awaitable[Tuple[int, Headers, bytes]]]): Runs the request and returns
+                its status code, headers and body.
+
+        Returns:
+            Response: The response of the request, or of the first request with the same key.
+        """
+        scope = (user_id, key)
+        if scope in self._inflight:
+            self.coalesced += 1
+            return self._replay(await asyncio.shield(self._inflight[scope]), fingerprint)
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[scope] = future
+        try:
+            claimed, stored = await self._claim(user_id, key, fingerprint)
+            if claimed:
+                stored = await self._execute(user_id, key, fingerprint, execute)
+                future.set_result(stored)
+                return stored.response(replayed=False)
+            future.set_result(stored)
+            return self._replay(stored, fingerprint)
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()
+            raise
+        finally:
+            del self._inflight[scope]
+
+    async def sweep(self) -> int:
+        """Deletes the expired keys.
+
+        Returns:
+            int: The number of keys deleted.
+        """
+        async with self.session_factory() as db:
+            result = await db.execute(
+                delete(IdempotencyKeyModel).where(IdempotencyKeyModel.expires_at <= datetime.utcnow())
+            )
+            await db.commit()
+        self.swept += result.rowcount
+        return result.rowcount
+
+    async def start(self):
+        """Starts the background sweep of expired keys."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops the background sweep."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        """Returns the execution and replay counters.
+
+        Returns:
+            dict: The current counters of the store.
+        """
+        return {
+            "in_flight": len(self._inflight),
+            "executed": self.executed,
+            "replayed": self.replayed,
+            "coalesced": self.coalesced,
+            "conflicts": self.conflicts,
+            "unstored": self.unstored,
+            "swept": self.swept,
+        }
+
+    def _replay(self, stored: Optional[StoredResponse], fingerprint: str) -> Response:
+        if stored is None:
+            self.conflicts += 1
+            return key_conflict("A request with this Idempotency-Key is still in progress.", 409)
+        if stored.fingerprint != fingerprint:
+            self.conflicts += 1
+            return key_conflict("Idempotency-Key was already used with a different request.", 422)
+        self.replayed += 1
+        return stored.response(replayed=True)
+
+    async def _claim(self, user_id: int, key: str, fingerprint: str) -> Tuple[bool, Optional[StoredResponse]]:
+        # Either the key is claimed for this request, or the stored response of the request that owns
+        # it is returned; None when that request is still running after the wait timeout.
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.wait_timeout
+        while True:
+            async with self.session_factory() as db:
+                row = await db.scalar(select(IdempotencyKeyModel).where(
+                    IdempotencyKeyModel.user_id == user_id, IdempotencyKeyModel.key == key
+                ))
+                now = datetime.utcnow()
+                if row is not None and row.expires_at <= now:
+                    await db.delete(row)
+                    row = None
+                if row is None:
+                    db.add(IdempotencyKeyModel(user_id=user_id, key=key, fingerprint=fingerprint,
+                                               expires_at=now + timedelta(seconds=self.lock_timeout)))
+                    try:
+                        await db.commit()
+                        return True, None
+                    except IntegrityError:
+                        await db.rollback()
+                        continue
+                if row.status_code is not None or row.fingerprint != fingerprint:
+                    headers = [tuple(header) for header in json.loads(row.response_headers or "[]")]
+                    return False, StoredResponse(row.fingerprint, row.status_code, headers,
+                                                 (row.response_body or "").encode())
+            if loop.time() >= deadline:
+                return False, None
+            await asyncio.sleep(IDEMPOTENCY_POLL_INTERVAL)
+
+    async def _execute(self, user_id: int, key: str, fingerprint: str, execute) -> StoredResponse:
+        self.executed += 1
+        try:
+            status_code, headers, body = await execute()
+        except BaseException:
+            await self._release(user_id, key)
+            raise
+        stored = StoredResponse(fingerprint, status_code, headers, body)
+        if status_code >= 500 or status_code in RETRYABLE_STATUS_CODES:
+            await self._release(user_id, key)
+            return stored
+        try:
+            async with self.session_factory() as db:
+                await db.execute(
+                    update(IdempotencyKeyModel)
+                    .where(IdempotencyKeyModel.user_id == user_id, IdempotencyKeyModel.key == key)
+                    .values(status_code=status_code, response_headers=json.dumps(headers),
+                            response_body=body.decode(),
+                            expires_at=datetime.utcnow() + timedelta(seconds=self.ttl))
+                )
+                await db.commit()
+        except Exception as e:
+            # The request went through: its client gets the real response, and duplicates are answered
+            # 409 until the claim expires after the lock timeout.
+            self.unstored += 1
+            logger.error(f"Error storing the response of Idempotency-Key {key!r}: {e}")
+        return stored
+
+    async def _release(self, user_id: int, key: str):
+        async with self.session_factory() as db:
+            await db.execute(delete(IdempotencyKeyModel).where(
+                IdempotencyKeyModel.user_id == user_id, IdempotencyKeyModel.key == key
+            ))
+            await db.commit()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Error sweeping expired idempotency keys: {e}")
+
+
+idempotency_store = IdempotencyStore()
+
+
+async def idempotency_middleware(request: Request, call_next):
+    key = request.headers.get("Idempotency-Key")
+    if not key or request.method != "POST" or not IDEMPOTENT_PATHS.match(request.url.path):
+        return await call_next(request)
+    _, user_id = bearer_identity(request)
+    if user_id is None:
+        # Let the route reject the request as unauthenticated.
+        return await call_next(request)
+    if len(key) > 255:
+        return key_conflict("Idempotency-Key must be at most 255 characters.", 400)
+
+    body = await request.body()
+    fingerprint = hashlib.sha256(b"\n".join([request.method.encode(), request.url.path.encode(), body])).hexdigest()
+
+    async def execute() -> Tuple[int, Headers, bytes]:
+        response = await call_next(request)
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        return response.status_code, stored_headers(response), body
+
+    return await idempotency_store.run(user_id, key, fingerprint, execute)
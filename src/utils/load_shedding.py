@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Optional
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+from sqlalchemy import text
+
+from src.db.connection import AsyncSessionLocal, pool_status
+from src.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL") or 0.5)
+# Requests are rejected while a pool checkout has waited, or the event loop lags, longer than these seconds.
+LOAD_SHED_POOL_WAIT = float(os.getenv("LOAD_SHED_POOL_WAIT") or 1.0)
+LOAD_SHED_LOOP_LAG = float(os.getenv("LOAD_SHED_LOOP_LAG") or 0.5)
+LOAD_SHED_RETRY_AFTER = int(os.getenv("LOAD_SHED_RETRY_AFTER") or 1)
+READINESS_DB_TIMEOUT = float(os.getenv("READINESS_DB_TIMEOUT") or 2.0)
+
+# Probes and scrapes are always answered, so the load balancer sees why the worker is draining.
+UNSHED_PATHS = {"/health", "/health/stats", "/ready", "/metrics"}
+
+LOOP_LAG = metrics.gauge("payment_event_loop_lag_seconds", "Delay of the event loop in running a scheduled callback.")
+REQUESTS_SHED = metrics.counter("payment_http_requests_shed_total", "Requests rejected with 503 by load shedding.",
+                                ("reason",))
+
+
+class LoopLagMonitor:
+    """Background task that measures how late the event loop wakes up a sleeping task.
+
+    A lag close to zero means the loop is free; a growing lag means callbacks queue
+    behind blocking or CPU-bound work.
+
+    Args:
+        interval (float): Seconds between two measurements.
+    """
+
+    def __init__(self, interval: float = LOOP_LAG_INTERVAL):
+        self.interval = interval
+        self.lag = 0.0
+        self.max_lag = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        """Starts measuring the event loop lag."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops measuring the event loop lag."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        """Returns the last and largest measured lag.
+
+        Returns:
+            dict: The lags in seconds.
+        """
+        return {"lag": round(self.lag, 4), "max_lag": round(self.max_lag, 4)}
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lag = max(loop.time() - expected, 0.0)
+            self.max_lag = max(self.max_lag, self.lag)
+            LOOP_LAG.set(self.lag)
+
+
+loop_monitor = LoopLagMonitor()
+
+
+def overload_reason() -> Optional[str]:
+    """Tells whether the worker is too busy to take more requests.
+
+    Returns:
+        Optional[str]: "pool_wait" or "loop_lag" when a threshold is crossed, None otherwise.
+    """
+    if pool_status()["longest_wait"] > LOAD_SHED_POOL_WAIT:
+        return "pool_wait"
+    if loop_monitor.lag > LOAD_SHED_LOOP_LAG:
+        return "loop_lag"
+    return None
+
+
+async def database_status(timeout: float = READINESS_DB_TIMEOUT) -> dict:
+    """Checks that the database answers a trivial query within a timeout.
+
+    The query goes through the API connection pool, so a saturated pool fails the
+    check as well.
+
+    Args:
+        timeout (float): Maximum seconds to wait for a connection and the answer.
+
+    Returns:
+        dict: Whether the database is reachable, the round trip in ms, and the error if any.
+    """
+    started = time.perf_counter()
+
+    async def ping():
+        async with AsyncSessionLocal() as db:
+            await db.execute(text("SELECT 1"))
+
+    try:
+        await asyncio.wait_for(ping(), timeout)
+    except asyncio.TimeoutError:
+        return {"reachable": False, "error": f"No answer within {timeout} s"}
+    except Exception as e:
+        logger.error(f"Readiness database check failed: {e}")
+        return {"reachable": False, "error": type(e).__name__}
+    return {"reachable": True, "latency_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+
+def service_unavailable(detail: str) -> JSONResponse:
+    return JSONResponse({"detail": detail}, status_code=503, headers={"Retry-After": str(LOAD_SHED_RETRY_AFTER)})
+
+
+async def load_shedding_middleware(request: Request, call_next):
+    if request.url.path in UNSHED_PATHS:
+        return await call_next(request)
+    reason = overload_reason()
+    if reason is not None:
+        REQUESTS_SHED.inc(reason)
+        return service_unavailable("The server is overloaded, retry later.")
+    return await call_next(request)
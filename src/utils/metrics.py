@@ -0,0 +1,308 @@
+import asyncio
+import glob
+import json
+import logging
+import math
+import os
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from fastapi import Request
+
+logger = logging.getLogger(__name__)
+
+# Directory shared by the workers of one deployment; each worker writes its snapshot there.
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR") or None
+METRICS_FLUSH_INTERVAL = float(os.getenv("METRICS_FLUSH_INTERVAL") or 1.0)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Metric:
+    """A named family of samples, one per combination of label values.
+
+    Args:
+        name (str): The metric name.
+        documentation (str): The HELP text.
+        labelnames (Sequence[str]): The names of the labels.
+    """
+    type = "untyped"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def samples(self) -> List[list]:
+        return [[list(labels), value] for labels, value in self._values.items()]
+
+
+class Counter(Metric):
+    """A value that only goes up."""
+    type = "counter"
+
+    def inc(self, *labelvalues: str, amount: float = 1.0):
+        self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+
+class Gauge(Metric):
+    """A value that can go up and down. Workers' values are summed in multi-process mode."""
+    type = "gauge"
+
+    def set(self, value: float, *labelvalues: str):
+        self._values[labelvalues] = value
+
+    def inc(self, *labelvalues: str, amount: float = 1.0):
+        self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+    def dec(self, *labelvalues: str, amount: float = 1.0):
+        self.inc(*labelvalues, amount=-amount)
+
+
+class Histogram(Metric):
+    """Counts observations in fixed buckets, with their sum.
+
+    Args:
+        buckets (Sequence[float]): The upper bounds of the buckets, without +Inf.
+    """
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._histograms: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labelvalues: str):
+        histogram = self._histograms.get(labelvalues)
+        if histogram is None:
+            # One count per bucket plus +Inf, then the sum of the observations.
+            histogram = self._histograms[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+        histogram[bisect_left(self.buckets, value)] += 1
+        histogram[-1] += value
+
+    def samples(self) -> List[list]:
+        return [[list(labels), list(histogram)] for labels, histogram in self._histograms.items()]
+
+
+class MetricsRegistry:
+    """Holds the metrics of the process and renders them in the Prometheus text format.
+
+    With a multiproc_dir every worker periodically writes a JSON snapshot of its
+    metrics to that directory, and a scrape of any worker renders the sum of all
+    snapshots. Gauges of workers that stopped writing are left out of the sum.
+
+    Args:
+        multiproc_dir (str, optional): The directory shared by the workers.
+        flush_interval (float): Seconds between two snapshots of this worker.
+    """
+
+    def __init__(self, multiproc_dir: Optional[str] = METRICS_MULTIPROC_DIR,
+                 flush_interval: float = METRICS_FLUSH_INTERVAL):
+        self.multiproc_dir = multiproc_dir
+        self.flush_interval = flush_interval
+        self.metrics: Dict[str, Metric] = {}
+        self._collectors: List[Callable[[], None]] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def on_collect(self, collector: Callable[[], None]):
+        """Registers a function that refreshes gauges right before they are read.
+
+        Args:
+            collector (Callable[[], None]): The function to call on every snapshot.
+        """
+        self._collectors.append(collector)
+
+    def snapshot(self) -> dict:
+        """Returns the current samples of every metric.
+
+        Returns:
+            dict: The metrics by name, with their type, help text, labels and samples.
+        """
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                logger.error(f"Error collecting metrics: {e}")
+        return {
+            metric.name: {
+                "type": metric.type,
+                "help": metric.documentation,
+                "labelnames": list(metric.labelnames),
+                "buckets": list(getattr(metric, "buckets", [])),
+                "samples": metric.samples(),
+            }
+            for metric in self.metrics.values()
+        }
+
+    def render(self) -> str:
+        """Renders the metrics of this worker, or of every worker in multi-process mode.
+
+        Returns:
+            str: The metrics in the Prometheus text exposition format.
+        """
+        if not self.multiproc_dir:
+            return render_snapshot(self.snapshot())
+        self.write_snapshot()
+        return render_snapshot(self.read_snapshots())
+
+    def write_snapshot(self):
+        """Atomically replaces the snapshot file of this worker."""
+        path = os.path.join(self.multiproc_dir, f"metrics-{os.getpid()}.json")
+        with open(f"{path}.tmp", "w") as file:
+            json.dump(self.snapshot(), file)
+        os.replace(f"{path}.tmp", path)
+
+    def read_snapshots(self) -> dict:
+        """Sums the snapshots of every worker.
+
+        Returns:
+            dict: The merged snapshot.
+        """
+        stale_before = time.time() - 3 * self.flush_interval
+        merged = {}
+        for path in sorted(glob.glob(os.path.join(self.multiproc_dir, "metrics-*.json"))):
+            try:
+                with open(path) as file:
+                    snapshot = json.load(file)
+                stale = os.path.getmtime(path) < stale_before
+            except (OSError, ValueError):
+                continue
+            for name, metric in snapshot.items():
+                if stale and metric["type"] == "gauge":
+                    continue
+                merge_metric(merged.setdefault(name, {**metric, "samples": []}), metric["samples"])
+        return merged
+
+    async def start(self):
+        """Starts writing snapshots in the background when running in multi-process mode."""
+        if self.multiproc_dir and self._task is None:
+            os.makedirs(self.multiproc_dir, exist_ok=True)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops the background snapshots after writing a last one."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self.write_snapshot()
+
+    def _register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    async def _run(self):
+        while True:
+            try:
+                self.write_snapshot()
+            except Exception as e:
+                logger.error(f"Error writing metrics snapshot: {e}")
+            await asyncio.sleep(self.flush_interval)
+
+
+def merge_metric(merged: dict, samples: List[list]):
+    """Adds samples into a merged metric, matching them by label values.
+
+    Args:
+        merged (dict): The merged metric, updated in place.
+        samples (List[list]): The samples of one worker.
+    """
+    index = {tuple(labels): position for position, (labels, _) in enumerate(merged["samples"])}
+    for labels, value in samples:
+        position = index.get(tuple(labels))
+        if position is None:
+            index[tuple(labels)] = len(merged["samples"])
+            merged["samples"].append([labels, value])
+        elif isinstance(value, list):
+            total = merged["samples"][position][1]
+            merged["samples"][position][1] = [left + right for left, right in zip(total, value)]
+        else:
+            merged["samples"][position][1] += value
+
+
+def format_labels(labelnames: Sequence[str], labelvalues: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+def render_snapshot(snapshot: dict) -> str:
+    """Renders a snapshot in the Prometheus text exposition format.
+
+    Args:
+        snapshot (dict): The metrics, as returned by MetricsRegistry.snapshot.
+
+    Returns:
+        str: The exposition text.
+    """
+    lines = []
+    for name in sorted(snapshot):
+        metric = snapshot[name]
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        labelnames = metric["labelnames"]
+        for labels, value in metric["samples"]:
+            if metric["type"] != "histogram":
+                lines.append(f"{name}{format_labels(labelnames, labels)} {format_value(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(metric["buckets"]) + [math.inf], value[:-1]):
+                cumulative += count
+                bucket_labels = format_labels(labelnames, labels, f'le="{format_value(bound)}"')
+                lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labelnames, labels)} {format_value(value[-1])}")
+            lines.append(f"{name}_count{format_labels(labelnames, labels)} {cumulative}")
+    return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+REQUESTS_IN_FLIGHT = metrics.gauge("payment_http_requests_in_flight", "HTTP requests being handled.")
+REQUEST_DURATION = metrics.histogram("payment_http_request_duration_seconds",
+                                     "HTTP request latency by route template.", ("method", "route", "status"))
+
+
+async def metrics_middleware(request: Request, call_next):
+    REQUESTS_IN_FLIGHT.inc()
+    started = time.perf_counter()
+    status = "500"
+    try:
+        response = await call_next(request)
+        status = str(response.status_code)
+        return response
+    finally:
+        REQUESTS_IN_FLIGHT.dec()
+        # The route template keeps the label set bounded, unlike the raw path.
+        route = request.scope.get("route")
+        REQUEST_DURATION.observe(time.perf_counter() - started, request.method,
+                                 route.path if route is not None else "unmatched", status)
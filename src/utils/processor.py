@@ -0,0 +1,353 @@
+import asyncio
+import logging
+import os
+import random
+import time
+import uuid
+from typing import List, Optional, Set, Tuple
+
+import httpx
+
+from src.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Base URL of the payment processor; captures and refunds are only sent to it when set.
+PROCESSOR_URL = os.getenv("PROCESSOR_URL") or None
+PROCESSOR_BATCH_SIZE = int(os.getenv("PROCESSOR_BATCH_SIZE") or 50)
+PROCESSOR_BATCH_WINDOW = float(os.getenv("PROCESSOR_BATCH_WINDOW") or 0.005)
+PROCESSOR_TIMEOUT = float(os.getenv("PROCESSOR_TIMEOUT") or 5.0)
+PROCESSOR_RETRIES = int(os.getenv("PROCESSOR_RETRIES") or 3)
+PROCESSOR_BACKOFF = float(os.getenv("PROCESSOR_BACKOFF") or 0.1)
+PROCESSOR_MAX_CONNECTIONS = int(os.getenv("PROCESSOR_MAX_CONNECTIONS") or 20)
+PROCESSOR_BREAKER_THRESHOLD = int(os.getenv("PROCESSOR_BREAKER_THRESHOLD") or 5)
+PROCESSOR_BREAKER_RESET = float(os.getenv("PROCESSOR_BREAKER_RESET") or 30.0)
+
+# Answers of the processor that a later attempt may not get.
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+PROCESSOR_BATCHES = metrics.counter("payment_processor_batches_total", "Batch calls to the payment processor.",
+                                    ("outcome",))
+PROCESSOR_BATCH_SIZES = metrics.histogram("payment_processor_batch_size", "Payments per processor batch call.",
+                                          buckets=(1, 5, 10, 25, 50, 100, 250, 500))
+PROCESSOR_CIRCUIT_OPEN = metrics.gauge("payment_processor_circuit_open",
+                                       "Whether calls to the payment processor are suspended.")
+
+
+class ProcessorError(Exception):
+    """The processor did not give an answer for a payment."""
+
+
+class ProcessorUnavailable(ProcessorError):
+    """The processor failed, timed out or is suspended by the circuit breaker; the payment may be retried."""
+
+
+class PaymentDeclined(ProcessorError):
+    """The processor answered and refused the payment."""
+
+
+class CircuitBreaker:
+    """Suspends calls to a failing dependency.
+
+    After failure_threshold consecutive failed calls the circuit opens and calls
+    are refused for reset_timeout seconds. A single trial call is then let
+    through: its success closes the circuit, its failure opens it again.
+
+    Args:
+        failure_threshold (int): Consecutive failures that open the circuit.
+        reset_timeout (float): Seconds the circuit stays open before a trial call.
+    """
+
+    def __init__(self, failure_threshold: int = PROCESSOR_BREAKER_THRESHOLD,
+                 reset_timeout: float = PROCESSOR_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened = 0
+        self._opened_at = 0.0
+
+    def blocked(self) -> bool:
+        """Tells whether calls are refused right now, without taking the trial call.
+
+        Returns:
+            bool: True while the circuit is open and the reset timeout has not elapsed,
+            or while the trial call is running.
+        """
+        if self.state == "open":
+            return time.monotonic() - self._opened_at < self.reset_timeout
+        return self.state == "half_open"
+
+    def allow(self) -> bool:
+        """Takes the permission to make a call.
+
+        Returns:
+            bool: True if the call may be made.
+        """
+        if self.state == "closed":
+            return True
+        if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self.state = "half_open"
+            return True
+        return False
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.opened += 1
+            self.state = "open"
+            self._opened_at = time.monotonic()
+
+
+class ProcessorClient:
+    """Async client of the payment processor batch API.
+
+    Payments submitted concurrently are coalesced: they wait at most batch_window
+    seconds, or until batch_size are pending, and are sent together in one
+    POST /payments/batch over a pool of keep-alive connections. Failed calls are
+    retried with jittered exponential backoff, under the same Idempotency-Key,
+    until the earliest deadline of the batch. A circuit breaker fails payments
+    at once while the processor keeps failing.
+
+    Every payment carries a reference the processor deduplicates on, so a payment
+    whose caller gave up at its deadline is not charged twice when retried.
+
+    Args:
+        base_url (str, optional): The URL of the processor; the client is disabled without it.
+        batch_size (int): Maximum number of payments per call.
+        batch_window (float): Maximum seconds a payment waits for others to join its batch.
+        timeout (float): Default seconds a payment waits for its answer.
+        retries (int): Maximum number of retries of a failed call.
+        backoff (float): Base delay, in seconds, of the retries.
+        max_connections (int): Maximum number of connections to the processor.
+        breaker (CircuitBreaker, optional): The circuit breaker of the processor.
+        transport (httpx.AsyncBaseTransport, optional): Transport replacing the network, for tests.
+    """
+
+    def __init__(self, base_url: Optional[str] = PROCESSOR_URL, batch_size: int = PROCESSOR_BATCH_SIZE,
+                 batch_window: float = PROCESSOR_BATCH_WINDOW, timeout: float = PROCESSOR_TIMEOUT,
+                 retries: int = PROCESSOR_RETRIES, backoff: float = PROCESSOR_BACKOFF,
+                 max_connections: int = PROCESSOR_MAX_CONNECTIONS, breaker: Optional[CircuitBreaker] = None,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.base_url = base_url
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_connections = max_connections
+        self.breaker = breaker or CircuitBreaker()
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._pending: List[Tuple[dict, asyncio.Future, float]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._batches: Set[asyncio.Task] = set()
+        self.submitted = 0
+        self.calls = 0
+        self.retried = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.rejected = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.base_url is not None
+
+    async def start(self):
+        """Opens the connection pool to the processor, when one is configured."""
+        if self.enabled and self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url, transport=self.transport, timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+            )
+
+    async def stop(self):
+        """Sends the pending payments, waits for the calls in flight and closes the connections."""
+        if self._client is None:
+            return
+        self._flush()
+        if self._batches:
+            await asyncio.gather(*self._batches, return_exceptions=True)
+        await self._client.aclose()
+        self._client = None
+
+    def stats(self) -> dict:
+        """Returns the call counters and the circuit breaker state.
+
+        Returns:
+            dict: The current counters of the client.
+        """
+        return {
+            "enabled": self.enabled,
+            "pending": len(self._pending),
+            "submitted": self.submitted,
+            "calls": self.calls,
+            "retried": self.retried,
+            "failed": self.failed,
+            "timed_out": self.timed_out,
+            "rejected": self.rejected,
+            "circuit": self.breaker.state,
+        }
+
+    async def submit(self, payment: dict, timeout: Optional[float] = None) -> dict:
+        """Sends a payment to the processor as part of the next batch.
+
+        Args:
+            payment (dict): The payment, with a unique reference.
+            timeout (float, optional): Seconds to wait for the answer, the client timeout by default.
+
+        Returns:
+            dict: The answer of the processor for the payment.
+
+        Raises:
+            ProcessorUnavailable: If the circuit is open, the processor kept failing, or no answer
+                came before the deadline.
+            ProcessorError: If the client is not started or the processor refused the call.
+        """
+        if self._client is None:
+            raise ProcessorError("The processor client is not started.")
+        if self.breaker.blocked():
+            self.rejected += 1
+            raise ProcessorUnavailable("The payment processor is unavailable.")
+        loop = asyncio.get_running_loop()
+        timeout = self.timeout if timeout is None else timeout
+        future = loop.create_future()
+        self._pending.append((payment, future, loop.time() + timeout))
+        self.submitted += 1
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.batch_window, self._flush)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise ProcessorUnavailable(f"No answer from the payment processor within {timeout} s.") from None
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self._pending:
+            batch, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+            task = asyncio.get_running_loop().create_task(self._send(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batches.discard)
+
+    async def _send(self, batch: List[Tuple[dict, asyncio.Future, float]]):
+        loop = asyncio.get_running_loop()
+        expired = [item for item in batch if item[2] <= loop.time()]
+        batch = [item for item in batch if item[2] > loop.time()]
+        fail(expired, ProcessorUnavailable("The payment deadline passed before it was sent."))
+        if not batch:
+            return
+        if not self.breaker.allow():
+            self.rejected += len(batch)
+            fail(batch, ProcessorUnavailable("The payment processor is unavailable."))
+            return
+
+        PROCESSOR_BATCH_SIZES.observe(len(batch))
+        deadline = min(item[2] for item in batch)
+        headers = {"Idempotency-Key": uuid.uuid4().hex}
+        body = {"payments": [payment for payment, _, _ in batch]}
+        error: Exception = ProcessorUnavailable("The payment deadline passed before it was sent.")
+        # Every path records the outcome of the call, or the trial call of a half-open circuit would
+        # keep it half open, and refusing every payment, for good.
+        answered = False
+        try:
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    self.retried += 1
+                    delay = self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                    if loop.time() + delay >= deadline:
+                        break
+                    await asyncio.sleep(delay)
+                self.calls += 1
+                try:
+                    response = await self._client.post("/payments/batch", json=body, headers=headers,
+                                                       timeout=max(deadline - loop.time(), 0.001))
+                except httpx.TransportError as e:
+                    error = ProcessorUnavailable(f"Payment processor call failed: {type(e).__name__}")
+                    continue
+                if response.status_code in RETRYABLE_STATUS_CODES:
+                    error = ProcessorUnavailable(f"Payment processor answered {response.status_code}.")
+                    continue
+                if response.status_code != 200:
+                    # A refused request is a bug on our side, not a sign the processor is down.
+                    answered = True
+                    self.breaker.record_success()
+                    PROCESSOR_BATCHES.inc("refused")
+                    self.failed += len(batch)
+                    fail(batch, ProcessorError(f"Payment processor refused the batch with {response.status_code}."))
+                    return
+                results = batch_results(response)
+                answered = True
+                self.breaker.record_success()
+                PROCESSOR_BATCHES.inc("success")
+                for item, result in zip(batch, results):
+                    if not isinstance(result, dict) or not isinstance(result.get("status"), str):
+                        # Only this payment fails: the other answers of the batch are valid.
+                        self.failed += 1
+                        fail([item], ProcessorError("Malformed answer of the payment processor: "
+                                                    "a result has no status"))
+                    elif not item[1].done():
+                        item[1].set_result(result)
+                if len(results) < len(batch):
+                    self.failed += len(batch) - len(results)
+                    fail(batch, ProcessorError("The payment processor gave no answer for the payment."))
+                return
+        except Exception as e:
+            error = e if isinstance(e, ProcessorError) else ProcessorError(f"Payment processor call failed: {e!r}")
+        finally:
+            if not answered:
+                logger.warning(f"Payment processor batch of {len(batch)} failed: {error}")
+                self.breaker.record_failure()
+                PROCESSOR_BATCHES.inc("failure")
+                self.failed += len(batch)
+                fail(batch, error)
+
+
+def batch_results(response: httpx.Response) -> List[dict]:
+    """Reads the answers of a batch call.
+
+    Args:
+        response (httpx.Response): The 200 response of the processor.
+
+    Returns:
+        List[dict]: The answer for each payment, in batch order.
+
+    Raises:
+        ProcessorError: If the body is not a JSON object with a list of results. Each result is
+            checked by the caller, so a malformed one only fails its own payment.
+    """
+    try:
+        results = response.json()["results"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise ProcessorError(f"Malformed answer of the payment processor: {type(e).__name__}") from e
+    if not isinstance(results, list):
+        raise ProcessorError("Malformed answer of the payment processor: results is not a list")
+    return results
+
+
+def fail(batch: List[Tuple[dict, asyncio.Future, float]], error: Exception):
+    """Fails the waiting payments of a batch.
+
+    Args:
+        batch (List[Tuple[dict, asyncio.Future, float]]): The payments with their futures and deadlines.
+        error (Exception): The error raised to each waiting caller.
+    """
+    for _, future, _ in batch:
+        if not future.done():
+            future.set_exception(error)
+            # Callers that gave up at their deadline no longer await the future.
+            future.exception()
+
+
+processor_client = ProcessorClient()
+metrics.on_collect(lambda: PROCESSOR_CIRCUIT_OPEN.set(1 if processor_client.breaker.state != "closed" else 0))
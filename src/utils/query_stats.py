@@ -0,0 +1,159 @@
+import logging
+import os
+import re
+import time
+from collections import Counter
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from fastapi import Request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS") or 200.0)
+# A statement fingerprint repeated this many times in one request is reported as an N+1 pattern.
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD") or 5)
+QUERY_FINGERPRINTS_MAX = int(os.getenv("QUERY_FINGERPRINTS_MAX") or 1000)
+
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+# asyncpg $1, pyformat %(name)s and named :name placeholders; PostgreSQL ::type casts are kept.
+POSITIONAL_PARAMETER = re.compile(r"\$\d+|%\(\w+\)s|(?<![:\w]):\w+")
+PARAMETER_LIST = re.compile(r"\((?:\s*\?(?:::\w+)?\s*,)+\s*\?(?:::\w+)?\s*\)")
+WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=4096)
+def fingerprint(statement: str) -> str:
+    """Normalizes a SQL statement so executions that only differ by their values match.
+
+    Args:
+        statement (str): The SQL statement as sent to the driver.
+
+    Returns:
+        str: The statement with literals and parameters replaced by ? and IN lists collapsed.
+    """
+    statement = STRING_LITERAL.sub("?", statement)
+    statement = POSITIONAL_PARAMETER.sub("?", statement)
+    statement = NUMBER.sub("?", statement)
+    statement = PARAMETER_LIST.sub("(...)", statement)
+    return WHITESPACE.sub(" ", statement).strip()
+
+
+class QueryStats:
+    """Statements executed while handling one request."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints: Counter = Counter()
+
+    def record(self, statement: str, duration: float):
+        self.count += 1
+        self.duration += duration
+        self.fingerprints[statement] += 1
+
+    def repeated(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> Dict[str, int]:
+        """Returns the fingerprints executed at least threshold times, the usual sign of an N+1 pattern.
+
+        Args:
+            threshold (int): The minimum number of executions.
+
+        Returns:
+            Dict[str, int]: The number of executions of each repeated fingerprint.
+        """
+        return {statement: count for statement, count in self.fingerprints.items() if count >= threshold}
+
+
+class SlowestStatements:
+    """Aggregated timings per statement fingerprint, for the slowest statements report.
+
+    When more than max_size fingerprints are known, the one with the least total
+    time is forgotten.
+
+    Args:
+        max_size (int): Maximum number of fingerprints kept.
+    """
+
+    def __init__(self, max_size: int = QUERY_FINGERPRINTS_MAX):
+        self.max_size = max_size
+        self._statements: Dict[str, List[float]] = {}
+
+    def record(self, statement: str, duration: float):
+        entry = self._statements.get(statement)
+        if entry is None:
+            if len(self._statements) >= self.max_size:
+                del self._statements[min(self._statements, key=lambda key: self._statements[key][1])]
+            entry = self._statements[statement] = [0, 0.0, 0.0]
+        entry[0] += 1
+        entry[1] += duration
+        entry[2] = max(entry[2], duration)
+
+    def top(self, limit: int = 20) -> List[dict]:
+        """Returns the fingerprints with the most total time.
+
+        Args:
+            limit (int): The number of fingerprints to return.
+
+        Returns:
+            List[dict]: The statements with their execution count and total, mean and max time in ms.
+        """
+        ranked = sorted(self._statements.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+        return [
+            {"statement": statement, "count": count, "total_ms": round(total * 1000, 3),
+             "mean_ms": round(total / count * 1000, 3), "max_ms": round(longest * 1000, 3)}
+            for statement, (count, total, longest) in ranked
+        ]
+
+    def clear(self):
+        self._statements.clear()
+
+
+current_query_stats: ContextVar[Optional[QueryStats]] = ContextVar("current_query_stats", default=None)
+slowest_statements = SlowestStatements()
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    duration = time.perf_counter() - conn.info["query_started"].pop()
+    normalized = fingerprint(statement)
+    slowest_statements.record(normalized, duration)
+    stats = current_query_stats.get()
+    if stats is not None:
+        stats.record(normalized, duration)
+    if duration * 1000 >= SLOW_QUERY_THRESHOLD_MS:
+        logger.warning(f"Slow query ({duration * 1000:.1f} ms): {normalized}")
+
+
+def instrument(engine: Engine):
+    """Times every statement executed by an engine.
+
+    Args:
+        engine (Engine): The engine to instrument; use sync_engine for an AsyncEngine.
+    """
+    if not event.contains(engine, "before_cursor_execute", before_cursor_execute):
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+
+async def query_stats_middleware(request: Request, call_next):
+    stats = request.state.query_stats = QueryStats()
+    token = current_query_stats.set(stats)
+    try:
+        response = await call_next(request)
+    finally:
+        current_query_stats.reset(token)
+    if stats.count:
+        response.headers["Server-Timing"] = f'db;dur={stats.duration * 1000:.1f};desc="{stats.count} queries"'
+    repeated = stats.repeated()
+    if repeated:
+        logger.warning(f"Possible N+1 on {request.method} {request.url.path}: " + "; ".join(
+            f"{count}x {statement}" for statement, count in repeated.items()
+        ))
+    return response
@@ -0,0 +1,375 @@
+import fcntl
+import hashlib
+import logging
+import math
+import mmap
+import os
+import struct
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import List, NamedTuple, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import JSONResponse
+
+from src.routes.auth import bearer_identity
+from src.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_ENABLED = (os.getenv("RATE_LIMIT_ENABLED") or "true").lower() == "true"
+# Tokens added per second and bucket capacity of the routes no rule matches.
+RATE_LIMIT_RATE = float(os.getenv("RATE_LIMIT_RATE") or 100)
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST") or 200)
+# Comma-separated "METHOD /path/prefix=rate:burst" rules, the first match wins; METHOD may be *.
+RATE_LIMIT_RULES = os.getenv("RATE_LIMIT_RULES") or "POST /api/v1/transaction/=50:100"
+# "memory" keeps the buckets in the worker; "shared" keeps them in a file under /dev/shm shared by the workers.
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND") or "memory"
+RATE_LIMIT_SHM_PATH = os.getenv("RATE_LIMIT_SHM_PATH") or "/dev/shm/payment-api-rate-limit"
+RATE_LIMIT_BUCKETS = int(os.getenv("RATE_LIMIT_BUCKETS") or 65536)
+
+# Probes and scrapes are never limited.
+UNLIMITED_PATHS = {"/health", "/health/stats", "/ready", "/metrics"}
+
+REQUESTS_LIMITED = metrics.counter("payment_http_requests_rate_limited_total",
+                                   "Requests rejected with 429 by the rate limiter.", ("rule",))
+
+
+class RateLimitRule(NamedTuple):
+    method: str
+    prefix: str
+    rate: float
+    burst: int
+
+    @property
+    def name(self) -> str:
+        return f"{self.method} {self.prefix}"
+
+    def matches(self, method: str, path: str) -> bool:
+        return self.method in ("*", method) and path.startswith(self.prefix)
+
+
+class RateLimitResult(NamedTuple):
+    allowed: bool
+    limit: int
+    remaining: int
+    reset: float
+    retry_after: float
+
+
+def parse_rules(rules: str) -> List[RateLimitRule]:
+    """Parses the rules of the RATE_LIMIT_RULES setting.
+
+    Args:
+        rules (str): Comma-separated "METHOD /path/prefix=rate:burst" rules.
+
+    Returns:
+        List[RateLimitRule]: The rules, in order.
+
+    Raises:
+        ValueError: If a rule is malformed.
+    """
+    parsed = []
+    for rule in filter(None, (rule.strip() for rule in rules.split(","))):
+        try:
+            route, _, limits = rule.rpartition("=")
+            method, prefix = route.split()
+            rate, burst = limits.split(":")
+            parsed.append(RateLimitRule(method.upper(), prefix, float(rate), int(burst)))
+        except ValueError as e:
+            raise ValueError(f"Invalid rate limit rule {rule!r}, expected 'METHOD /path=rate:burst'") from e
+    return parsed
+
+
+def refill(tokens: float, updated: float, now: float, rate: float, burst: int) -> float:
+    return min(float(burst), tokens + max(now - updated, 0.0) * rate)
+
+
+def take(tokens: float, rate: float, burst: int, cost: float) -> Tuple[float, RateLimitResult]:
+    """Takes tokens from a refilled bucket.
+
+    Args:
+        tokens (float): The tokens in the bucket.
+        rate (float): Tokens added per second.
+        burst (int): Capacity of the bucket.
+        cost (float): Tokens the request takes.
+
+    Returns:
+        Tuple[float, RateLimitResult]: The tokens left in the bucket and the outcome of the request.
+    """
+    allowed = tokens >= cost
+    if allowed:
+        tokens -= cost
+    retry_after = 0.0 if allowed else (cost - tokens) / rate
+    return tokens, RateLimitResult(allowed, burst, int(tokens), (burst - tokens) / rate, retry_after)
+
+
+class RateLimitStore(ABC):
+    """Interface of the storage of the token buckets.
+
+    Calls are synchronous: both stores answer in microseconds, without I/O.
+    """
+
+    @abstractmethod
+    def take(self, key: str, rate: float, burst: int, cost: float = 1.0) -> RateLimitResult:
+        ...
+
+    @abstractmethod
+    def reset(self):
+        ...
+
+    @abstractmethod
+    def __len__(self) -> int:
+        ...
+
+
+class MemoryRateLimitStore(RateLimitStore):
+    """Token buckets of one worker, in an LRU dictionary.
+
+    The event loop runs one take at a time, so no lock is needed. The least
+    recently used buckets are evicted beyond max_size; they are the ones most
+    likely to be full again.
+
+    Args:
+        max_size (int): Maximum number of buckets.
+    """
+
+    def __init__(self, max_size: int = RATE_LIMIT_BUCKETS):
+        self.max_size = max_size
+        self._buckets: OrderedDict = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def take(self, key: str, rate: float, burst: int, cost: float = 1.0) -> RateLimitResult:
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        tokens = float(burst) if bucket is None else refill(bucket[0], bucket[1], now, rate, burst)
+        tokens, result = take(tokens, rate, burst, cost)
+        self._buckets[key] = (tokens, now)
+        self._buckets.move_to_end(key)
+        if len(self._buckets) > self.max_size:
+            self._buckets.popitem(last=False)
+        return result
+
+    def reset(self):
+        self._buckets.clear()
+
+
+class SharedMemoryRateLimitStore(RateLimitStore):
+    """Token buckets shared by the workers of one host, in a memory-mapped file.
+
+    The file is an open-addressed table of fixed-size slots holding the hash of
+    the key, the tokens and the time of the last update. A take hashes the key,
+    probes a few slots under an exclusive flock of the file, and updates the slot
+    in place. When the probed slots all belong to other keys, the least recently
+    updated one is reused. The monotonic clock is shared by the processes of a
+    host, so the update times are comparable between workers.
+
+    Args:
+        path (str): The file, preferably on a tmpfs like /dev/shm.
+        slots (int): Number of buckets in the table.
+        probes (int): Slots probed before reusing one.
+    """
+    SLOT = struct.Struct("<Qdd")
+
+    def __init__(self, path: str = RATE_LIMIT_SHM_PATH, slots: int = RATE_LIMIT_BUCKETS, probes: int = 8):
+        self.path = path
+        self.slots = slots
+        self.probes = probes
+        self._fd: Optional[int] = None
+        self._map: Optional[mmap.mmap] = None
+
+    def __len__(self) -> int:
+        self._open()
+        with self._locked():
+            return sum(1 for slot in range(self.slots) if self.SLOT.unpack_from(self._map, slot * self.SLOT.size)[0])
+
+    def take(self, key: str, rate: float, burst: int, cost: float = 1.0) -> RateLimitResult:
+        self._open()
+        digest = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") or 1
+        with self._locked():
+            now = time.monotonic()
+            offset, tokens = self._find(digest, now, rate, burst)
+            tokens, result = take(tokens, rate, burst, cost)
+            self.SLOT.pack_into(self._map, offset, digest, tokens, now)
+        return result
+
+    def reset(self):
+        self._open()
+        with self._locked():
+            self._map[:] = bytes(len(self._map))
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            os.close(self._fd)
+            self._map = None
+            self._fd = None
+
+    def _open(self):
+        if self._map is not None:
+            return
+        size = self.slots * self.SLOT.size
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            # The first worker sizes the file; a resize would move the slots under the others.
+            if os.fstat(fd).st_size == 0:
+                os.ftruncate(fd, size)
+            elif os.fstat(fd).st_size != size:
+                raise ValueError(f"{self.path} holds {os.fstat(fd).st_size // self.SLOT.size} buckets, "
+                                 f"not {self.slots}")
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        self._fd = fd
+        self._map = mmap.mmap(fd, size)
+
+    @contextmanager
+    def _locked(self):
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _find(self, digest: int, now: float, rate: float, burst: int) -> Tuple[int, float]:
+        # Returns the offset of the slot of the key and its refilled tokens.
+        start = digest % self.slots
+        oldest = None
+        for probe in range(self.probes):
+            offset = (start + probe) % self.slots * self.SLOT.size
+            slot_digest, tokens, updated = self.SLOT.unpack_from(self._map, offset)
+            if slot_digest == digest:
+                return offset, refill(tokens, updated, now, rate, burst)
+            if slot_digest == 0:
+                return offset, float(burst)
+            if oldest is None or updated < oldest[1]:
+                oldest = (offset, updated)
+        return oldest[0], float(burst)
+
+
+class RateLimiter:
+    """Token-bucket rate limiter of the API clients.
+
+    A client is the user of the bearer token of the request, or its IP address
+    when the request carries no valid token. Each client has one bucket per rule:
+    a request takes a token from the bucket of the first rule matching its method
+    and path, or of the default limits, and is rejected while the bucket is empty.
+
+    Args:
+        store (RateLimitStore): The storage of the buckets.
+        rules (List[RateLimitRule]): The per-route limits, the first match wins.
+        rate (float): Tokens added per second to the buckets of the default limits.
+        burst (int): Capacity of the buckets of the default limits.
+    """
+
+    def __init__(self, store: RateLimitStore, rules: List[RateLimitRule], rate: float = RATE_LIMIT_RATE,
+                 burst: int = RATE_LIMIT_BURST):
+        self.store = store
+        self.rules = rules
+        self.default = RateLimitRule("*", "/", rate, burst)
+        self.allowed = 0
+        self.limited = 0
+
+    def rule(self, method: str, path: str) -> RateLimitRule:
+        return next((rule for rule in self.rules if rule.matches(method, path)), self.default)
+
+    def check(self, client: str, method: str, path: str) -> Tuple[RateLimitRule, RateLimitResult]:
+        """Takes a token for a request.
+
+        Args:
+            client (str): The client identifier.
+            method (str): The HTTP method of the request.
+            path (str): The path of the request.
+
+        Returns:
+            Tuple[RateLimitRule, RateLimitResult]: The rule applied and whether the request is allowed.
+        """
+        rule = self.rule(method, path)
+        result = self.store.take(f"{rule.name}|{client}", rule.rate, rule.burst)
+        if result.allowed:
+            self.allowed += 1
+        else:
+            self.limited += 1
+            REQUESTS_LIMITED.inc(rule.name)
+        return rule, result
+
+    def reset(self):
+        """Refills every bucket."""
+        self.store.reset()
+
+    def stats(self) -> dict:
+        """Returns the decision counters and the number of buckets.
+
+        Returns:
+            dict: The current counters of the limiter.
+        """
+        return {
+            "enabled": RATE_LIMIT_ENABLED,
+            "backend": type(self.store).__name__,
+            "buckets": len(self.store),
+            "allowed": self.allowed,
+            "limited": self.limited,
+        }
+
+
+def client_identity(request: Request) -> str:
+    """Identifies the client a request is counted against.
+
+    Args:
+        request (Request): The incoming request.
+
+    Returns:
+        str: "user:<id>" for a valid bearer token, "ip:<address>" otherwise.
+    """
+    _, user_id = bearer_identity(request)
+    if user_id is not None:
+        return f"user:{user_id}"
+    return f"ip:{request.client.host if request.client else 'unknown'}"
+
+
+def rate_limit_headers(rule: RateLimitRule, result: RateLimitResult) -> dict:
+    """Builds the RateLimit headers of the IETF httpapi draft for a decision.
+
+    Args:
+        rule (RateLimitRule): The rule applied.
+        result (RateLimitResult): The decision.
+
+    Returns:
+        dict: The headers, with Retry-After when the request is rejected.
+    """
+    headers = {
+        "RateLimit-Limit": str(result.limit),
+        "RateLimit-Remaining": str(result.remaining),
+        "RateLimit-Reset": str(math.ceil(result.reset)),
+        "RateLimit-Policy": f"{rule.burst};w={math.ceil(rule.burst / rule.rate)}",
+    }
+    if not result.allowed:
+        headers["Retry-After"] = str(max(math.ceil(result.retry_after), 1))
+    return headers
+
+
+def create_store(backend: str = RATE_LIMIT_BACKEND) -> RateLimitStore:
+    if backend == "shared":
+        return SharedMemoryRateLimitStore()
+    if backend != "memory":
+        raise ValueError(f"Unknown rate limit backend {backend!r}, expected 'memory' or 'shared'")
+    return MemoryRateLimitStore()
+
+
+rate_limiter = RateLimiter(create_store(), parse_rules(RATE_LIMIT_RULES))
+
+
+async def rate_limit_middleware(request: Request, call_next):
+    if not RATE_LIMIT_ENABLED or request.url.path in UNLIMITED_PATHS:
+        return await call_next(request)
+    rule, result = rate_limiter.check(client_identity(request), request.method, request.url.path)
+    headers = rate_limit_headers(rule, result)
+    if not result.allowed:
+        return JSONResponse({"detail": "Rate limit exceeded, retry later."}, status_code=429, headers=headers)
+    response = await call_next(request)
+    response.headers.update(headers)
+    return response
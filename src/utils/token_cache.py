@@ -0,0 +1,89 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE") or 10000)
+
+
+class TokenCache:
+    """Bounded LRU cache of verified JWT claims.
+
+    Entries are keyed by the SHA-256 digest of the token, so raw bearer tokens are
+    not kept in memory, and expire at the token's own `exp` claim. Only tokens that
+    passed verification are cached; failures are re-verified every time.
+
+    Args:
+        decode (Callable[[str], dict]): Verifies a token and returns its claims. It must raise on
+            invalid or expired tokens.
+        max_size (int): Maximum number of cached tokens.
+    """
+
+    def __init__(self, decode: Callable[[str], dict], max_size: int = TOKEN_CACHE_SIZE):
+        self.decode = decode
+        self.max_size = max_size
+        self._entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, token: str) -> Optional[dict]:
+        """Returns the cached claims of a token without verifying it.
+
+        Args:
+            token (str): The bearer token.
+
+        Returns:
+            Optional[dict]: The claims, or None if the token is not cached or has expired.
+        """
+        key = hashlib.sha256(token.encode()).digest()
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        claims, expires_at = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return claims
+
+    def claims(self, token: str) -> dict:
+        """Returns the claims of a token, verifying it only if it is not cached.
+
+        Args:
+            token (str): The bearer token.
+
+        Returns:
+            dict: The verified claims.
+
+        Raises:
+            Exception: Whatever the decode function raises for an invalid token.
+        """
+        claims = self.get(token)
+        if claims is not None:
+            self.hits += 1
+            return claims
+        self.misses += 1
+        claims = self.decode(token)
+        expires_at = claims.get("exp")
+        if expires_at is not None:
+            self._entries[hashlib.sha256(token.encode()).digest()] = (claims, float(expires_at))
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return claims
+
+    def stats(self) -> dict:
+        """Returns the size and hit counters of the cache.
+
+        Returns:
+            dict: The current counters of the cache.
+        """
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,330 @@
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import random
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set
+from urllib.parse import urlsplit
+
+import httpx
+import orjson
+from sqlalchemy import Row, delete, select, update
+
+from src.db.connection import AsyncSessionLocal
+from src.db.models.merchant import Merchant as MerchantModel
+from src.db.models.webhook_event import WebhookEvent as WebhookEventModel
+from src.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_POLL_INTERVAL = float(os.getenv("WEBHOOK_POLL_INTERVAL") or 5.0)
+WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE") or 100)
+WEBHOOK_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT") or 10.0)
+WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS") or 10)
+WEBHOOK_BACKOFF = float(os.getenv("WEBHOOK_BACKOFF") or 10.0)
+WEBHOOK_MAX_BACKOFF = float(os.getenv("WEBHOOK_MAX_BACKOFF") or 3600.0)
+# Concurrent deliveries to one host, and in total per worker.
+WEBHOOK_PER_DESTINATION = int(os.getenv("WEBHOOK_PER_DESTINATION") or 4)
+WEBHOOK_MAX_IN_FLIGHT = int(os.getenv("WEBHOOK_MAX_IN_FLIGHT") or 100)
+# Seconds a claimed event is hidden from the other workers; a crashed worker's events are retried after it.
+WEBHOOK_LEASE = float(os.getenv("WEBHOOK_LEASE") or 300.0)
+WEBHOOK_RETENTION = int(os.getenv("WEBHOOK_RETENTION") or 7 * 86400)
+WEBHOOK_SWEEP_INTERVAL = float(os.getenv("WEBHOOK_SWEEP_INTERVAL") or 3600.0)
+# Maximum age, in seconds, of a signature timestamp a receiver accepts.
+WEBHOOK_SIGNATURE_TOLERANCE = int(os.getenv("WEBHOOK_SIGNATURE_TOLERANCE") or 300)
+
+WEBHOOK_EVENT_TYPES = {
+    'capture': 'transaction.captured',
+    'refund': 'transaction.refunded',
+}
+
+WEBHOOK_DELIVERIES = metrics.counter("payment_webhook_deliveries_total", "Webhook delivery attempts.", ("outcome",))
+WEBHOOK_IN_FLIGHT = metrics.gauge("payment_webhook_deliveries_in_flight", "Webhook deliveries running.")
+
+
+def sign(secret: str, timestamp: int, body: bytes) -> str:
+    """Computes the Webhook-Signature header of a delivery.
+
+    Args:
+        secret (str): The authentication key of the merchant.
+        timestamp (int): The Unix time of the delivery.
+        body (bytes): The request body.
+
+    Returns:
+        str: "t=<timestamp>,v1=<hex HMAC-SHA256 of '<timestamp>.<body>'>".
+    """
+    digest = hmac.new(secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+
+def verify_signature(secret: str, header: str, body: bytes,
+                     tolerance: int = WEBHOOK_SIGNATURE_TOLERANCE) -> bool:
+    """Checks the Webhook-Signature header of a received delivery, as a merchant would.
+
+    Args:
+        secret (str): The authentication key of the merchant.
+        header (str): The Webhook-Signature header.
+        body (bytes): The raw request body.
+        tolerance (int): Maximum age of the signature, in seconds, against replays.
+
+    Returns:
+        bool: True if the signature matches the body and is recent enough.
+    """
+    try:
+        parts = dict(part.split("=", 1) for part in header.split(","))
+        timestamp = int(parts["t"])
+    except (KeyError, ValueError):
+        return False
+    if abs(time.time() - timestamp) > tolerance:
+        return False
+    return hmac.compare_digest(sign(secret, timestamp, body), f"t={timestamp},v1={parts.get('v1', '')}")
+
+
+class WebhookDispatcher:
+    """Delivers the webhook events of the outbox table to the merchants.
+
+    Events are claimed in id order by moving their next attempt past a lease, with
+    SKIP LOCKED on PostgreSQL, so several workers share the outbox without
+    delivering an event twice. Each event is POSTed as JSON, signed with the
+    authentication key of its merchant, with at most per_destination deliveries
+    to the same host at a time. A 2xx answer marks it delivered; any other outcome
+    schedules a retry with jittered exponential backoff, and the event is
+    dead-lettered after max_attempts failures.
+
+    The dispatcher polls every poll_interval seconds, and at once when notify is
+    called after a local commit wrote events. Delivery is at least once, and
+    events of one merchant may arrive out of order: receivers deduplicate on the
+    Webhook-Id header and order on the transaction updated_at.
+
+    Args:
+        session_factory (async_sessionmaker): Factory for the sessions used to claim and update events.
+        poll_interval (float): Maximum seconds between two looks at the outbox.
+        batch_size (int): Maximum number of events claimed at a time.
+        timeout (float): Seconds a delivery waits for the merchant endpoint.
+        max_attempts (int): Failed attempts after which an event is dead-lettered.
+        backoff (float): Base delay, in seconds, of the retries.
+        max_backoff (float): Maximum delay, in seconds, between two attempts.
+        per_destination (int): Maximum concurrent deliveries to one host.
+        max_in_flight (int): Maximum concurrent deliveries of the dispatcher.
+        lease (float): Seconds a claimed event is hidden from the other workers.
+        transport (httpx.AsyncBaseTransport, optional): Transport replacing the network, for tests.
+    """
+
+    def __init__(self, session_factory=AsyncSessionLocal, poll_interval: float = WEBHOOK_POLL_INTERVAL,
+                 batch_size: int = WEBHOOK_BATCH_SIZE, timeout: float = WEBHOOK_TIMEOUT,
+                 max_attempts: int = WEBHOOK_MAX_ATTEMPTS, backoff: float = WEBHOOK_BACKOFF,
+                 max_backoff: float = WEBHOOK_MAX_BACKOFF, per_destination: int = WEBHOOK_PER_DESTINATION,
+                 max_in_flight: int = WEBHOOK_MAX_IN_FLIGHT, lease: float = WEBHOOK_LEASE,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.session_factory = session_factory
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.per_destination = per_destination
+        self.max_in_flight = max_in_flight
+        self.lease = lease
+        self.transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup = asyncio.Event()
+        self._destinations: Dict[str, asyncio.Semaphore] = {}
+        self._deliveries: Set[asyncio.Task] = set()
+        self._stopping = False
+        self._last_sweep = time.monotonic()
+        self.delivered = 0
+        self.failed = 0
+        self.dead = 0
+        self.swept = 0
+
+    async def start(self):
+        """Opens the HTTP client and starts delivering events."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(transport=self.transport, timeout=self.timeout,
+                                             limits=httpx.Limits(max_connections=self.max_in_flight))
+        if self._task is None:
+            # Semaphores and events are bound to the loop that first waits on them.
+            self._wakeup = asyncio.Event()
+            self._destinations = {}
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stops claiming events, waits for the deliveries in flight and closes the HTTP client.
+
+        Events claimed but not delivered are retried by any worker once their lease expires.
+        """
+        if self._task is not None:
+            # The loop finishes its pass instead of being cancelled in the middle of a claim.
+            self._stopping = True
+            self._wakeup.set()
+            await self._task
+            self._task = None
+        await self.drain()
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def notify(self):
+        """Wakes the dispatcher up after a commit that wrote events."""
+        self._wakeup.set()
+
+    def stats(self) -> dict:
+        """Returns the delivery counters.
+
+        Returns:
+            dict: The current counters of the dispatcher.
+        """
+        return {
+            "in_flight": len(self._deliveries),
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "dead": self.dead,
+            "swept": self.swept,
+        }
+
+    async def dispatch(self) -> int:
+        """Claims the due events and starts delivering them.
+
+        Returns:
+            int: The number of events claimed.
+        """
+        capacity = self.max_in_flight - len(self._deliveries)
+        if capacity <= 0 or self._client is None:
+            return 0
+        events = await self._claim(min(capacity, self.batch_size))
+        for event in events:
+            task = asyncio.get_running_loop().create_task(self._deliver(event))
+            self._deliveries.add(task)
+            task.add_done_callback(self._delivery_done)
+        WEBHOOK_IN_FLIGHT.set(len(self._deliveries))
+        return len(events)
+
+    async def drain(self):
+        """Waits for the deliveries in flight."""
+        if self._deliveries:
+            await asyncio.gather(*self._deliveries, return_exceptions=True)
+
+    async def sweep(self) -> int:
+        """Deletes the delivered events older than the retention period. Dead events are kept.
+
+        Returns:
+            int: The number of events deleted.
+        """
+        async with self.session_factory() as db:
+            result = await db.execute(delete(WebhookEventModel).where(
+                WebhookEventModel.status == "delivered",
+                WebhookEventModel.created_at <= datetime.utcnow() - timedelta(seconds=WEBHOOK_RETENTION),
+            ))
+            await db.commit()
+        self.swept += result.rowcount
+        return result.rowcount
+
+    def _delivery_done(self, task: asyncio.Task):
+        self._deliveries.discard(task)
+        WEBHOOK_IN_FLIGHT.set(len(self._deliveries))
+        # A finished delivery frees a slot for the events that did not fit.
+        self._wakeup.set()
+
+    async def _claim(self, limit: int) -> List[Row]:
+        # The due events with the endpoint and signing key of their merchant.
+        now = datetime.utcnow()
+        async with self.session_factory() as db:
+            rows = (await db.execute(
+                select(WebhookEventModel.id, WebhookEventModel.merchant_id, WebhookEventModel.event_type,
+                       WebhookEventModel.payload, WebhookEventModel.attempts, WebhookEventModel.created_at,
+                       MerchantModel.webhook_url, MerchantModel.authentication_key)
+                .join(MerchantModel, MerchantModel.id == WebhookEventModel.merchant_id)
+                .where(WebhookEventModel.status == "pending", WebhookEventModel.next_attempt_at <= now)
+                .order_by(WebhookEventModel.id)
+                .limit(limit)
+                .with_for_update(of=WebhookEventModel, skip_locked=True)
+            )).all()
+            if not rows:
+                return []
+            await db.execute(
+                update(WebhookEventModel)
+                .where(WebhookEventModel.id.in_([event.id for event in rows]))
+                .values(next_attempt_at=now + timedelta(seconds=self.lease))
+                .execution_options(synchronize_session=False)
+            )
+            await db.commit()
+        return rows
+
+    async def _deliver(self, event: Row):
+        url, secret = event.webhook_url, event.authentication_key
+        if not url:
+            await self._record(event, "The merchant has no webhook URL.", dead=True)
+            return
+        timestamp = int(time.time())
+        body = orjson.dumps({
+            "id": event.id,
+            "type": event.event_type,
+            "created_at": event.created_at.isoformat() + "Z",
+            "data": orjson.loads(event.payload),
+        })
+        headers = {
+            "Content-Type": "application/json",
+            "Webhook-Id": str(event.id),
+            "Webhook-Timestamp": str(timestamp),
+            "Webhook-Signature": sign(secret, timestamp, body),
+        }
+        semaphore = self._destinations.setdefault(urlsplit(url).netloc, asyncio.Semaphore(self.per_destination))
+        async with semaphore:
+            try:
+                response = await self._client.post(url, content=body, headers=headers)
+                error = None if response.is_success else f"Endpoint answered {response.status_code}."
+            except httpx.HTTPError as e:
+                error = f"Delivery failed: {type(e).__name__}"
+        await self._record(event, error)
+
+    async def _record(self, event: Row, error: Optional[str], dead: bool = False):
+        now = datetime.utcnow()
+        if error is None:
+            values = {"status": "delivered", "delivered_at": now, "last_error": None}
+            self.delivered += 1
+            WEBHOOK_DELIVERIES.inc("delivered")
+        elif dead or event.attempts + 1 >= self.max_attempts:
+            values = {"status": "dead", "attempts": event.attempts + 1, "last_error": error}
+            self.dead += 1
+            WEBHOOK_DELIVERIES.inc("dead")
+            logger.warning(f"Webhook event {event.id} of merchant {event.merchant_id} dead-lettered: {error}")
+        else:
+            delay = min(self.backoff * 2 ** event.attempts, self.max_backoff) * random.uniform(0.5, 1.5)
+            values = {"attempts": event.attempts + 1, "last_error": error,
+                      "next_attempt_at": now + timedelta(seconds=delay)}
+            self.failed += 1
+            WEBHOOK_DELIVERIES.inc("failed")
+        try:
+            async with self.session_factory() as db:
+                await db.execute(update(WebhookEventModel).where(WebhookEventModel.id == event.id).values(**values))
+                await db.commit()
+        except Exception as e:
+            # The lease expires and the event is delivered again.
+            logger.error(f"Error recording the delivery of webhook event {event.id}: {e}")
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            if self._stopping:
+                return
+            try:
+                while await self.dispatch() == self.batch_size:
+                    pass
+                if time.monotonic() - self._last_sweep >= WEBHOOK_SWEEP_INTERVAL:
+                    self._last_sweep = time.monotonic()
+                    await self.sweep()
+            except Exception as e:
+                logger.error(f"Error dispatching webhook events: {e}")
+
+
+webhook_dispatcher = WebhookDispatcher()
@@ -0,0 +1,94 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from main import app
+from src.db.connection import AsyncSessionLocal, Base
+from src.db.models.audit_log import AuditLogModel
+from src.routes.auth import token_cache
+from src.utils.audit import AuditLogWriter
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'audit.db'}")
+    factory = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+    async def setup():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+    asyncio.run(setup())
+    yield factory
+    asyncio.run(engine.dispose())
+
+
+def query(factory, statement):
+    async def run():
+        async with factory() as db:
+            return (await db.execute(statement)).all()
+
+    return asyncio.run(run())
+
+
+def make_record(bearer_token=None):
+    return {
+        "user_id": None,
+        "activity_type": "GET",
+        "bearer_token": bearer_token,
+        "ip_address": "127.0.0.1",
+        "path": "/api/v1/customer/",
+        "timestamp": datetime.now(timezone.utc),
+    }
+
+
+def test_writer_flushes_in_batches_and_drains_on_stop(session_factory):
+    writer = AuditLogWriter(session_factory, queue_size=100, batch_size=10, flush_interval=0.05)
+
+    async def scenario():
+        await writer.start()
+        for _ in range(25):
+            writer.enqueue(make_record())
+        await writer.stop()
+
+    asyncio.run(scenario())
+
+    assert query(session_factory, select(func.count()).select_from(AuditLogModel)) == [(25,)]
+    stats = writer.stats()
+    assert stats["written"] == 25
+    assert stats["queue_depth"] == 0
+    assert stats["batches"] >= 3
+
+
+def test_writer_drops_when_queue_is_full(session_factory):
+    writer = AuditLogWriter(session_factory, queue_size=5, batch_size=10, flush_interval=0.05)
+
+    async def scenario():
+        for _ in range(8):
+            writer.enqueue(make_record())
+        await writer.stop()
+
+    asyncio.run(scenario())
+
+    stats = writer.stats()
+    assert stats["enqueued"] == 5
+    assert stats["dropped"] == 3
+    assert stats["written"] == 5
+
+
+def test_middleware_takes_the_user_from_the_verified_token(engine):
+    with TestClient(app) as client:
+        client.post("/api/v1/auth", json={"username": "tester", "password": "secret"})
+        token = client.post("/api/v1/token", data={"username": "tester", "password": "secret"}).json()
+        hits = token_cache.hits
+        client.get("/api/v1/auth/me", headers={"Authorization": f"Bearer {token['access_token']}"})
+        client.get("/health", headers={"Authorization": "Bearer not-a-jwt"})
+        assert token_cache.hits == hits + 1
+
+    rows = query(AsyncSessionLocal, select(AuditLogModel.path, AuditLogModel.user_id))
+    assert dict(rows)["/api/v1/auth/me"] is not None
+    assert dict(rows)["/health"] is None
@@ -0,0 +1,81 @@
+import asyncio
+from decimal import Decimal
+
+from sqlalchemy import func, select
+
+from src.db.balance_slots import compact
+from src.db.connection import AsyncSessionLocal
+from src.db.ledger import check
+from src.db.models.merchant_balance_slot import MerchantBalanceSlot as MerchantBalanceSlotModel
+from test_transaction import balance, process, seed
+
+
+async def slots(merchant_id):
+    async with AsyncSessionLocal() as db:
+        return (await db.execute(
+            select(func.count(), func.sum(MerchantBalanceSlotModel.amount))
+            .where(MerchantBalanceSlotModel.merchant_id == merchant_id)
+        )).one()
+
+
+def test_sharded_captures_go_to_the_slots(engine, client, auth_headers):
+    merchant_id, tokens = asyncio.run(seed([10, 20, 30, 40]))
+    response = client.put(f"/api/v1/merchant/{merchant_id}", headers=auth_headers, json={"balance_shards": 4})
+    assert response.json()["balance_shards"] == 4
+
+    async def capture_all():
+        return await asyncio.gather(*(process(token) for token in tokens))
+
+    assert asyncio.run(capture_all()) == ["success"] * 4
+    assert asyncio.run(slots(merchant_id)) == (4, 100)
+    assert asyncio.run(balance(merchant_id)) == 0
+    assert client.get(f"/api/v1/merchant/{merchant_id}", headers=auth_headers).json()["amount_account"] == 100
+    assert client.get("/api/v1/merchant/", headers=auth_headers).json()["items"][0]["amount_account"] == "100.00"
+
+
+def test_compaction_folds_the_slots_into_the_merchant(engine, client, auth_headers):
+    merchant_id, tokens = asyncio.run(seed([10, 20, 5]))
+    client.put(f"/api/v1/merchant/{merchant_id}", headers=auth_headers, json={"balance_shards": 2})
+    for token, type in zip(tokens, ["capture", "capture", "refund"]):
+        asyncio.run(process(token, type))
+
+    async def compact_all():
+        async with AsyncSessionLocal() as db:
+            compacted = await compact(db)
+        async with AsyncSessionLocal() as db:
+            return compacted, await check(db)
+
+    compacted, problems = asyncio.run(compact_all())
+
+    assert compacted > 0
+    assert asyncio.run(slots(merchant_id)) == (2, 0)
+    assert asyncio.run(balance(merchant_id)) == 25
+    assert problems == {"balances": [], "checkpoints": [], "missing_entries": []}
+
+
+def test_compaction_keeps_the_cents(engine, client, auth_headers):
+    merchant_id, tokens = asyncio.run(seed(["10.55", "20.25", "5.10"]))
+    client.put(f"/api/v1/merchant/{merchant_id}", headers=auth_headers, json={"balance_shards": 2})
+    for token, type in zip(tokens, ["capture", "capture", "refund"]):
+        asyncio.run(process(token, type))
+
+    async def compact_all():
+        async with AsyncSessionLocal() as db:
+            return await compact(db)
+
+    asyncio.run(compact_all())
+
+    assert asyncio.run(slots(merchant_id)) == (2, 0)
+    assert asyncio.run(balance(merchant_id)) == Decimal("25.70")
+    assert client.get("/api/v1/merchant/", headers=auth_headers).json()["items"][0]["amount_account"] == "25.70"
+
+
+def test_setting_the_balance_empties_the_slots(engine, client, auth_headers):
+    merchant_id, tokens = asyncio.run(seed([10]))
+    client.put(f"/api/v1/merchant/{merchant_id}", headers=auth_headers, json={"balance_shards": 2})
+    asyncio.run(process(tokens[0]))
+
+    client.put(f"/api/v1/merchant/{merchant_id}", headers=auth_headers, json={"amount_account": 50})
+
+    assert client.get(f"/api/v1/merchant/{merchant_id}", headers=auth_headers).json()["amount_account"] == 50
+    assert asyncio.run(slots(merchant_id)) == (2, 0)
@@ -0,0 +1,112 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import update
+
+from src.db.connection import AsyncSessionLocal
+from src.db.models.merchant import Merchant as MerchantModel
+from src.db.operations import merchant_cache
+from src.utils import cache as cache_module
+from src.utils.cache import CacheBackend, LRUCache, ReadThroughCache
+
+
+def test_concurrent_misses_share_one_load():
+    cache = ReadThroughCache("test")
+    loads = []
+
+    async def load():
+        loads.append(1)
+        await asyncio.sleep(0.01)
+        return {"id": 1, "name": "Customer"}
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get_or_load(1, load) for _ in range(20)))
+
+    results = asyncio.run(scenario())
+
+    assert len(loads) == 1
+    assert {result.name for result in results} == {"Customer"}
+    assert cache.stats()["coalesced"] == 19
+
+
+def test_entries_expire():
+    cache = LRUCache(max_size=2, ttl=0)
+    cache.set(1, "value")
+
+    assert cache.get(1) is None
+
+
+def test_invalidation_during_a_load_is_not_overwritten():
+    cache = ReadThroughCache("test")
+
+    async def scenario():
+        async def load():
+            await cache.invalidate(1)
+            return {"id": 1, "name": "Stale"}
+
+        await cache.get_or_load(1, load)
+        return cache.local.get(1)
+
+    assert asyncio.run(scenario()) is None
+
+
+def test_update_invalidates_the_cached_customer(client, auth_headers, customer_id):
+    url = f"/api/v1/customer/{customer_id}"
+    assert client.get(url, headers=auth_headers).json()["name"] == "Customer"
+
+    client.put(url, headers=auth_headers, json={"name": "Renamed"})
+
+    assert client.get(url, headers=auth_headers).json()["name"] == "Renamed"
+    assert client.get("/health/stats").json()["customer_cache"]["invalidations"] == 1
+
+
+def capture(client, auth_headers, customer_id, merchant_id):
+    transaction = client.post("/api/v1/transaction/", headers=auth_headers,
+                              json={"merchant_id": merchant_id, "customer_id": customer_id, "amount": "10.00",
+                                    "currency": "USD", "hash_credit_card": "card"}).json()
+    return client.post(f"/api/v1/transaction/process/{transaction['token']}", headers=auth_headers)
+
+
+def test_captures_keep_the_cached_merchant(client, auth_headers, customer_id, merchant_id):
+    url = f"/api/v1/merchant/{merchant_id}"
+    assert client.get(url, headers=auth_headers).json()["amount_account"] == 0
+    before = merchant_cache.stats()
+
+    responses = [capture(client, auth_headers, customer_id, merchant_id) for _ in range(2)]
+
+    assert [response.status_code for response in responses] == [200, 200]
+    assert client.get(url, headers=auth_headers).json()["amount_account"] == 20
+    after = merchant_cache.stats()
+    assert [after[key] - before[key] for key in ("misses", "hits", "invalidations")] == [1, 1, 0]
+    assert "amount_account" not in merchant_cache.local.get(merchant_id)
+
+
+def test_merchant_updates_of_other_workers_apply_after_the_ttl(client, auth_headers, customer_id, merchant_id,
+                                                                 monkeypatch):
+    assert capture(client, auth_headers, customer_id, merchant_id).status_code == 200
+
+    async def deactivate():
+        # Another worker's update_merchant: the database changes, this process's snapshot does not.
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(MerchantModel).where(MerchantModel.id == merchant_id).values(is_active=False))
+            await db.commit()
+
+    asyncio.run(deactivate())
+
+    assert capture(client, auth_headers, customer_id, merchant_id).status_code == 200
+    expired = time.monotonic() + merchant_cache.local.ttl
+    monkeypatch.setattr(cache_module, "time", SimpleNamespace(monotonic=lambda: expired))
+    response = capture(client, auth_headers, customer_id, merchant_id)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Merchant not found or not active."
+
+
+def test_cache_backends_must_implement_the_interface():
+    class Incomplete(CacheBackend):
+        async def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        Incomplete()
@@ -0,0 +1,107 @@
+import asyncio
+import functools
+import json
+import threading
+import time
+import uuid
+from decimal import Decimal
+
+from src.db.connection import AsyncSessionLocal
+from src.db.models.transaction import Transaction as TransactionModel
+from src.utils.event_stream import NOTIFY_PAYLOAD_MAX, TransactionEventBroker, notify_payloads, transaction_events
+
+
+def event(merchant_id, token="token"):
+    return {"merchant_id": merchant_id, "event_type": "transaction.captured",
+            "payload": json.dumps({"token": token, "state": "success"})}
+
+
+async def read(broker, subscription, count, **options):
+    messages = []
+    async for message in broker.stream(subscription, **options):
+        messages.append(message)
+        if len(messages) == count:
+            break
+    return messages
+
+
+def test_events_reach_the_subscribers_of_their_merchant():
+    async def scenario():
+        broker = TransactionEventBroker()
+        first, second, other = broker.subscribe(1), broker.subscribe(1), broker.subscribe(2)
+        broker.publish([event(1, "a"), event(3, "b")])
+        messages = await asyncio.gather(read(broker, first, 2), read(broker, second, 2),
+                                        read(broker, other, 2, heartbeat=0.01))
+        return messages, broker.stats()
+
+    (first, second, other), stats = asyncio.run(scenario())
+
+    assert first == second == ["retry: 3000\n\n",
+                               'event: transaction.captured\ndata: {"token": "a", "state": "success"}\n\n']
+    assert other == ["retry: 3000\n\n", ": keep-alive\n\n"]
+    assert stats["delivered"] == 2
+    assert stats["subscribers"] == 0
+
+
+def test_slow_consumers_are_evicted():
+    async def scenario():
+        broker = TransactionEventBroker(buffer_size=2)
+        slow, fast = broker.subscribe(1), broker.subscribe(1)
+        broker.publish([event(1, "a"), event(1, "b")])
+        fast_messages = await read(broker, fast, 3)
+        broker.publish([event(1, "c")])
+        return await read(broker, slow, 10), fast_messages, broker.stats()
+
+    slow, fast, stats = asyncio.run(scenario())
+
+    assert slow == ["retry: 3000\n\n",
+                    'event: evicted\ndata: {"detail": "The stream fell behind, reconnect."}\n\n']
+    assert len(fast) == 3
+    assert stats["evicted"] == 1
+
+
+def test_notify_payloads_fit_in_a_notification():
+    events = [event(1, str(n) * 100) for n in range(200)]
+
+    payloads = notify_payloads(events)
+
+    assert len(payloads) > 1
+    assert all(len(payload) <= NOTIFY_PAYLOAD_MAX for payload in payloads)
+    assert [item["payload"] for payload in payloads for item in json.loads(payload)] == \
+        [item["payload"] for item in events]
+
+
+def test_merchant_stream_receives_captures(client, auth_headers, customer_id, merchant_id, monkeypatch):
+    monkeypatch.setattr(transaction_events, "stream",
+                        functools.partial(transaction_events.stream, max_duration=1.0))
+
+    async def create_transaction():
+        async with AsyncSessionLocal() as db:
+            transaction = TransactionModel(merchant_id=merchant_id, customer_id=customer_id, amount=Decimal(10),
+                                           currency="USD", hash_credit_card="card", token=str(uuid.uuid4()),
+                                           state="pending")
+            db.add(transaction)
+            await db.commit()
+            return transaction.token
+
+    token = asyncio.run(create_transaction())
+
+    def capture():
+        deadline = time.monotonic() + 1
+        while not transaction_events.stats()["subscribers"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        client.post(f"/api/v1/transaction/process/{token}", headers=auth_headers)
+
+    thread = threading.Thread(target=capture)
+    thread.start()
+    response = client.get(f"/api/v1/merchant/{merchant_id}/events", headers=auth_headers)
+    thread.join()
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    messages = [message for message in response.text.split("\n\n") if message.startswith("event:")]
+    assert len(messages) == 1
+    event_type, data = messages[0].split("\n")
+    assert event_type == "event: transaction.captured"
+    assert json.loads(data.removeprefix("data: "))["token"] == token
+    assert client.get("/api/v1/merchant/999/events", headers=auth_headers).status_code == 404
@@ -0,0 +1,59 @@
+import asyncio
+import csv
+import io
+import json
+
+import pytest
+
+from src.db.operations import stream_transactions_by_merchant_id
+
+
+@pytest.fixture
+def transactions(client, auth_headers, customer_id, merchant_id):
+    return [
+        client.post("/api/v1/transaction/", headers=auth_headers,
+                    json={"merchant_id": merchant_id, "customer_id": customer_id, "amount": amount,
+                          "currency": "USD", "hash_credit_card": "card"}).json()
+        for amount in ("10.00", "20.50", "30.25")
+    ]
+
+
+def test_csv_export_matches_the_api_representation(client, auth_headers, merchant_id, transactions):
+    response = client.get(f"/api/v1/merchant/{merchant_id}/transactions/export", headers=auth_headers)
+
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert response.headers["content-type"].startswith("text/csv")
+    assert response.headers["content-disposition"] == \
+        f'attachment; filename="merchant-{merchant_id}-transactions.csv"'
+    assert [row["token"] for row in rows] == [transaction["token"] for transaction in transactions]
+    assert [row["amount"] for row in rows] == ["10.00", "20.50", "30.25"]
+    assert rows[0]["created_at"] == transactions[0]["created_at"]
+
+
+def test_ndjson_export_matches_the_api_representation(client, auth_headers, merchant_id, transactions):
+    response = client.get(f"/api/v1/merchant/{merchant_id}/transactions/export", headers=auth_headers,
+                          params={"format": "ndjson"})
+
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert lines == [{key: transaction[key] for key in lines[0]} for transaction in transactions]
+
+
+def test_export_of_unknown_merchant(client, auth_headers):
+    response = client.get("/api/v1/merchant/999/transactions/export", headers=auth_headers)
+
+    assert response.status_code == 404
+
+
+def test_export_rejects_unknown_format(client, auth_headers, merchant_id):
+    response = client.get(f"/api/v1/merchant/{merchant_id}/transactions/export", headers=auth_headers,
+                          params={"format": "xml"})
+
+    assert response.status_code == 422
+
+
+def test_rows_are_fetched_in_batches(merchant_id, transactions):
+    async def batches():
+        return [len(rows) async for rows in stream_transactions_by_merchant_id(merchant_id, batch_size=2)]
+
+    assert asyncio.run(batches()) == [2, 1]
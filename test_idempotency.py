@@ -0,0 +1,143 @@
+import asyncio
+
+from src.utils.idempotency import IdempotencyStore
+
+
+def create(client, headers, customer_id, merchant_id, amount="10.00"):
+    return client.post("/api/v1/transaction/", headers=headers,
+                       json={"merchant_id": merchant_id, "customer_id": customer_id, "amount": amount,
+                             "currency": "USD", "hash_credit_card": "card"})
+
+
+def test_retried_create_returns_the_first_transaction(client, auth_headers, customer_id, merchant_id):
+    headers = {**auth_headers, "Idempotency-Key": "create-1"}
+
+    first = create(client, headers, customer_id, merchant_id)
+    retry = create(client, headers, customer_id, merchant_id)
+
+    assert retry.status_code == 200
+    assert retry.json() == first.json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+    assert retry.headers["content-type"] == first.headers["content-type"]
+    assert "RateLimit-Remaining" in retry.headers
+
+
+def test_retried_bulk_create_returns_the_first_transactions(client, auth_headers, customer_id, merchant_id):
+    headers = {**auth_headers, "Idempotency-Key": "bulk-1"}
+    item = {"merchant_id": merchant_id, "customer_id": customer_id, "amount": "10.00", "currency": "USD",
+            "hash_credit_card": "card"}
+
+    first, retry = [client.post("/api/v1/transaction/bulk", headers=headers, json={"items": [item, item]})
+                    for _ in range(2)]
+
+    assert retry.status_code == 200
+    assert retry.json() == first.json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    transactions = client.get(f"/api/v1/merchant/{merchant_id}/transactions", headers=auth_headers).json()
+    assert len(transactions["items"]) == 2
+
+
+def test_key_reused_with_another_body_is_rejected(client, auth_headers, customer_id, merchant_id):
+    headers = {**auth_headers, "Idempotency-Key": "create-2"}
+    create(client, headers, customer_id, merchant_id)
+
+    response = create(client, headers, customer_id, merchant_id, amount="20.00")
+
+    assert response.status_code == 422
+
+
+def test_retried_capture_replays_success(client, auth_headers, customer_id, merchant_id):
+    token = create(client, auth_headers, customer_id, merchant_id).json()["token"]
+    headers = {**auth_headers, "Idempotency-Key": "capture-1"}
+
+    responses = [client.post(f"/api/v1/transaction/process/{token}", headers=headers) for _ in range(2)]
+
+    assert [response.json()["state"] for response in responses] == ["success", "success"]
+    assert client.get(f"/api/v1/merchant/{merchant_id}", headers=auth_headers).json()["amount_account"] == 10
+
+
+def test_concurrent_duplicates_wait_for_the_first_execution(engine):
+    store = IdempotencyStore()
+    calls = []
+
+    async def execute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 200, [], b'{"state": "success"}'
+
+    async def scenario():
+        return await asyncio.gather(*(store.run(1, "key", "fingerprint", execute) for _ in range(5)))
+
+    responses = asyncio.run(scenario())
+
+    assert len(calls) == 1
+    assert {response.body for response in responses} == {b'{"state": "success"}'}
+    assert store.stats()["coalesced"] == 4
+
+
+def test_server_errors_are_not_stored(engine):
+    store = IdempotencyStore()
+    statuses = iter([500, 200])
+
+    async def execute():
+        return next(statuses), [], b"{}"
+
+    async def scenario():
+        return [(await store.run(1, "key", "fingerprint", execute)).status_code for _ in range(2)]
+
+    assert asyncio.run(scenario()) == [500, 200]
+
+
+def test_sweep_deletes_expired_keys(engine):
+    store = IdempotencyStore(ttl=0)
+
+    async def execute():
+        return 200, [], b"{}"
+
+    async def scenario():
+        await store.run(1, "key", "fingerprint", execute)
+        return await store.sweep()
+
+    assert asyncio.run(scenario()) == 1
+
+
+def test_replays_keep_the_stored_headers(engine):
+    headers = [("content-type", "application/json"), ("location", "/api/v1/transaction/1")]
+
+    async def execute():
+        return 201, headers, b'{"id": 1}'
+
+    async def scenario():
+        await IdempotencyStore().run(1, "key", "fingerprint", execute)
+        # A new store reads the response from the database, as another worker would.
+        return await IdempotencyStore().run(1, "key", "fingerprint", execute)
+
+    response = asyncio.run(scenario())
+
+    assert response.status_code == 201
+    assert response.headers["location"] == "/api/v1/transaction/1"
+    assert response.headers["content-type"] == "application/json"
+    assert response.headers["Idempotent-Replayed"] == "true"
+
+
+class BrokenSession:
+    async def __aenter__(self):
+        raise ConnectionError("The database is unreachable.")
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+def test_response_is_returned_when_it_cannot_be_stored(engine):
+    store = IdempotencyStore()
+
+    async def execute():
+        store.session_factory = BrokenSession
+        return 200, [], b'{"state": "success"}'
+
+    response = asyncio.run(store.run(1, "key", "fingerprint", execute))
+
+    assert response.status_code == 200
+    assert response.body == b'{"state": "success"}'
+    assert store.stats()["unstored"] == 1
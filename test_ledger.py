@@ -0,0 +1,115 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import update
+
+from src.db.balance_slots import compact, create_slots
+from src.db.connection import AsyncSessionLocal
+from src.db.ledger import check, create_checkpoints, merchant_balance, rebuild
+from src.db.models.merchant import Merchant as MerchantModel
+from src.db.models.transaction import Transaction as TransactionModel
+from test_transaction import process, seed
+
+
+async def in_session(function, *args, **kwargs):
+    async with AsyncSessionLocal() as db:
+        return await function(db, *args, **kwargs)
+
+
+def test_balance_is_checkpoint_plus_later_entries(engine):
+    async def scenario():
+        merchant_id, tokens = await seed([10, 20, 30, 5])
+        await process(tokens[0])
+        await process(tokens[1])
+        checkpoints = await in_session(create_checkpoints, min_entries=1, lag=0)
+        between = datetime.utcnow()
+        await asyncio.sleep(0.01)
+        await process(tokens[2])
+        await process(tokens[3], "refund")
+        return (checkpoints, await in_session(merchant_balance, merchant_id),
+                await in_session(merchant_balance, merchant_id, between),
+                await in_session(merchant_balance, merchant_id, between - timedelta(days=1)))
+
+    assert asyncio.run(scenario()) == (1, Decimal(55), Decimal(30), Decimal(0))
+
+
+def test_checkpoints_skip_merchants_with_few_new_entries(engine):
+    async def scenario():
+        _, tokens = await seed([10])
+        await process(tokens[0])
+        return await in_session(create_checkpoints, min_entries=2, lag=0)
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_batch_capture_writes_one_entry_per_transaction(engine, client, auth_headers):
+    merchant_id, tokens = asyncio.run(seed([10, 20]))
+
+    client.post("/api/v1/transaction/process/batch", headers=auth_headers, json={"tokens": tokens})
+
+    response = client.get(f"/api/v1/merchant/{merchant_id}/balance", headers=auth_headers)
+    assert response.json() == {"merchant_id": merchant_id, "balance": "30.00", "as_of": None}
+    assert asyncio.run(in_session(check)) == {"balances": [], "checkpoints": [], "missing_entries": []}
+
+
+def test_balance_as_of_a_time_with_a_timezone(engine, client, auth_headers):
+    merchant_id, tokens = asyncio.run(seed([10]))
+    before = datetime.utcnow() - timedelta(hours=1)
+    client.post(f"/api/v1/transaction/process/{tokens[0]}", headers=auth_headers)
+    after = datetime.utcnow() + timedelta(hours=1)
+    url = f"/api/v1/merchant/{merchant_id}/balance"
+
+    earlier = client.get(url, headers=auth_headers, params={"as_of": before.isoformat() + "Z"}).json()
+    later = client.get(url, headers=auth_headers, params={"as_of": (after + timedelta(hours=2)).isoformat() + "+02:00"})
+
+    assert earlier["balance"] == "0.00"
+    assert later.json() == {"merchant_id": merchant_id, "balance": "10.00",
+                            "as_of": after.isoformat(timespec="microseconds")}
+
+
+def test_rebuild_repairs_what_the_checker_reports(engine):
+    async def scenario():
+        merchant_id, tokens = await seed([10, 20])
+        await process(tokens[0])
+        async with AsyncSessionLocal() as db:
+            db.add(TransactionModel(merchant_id=merchant_id, customer_id=1, amount=7, currency="USD",
+                                    hash_credit_card="card", token=str(uuid.uuid4()), state="success"))
+            await db.execute(update(MerchantModel).values(amount_account=99))
+            await db.commit()
+        problems = await in_session(check)
+        result = await in_session(rebuild, sync_balances=True)
+        return problems, result, await in_session(check), await in_session(merchant_balance, merchant_id)
+
+    problems, result, after, balance = asyncio.run(scenario())
+
+    assert [row["amount_account"] for row in problems["balances"]] == [99]
+    assert len(problems["missing_entries"]) == 1
+    assert result == {"backfilled": 1, "checkpoints": 1, "synced": 1}
+    assert after == {"balances": [], "checkpoints": [], "missing_entries": []}
+    assert balance == Decimal(17)
+
+
+def test_cent_amounts_are_consistent(engine):
+    async def scenario():
+        merchant_id, tokens = await seed(["10.55", "20.25", "5.10"])
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(MerchantModel).values(balance_shards=2))
+            await create_slots(db, merchant_id, 2)
+            await db.commit()
+        for token, type in zip(tokens, ["capture", "capture", "refund"]):
+            await process(token, type)
+        await in_session(compact)
+        await in_session(create_checkpoints, min_entries=1, lag=0)
+        problems = await in_session(check)
+        await in_session(rebuild, sync_balances=True)
+        async with AsyncSessionLocal() as db:
+            synced = await db.get(MerchantModel, merchant_id)
+            return problems, synced.amount_account, await in_session(check)
+
+    problems, synced, after = asyncio.run(scenario())
+
+    assert problems == {"balances": [], "checkpoints": [], "missing_entries": []}
+    assert synced == Decimal("25.70")
+    assert after == {"balances": [], "checkpoints": [], "missing_entries": []}
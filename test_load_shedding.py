@@ -0,0 +1,55 @@
+import asyncio
+import time
+
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from src.utils import load_shedding
+from src.utils.load_shedding import LoopLagMonitor, loop_monitor
+
+
+def test_loop_lag_is_measured():
+    async def block_loop():
+        monitor = LoopLagMonitor(interval=0.01)
+        await monitor.start()
+        await asyncio.sleep(0.02)
+        time.sleep(0.2)
+        await asyncio.sleep(0.02)
+        await monitor.stop()
+        return monitor.stats()
+
+    stats = asyncio.run(block_loop())
+
+    assert stats["max_lag"] >= 0.15
+
+
+def test_ready_reports_database_and_pool(client):
+    response = client.get("/ready")
+
+    assert response.status_code == 200
+    body = response.json()
+    assert body["status"] == "ready"
+    assert body["database"]["reachable"] is True
+    assert body["pool"]["utilization"] == 0.0
+
+
+def test_ready_fails_when_database_is_unreachable(client, tmp_path, monkeypatch):
+    unreachable = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'missing' / 'test.db'}")
+    monkeypatch.setattr(load_shedding, "AsyncSessionLocal", async_sessionmaker(bind=unreachable))
+
+    response = client.get("/ready")
+
+    assert response.status_code == 503
+    assert response.json()["reason"] == "database"
+
+
+def test_requests_are_shed_while_the_loop_lags(client, auth_headers, monkeypatch):
+    monkeypatch.setattr(loop_monitor, "lag", load_shedding.LOAD_SHED_LOOP_LAG + 1)
+
+    response = client.get("/api/v1/merchant/", headers=auth_headers)
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == str(load_shedding.LOAD_SHED_RETRY_AFTER)
+    assert client.get("/health").status_code == 200
+    ready = client.get("/ready")
+    assert ready.status_code == 503
+    assert ready.json()["reason"] == "loop_lag"
@@ -0,0 +1,60 @@
+import json
+import os
+import time
+
+from src.utils.metrics import MetricsRegistry, render_snapshot
+
+
+def sample(text, prefix):
+    return [float(line.rsplit(" ", 1)[1]) for line in text.splitlines() if line.startswith(prefix)]
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry(multiproc_dir=None)
+    latency = registry.histogram("latency_seconds", "Latency.", ("route",), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3):
+        latency.observe(value, "/a")
+
+    text = render_snapshot(registry.snapshot())
+
+    assert 'latency_seconds_bucket{route="/a",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{route="/a",le="1"} 3' in text
+    assert 'latency_seconds_bucket{route="/a",le="+Inf"} 4' in text
+    assert 'latency_seconds_count{route="/a"} 4' in text
+    assert "# TYPE latency_seconds histogram" in text
+
+
+def test_workers_are_summed_and_stale_gauges_dropped(tmp_path):
+    workers = [MetricsRegistry(multiproc_dir=str(tmp_path), flush_interval=1) for _ in range(2)]
+    for pid, registry in enumerate(workers):
+        registry.counter("requests_total", "Requests.").inc(amount=pid + 1)
+        registry.gauge("in_flight", "In flight.").set(5)
+        path = tmp_path / f"metrics-{pid}.json"
+        with open(path, "w") as file:
+            json.dump(registry.snapshot(), file)
+    stale = time.time() - 60
+    os.utime(tmp_path / "metrics-0.json", (stale, stale))
+
+    text = render_snapshot(workers[0].read_snapshots())
+
+    assert sample(text, "requests_total") == [3]
+    assert sample(text, "in_flight") == [5]
+
+
+def test_metrics_endpoint_reports_routes_and_transitions(client, auth_headers, customer_id, merchant_id):
+    transaction = client.post("/api/v1/transaction/", headers=auth_headers,
+                              json={"merchant_id": merchant_id, "customer_id": customer_id, "amount": "10.00",
+                                    "currency": "USD", "hash_credit_card": "card"}).json()
+    before = sample(client.get("/metrics").text,
+                    'payment_transaction_transitions_total{from_state="pending",to_state="success"}') or [0]
+
+    client.post(f"/api/v1/transaction/process/{transaction['token']}", headers=auth_headers)
+    response = client.get("/metrics")
+
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert sample(response.text,
+                  'payment_transaction_transitions_total{from_state="pending",to_state="success"}') == [before[0] + 1]
+    assert sample(response.text, 'payment_http_request_duration_seconds_count{method="POST",'
+                                 'route="/api/v1/transaction/process/{token}",status="200"}')[0] >= 1
+    assert "payment_db_pool_checked_out" in response.text
+    assert "payment_audit_queue_depth" in response.text
@@ -0,0 +1,71 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+from src.db.connection import AsyncSessionLocal
+from src.db.models.transaction import Transaction as TransactionModel
+from src.db.pagination import decode_cursor, encode_cursor
+
+START = datetime(2024, 1, 1)
+
+
+@pytest.fixture
+def transactions(client, customer_id, merchant_id):
+    """Seven transactions, two of them sharing a timestamp, every third one refunded."""
+    async def seed():
+        async with AsyncSessionLocal() as db:
+            db.add_all([
+                TransactionModel(merchant_id=merchant_id, customer_id=customer_id, amount=index, currency="USD",
+                                 hash_credit_card="card", token=str(uuid.uuid4()),
+                                 state="refunded" if index % 3 == 0 else "pending",
+                                 created_at=START + timedelta(days=min(index, 5)))
+                for index in range(7)
+            ])
+            await db.commit()
+
+    asyncio.run(seed())
+
+
+def read_all(client, url, headers, **params):
+    pages, cursor = [], None
+    while True:
+        response = client.get(url, headers=headers, params={**params, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        page = response.json()
+        pages.append([item["id"] for item in page["items"]])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return pages
+
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(START, 42)) == (START, 42)
+
+
+def test_invalid_cursor_is_rejected(client, auth_headers):
+    response = client.get("/api/v1/customer/", headers=auth_headers, params={"cursor": "not-a-cursor"})
+
+    assert response.status_code == 400
+
+
+def test_pages_cover_every_transaction_once_newest_first(client, auth_headers, merchant_id, transactions):
+    pages = read_all(client, f"/api/v1/merchant/{merchant_id}/transactions", auth_headers, limit=3)
+
+    assert pages == [[7, 6, 5], [4, 3, 2], [1]]
+
+
+def test_transaction_filters(client, auth_headers, customer_id, transactions):
+    pages = read_all(client, f"/api/v1/customer/{customer_id}/transactions", auth_headers, limit=2,
+                     state="pending", created_from=(START + timedelta(days=1)).isoformat(),
+                     created_to=(START + timedelta(days=5)).isoformat())
+
+    assert pages == [[5, 3], [2]]
+
+
+def test_customer_listing(client, auth_headers, customer_id):
+    response = client.get("/api/v1/customer/", headers=auth_headers)
+
+    assert [item["id"] for item in response.json()["items"]] == [customer_id]
+    assert response.json()["next_cursor"] is None
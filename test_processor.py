@@ -0,0 +1,284 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi import Request
+from sqlalchemy import select
+
+from benchmarks.fake_processor import FakeProcessor
+from src.db import operations
+from src.db.connection import AsyncSessionLocal
+from src.db.models.transaction import Transaction as TransactionModel
+from src.utils.processor import CircuitBreaker, ProcessorClient, ProcessorError, ProcessorUnavailable, processor_client
+
+
+async def run_client(fake, submit, **options):
+    client = ProcessorClient("http://processor", transport=httpx.ASGITransport(app=fake.app), **options)
+    await client.start()
+    try:
+        return await submit(client)
+    finally:
+        await client.stop()
+
+
+def payment(reference, card="card"):
+    return {"reference": reference, "type": "capture", "amount": "10.00", "currency": "USD", "card": card,
+            "merchant_id": 1}
+
+
+def test_concurrent_payments_are_sent_in_batches():
+    fake = FakeProcessor()
+
+    async def submit(client):
+        return await asyncio.gather(*(client.submit(payment(str(n))) for n in range(25)))
+
+    results = asyncio.run(run_client(fake, submit, batch_size=10, batch_window=0.01))
+
+    assert [result["reference"] for result in results] == [str(n) for n in range(25)]
+    assert all(result["status"] == "approved" for result in results)
+    assert sorted(fake.batch_sizes) == [5, 10, 10]
+
+
+def test_failed_calls_are_retried():
+    fake = FakeProcessor()
+    fake.fail_next = 2
+
+    async def submit(client):
+        return await client.submit(payment("1", card="declined")), client.stats()
+
+    result, stats = asyncio.run(run_client(fake, submit, backoff=0.001))
+
+    assert result["status"] == "declined"
+    assert stats["retried"] == 2
+    assert fake.calls == 3
+
+
+def test_circuit_opens_after_repeated_failures():
+    fake = FakeProcessor()
+    fake.fail_next = 100
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+
+    async def submit(client):
+        for reference in ("1", "2"):
+            with pytest.raises(ProcessorUnavailable):
+                await client.submit(payment(reference))
+        calls = fake.calls
+        with pytest.raises(ProcessorUnavailable):
+            await client.submit(payment("3"))
+        assert fake.calls == calls
+        fake.fail_next = 0
+        await asyncio.sleep(0.05)
+        return await client.submit(payment("4"))
+
+    result = asyncio.run(run_client(fake, submit, retries=0, breaker=breaker))
+
+    assert result["status"] == "approved"
+    assert breaker.state == "closed"
+    assert breaker.opened == 1
+
+
+async def run_mock(handler, submit, **options):
+    client = ProcessorClient("http://processor", transport=httpx.MockTransport(handler), **options)
+    await client.start()
+    try:
+        return await submit(client)
+    finally:
+        await client.stop()
+
+
+def test_refused_trial_call_closes_the_circuit():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.01)
+    breaker.record_failure()
+
+    async def submit(client):
+        await asyncio.sleep(0.01)
+        with pytest.raises(ProcessorError) as refused:
+            await client.submit(payment("1"))
+        assert not isinstance(refused.value, ProcessorUnavailable)
+        with pytest.raises(ProcessorError) as again:
+            await client.submit(payment("2"))
+        return again.value
+
+    error = asyncio.run(run_mock(lambda request: httpx.Response(400), submit, retries=0, breaker=breaker))
+
+    assert breaker.state == "closed"
+    assert str(error) == "Payment processor refused the batch with 400."
+
+
+def test_malformed_answers_fail_the_payments():
+    bodies = iter([{"payments": []}, {"results": [{"reference": "1", "status": "approved"}]}, "not json"])
+
+    def handler(request):
+        body = next(bodies)
+        if isinstance(body, str):
+            return httpx.Response(200, content=body.encode())
+        return httpx.Response(200, json=body)
+
+    async def submit(client):
+        errors = []
+        for references in (["1"], ["2", "3"], ["4"]):
+            outcomes = await asyncio.gather(*(client.submit(payment(reference)) for reference in references),
+                                            return_exceptions=True)
+            errors.append([type(outcome).__name__ for outcome in outcomes])
+        return errors, client.breaker.state, client.stats()
+
+    errors, state, stats = asyncio.run(run_mock(handler, submit, retries=0, batch_window=0.01))
+
+    assert errors == [["ProcessorError"], ["dict", "ProcessorError"], ["ProcessorError"]]
+    assert state == "closed"
+    assert stats["failed"] == 3
+
+
+def test_payments_fail_at_their_deadline():
+    fake = FakeProcessor(latency=0.5)
+
+    async def submit(client):
+        with pytest.raises(ProcessorUnavailable):
+            await client.submit(payment("1"), timeout=0.05)
+        return client.stats()
+
+    assert asyncio.run(run_client(fake, submit))["timed_out"] == 1
+
+
+@pytest.fixture
+def processor(monkeypatch):
+    """Fake processor answering the application processor client."""
+    fake = FakeProcessor()
+    monkeypatch.setattr(processor_client, "base_url", "http://processor")
+    monkeypatch.setattr(processor_client, "transport", httpx.ASGITransport(app=fake.app))
+    return fake
+
+
+def create_transaction(client, auth_headers, merchant_id, customer_id, card):
+    return client.post("/api/v1/transaction/", headers=auth_headers,
+                       json={"merchant_id": merchant_id, "customer_id": customer_id, "amount": "10.00",
+                             "currency": "USD", "hash_credit_card": card}).json()["token"]
+
+
+def test_declined_capture_leaves_the_transaction_pending(processor, client, auth_headers, merchant_id):
+    customer_id = client.post("/api/v1/customer/", headers=auth_headers,
+                              json={"name": "Declined", "email": "declined@example.com",
+                                    "hash_credit_card": "declined-card"}).json()["id"]
+    token = create_transaction(client, auth_headers, merchant_id, customer_id, "declined-card")
+
+    response = client.post(f"/api/v1/transaction/process/{token}", headers=auth_headers)
+
+    assert response.status_code == 402
+    assert response.json()["detail"] == "Payment declined: Card declined by the issuer."
+    assert client.get(f"/api/v1/transaction/token/{token}", headers=auth_headers).json()["state"] == "pending"
+
+
+@pytest.fixture
+def statusless_processor(monkeypatch):
+    """Processor answering a result without status, then a null result."""
+    answers = iter([{"results": [{}]}, {"results": [None]}])
+    monkeypatch.setattr(processor_client, "base_url", "http://processor")
+    monkeypatch.setattr(processor_client, "transport",
+                        httpx.MockTransport(lambda request: httpx.Response(200, json=next(answers))))
+
+
+def test_payment_answers_without_status_release_the_transaction(statusless_processor, client, auth_headers,
+                                                                 customer_id, merchant_id):
+    token = create_transaction(client, auth_headers, merchant_id, customer_id, "card")
+
+    for _ in range(2):
+        response = client.post(f"/api/v1/transaction/process/{token}", headers=auth_headers)
+        assert response.status_code == 502
+        assert response.json()["detail"].startswith("Malformed answer of the payment processor")
+        assert client.get(f"/api/v1/transaction/token/{token}", headers=auth_headers).json()["state"] == "pending"
+
+
+def test_batch_capture_processes_approved_payments(processor, client, auth_headers, customer_id, merchant_id):
+    declined_customer_id = client.post("/api/v1/customer/", headers=auth_headers,
+                                       json={"name": "Declined", "email": "declined@example.com",
+                                             "hash_credit_card": "declined-card"}).json()["id"]
+    approved = [create_transaction(client, auth_headers, merchant_id, customer_id, "card") for _ in range(3)]
+    declined = create_transaction(client, auth_headers, merchant_id, declined_customer_id, "declined-card")
+
+    results = client.post("/api/v1/transaction/process/batch", headers=auth_headers,
+                          json={"tokens": approved + [declined]}).json()
+
+    assert [result["state"] for result in results] == ["success", "success", "success", None]
+    assert results[-1]["detail"] == "Payment declined: Card declined by the issuer."
+    assert processor.batch_sizes == [4]
+    assert client.get(f"/api/v1/transaction/token/{declined}", headers=auth_headers).json()["state"] == "pending"
+
+
+class InspectingProcessor(FakeProcessor):
+    """Fake processor that reads the transaction states while it answers."""
+
+    def __init__(self):
+        super().__init__()
+        self.states = []
+
+    async def batch(self, request: Request):
+        async with AsyncSessionLocal() as db:
+            states = await db.scalars(select(TransactionModel.state).order_by(TransactionModel.id))
+            self.states.append(states.all())
+        return await super().batch(request)
+
+
+def test_unexpected_payment_failure_only_releases_its_transaction(processor, client, auth_headers, customer_id,
+                                                                  merchant_id, monkeypatch):
+    approved = [create_transaction(client, auth_headers, merchant_id, customer_id, "card") for _ in range(2)]
+    failing = create_transaction(client, auth_headers, merchant_id, customer_id, "card")
+    process_payment = operations.BankUtils.process_payment
+
+    async def failing_process_payment(transaction, type, timeout=None):
+        result = await process_payment(transaction, type, timeout)
+        if transaction.token == failing:
+            raise RuntimeError("Connection reset.")
+        return result
+
+    monkeypatch.setattr(operations.BankUtils, "process_payment", failing_process_payment)
+    results = client.post("/api/v1/transaction/process/batch", headers=auth_headers,
+                          json={"tokens": approved + [failing]}).json()
+
+    assert [result["state"] for result in results] == ["success", "success", None]
+    assert results[-1]["detail"] == "Payment processor call failed: RuntimeError('Connection reset.')"
+    assert client.get(f"/api/v1/transaction/token/{failing}", headers=auth_headers).json()["state"] == "pending"
+    assert client.get(f"/api/v1/merchant/{merchant_id}", headers=auth_headers).json()["amount_account"] == 20
+
+
+@pytest.fixture
+def inspecting_processor(monkeypatch):
+    fake = InspectingProcessor()
+    monkeypatch.setattr(processor_client, "base_url", "http://processor")
+    monkeypatch.setattr(processor_client, "transport", httpx.ASGITransport(app=fake.app))
+    return fake
+
+
+def test_payments_are_reserved_and_committed_before_the_processor_call(inspecting_processor, client, auth_headers,
+                                                                       customer_id, merchant_id):
+    token = create_transaction(client, auth_headers, merchant_id, customer_id, "card")
+    refund = create_transaction(client, auth_headers, merchant_id, customer_id, "card")
+
+    assert client.post(f"/api/v1/transaction/process/{token}", headers=auth_headers).status_code == 200
+    client.post("/api/v1/transaction/refund/batch", headers=auth_headers, json={"tokens": [refund]})
+
+    # Another session sees the reservation while the processor answers: no lock nor connection is held.
+    assert inspecting_processor.states == [["capturing", "pending"], ["success", "refunding"]]
+
+
+def test_unsettled_reservation_is_claimed_again_after_its_timeout(processor, client, auth_headers, customer_id,
+                                                                  merchant_id, monkeypatch):
+    token = create_transaction(client, auth_headers, merchant_id, customer_id, "card")
+
+    async def failing_add_to_balance(*args):
+        raise RuntimeError("Connection lost.")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(operations, "add_to_balance", failing_add_to_balance)
+        assert client.post(f"/api/v1/transaction/process/{token}", headers=auth_headers).status_code == 400
+    assert client.get(f"/api/v1/transaction/token/{token}", headers=auth_headers).json()["state"] == "capturing"
+    retry = client.post(f"/api/v1/transaction/process/{token}", headers=auth_headers)
+    assert (retry.status_code, retry.json()["detail"]) == (409, "Transaction is being processed.")
+
+    monkeypatch.setattr(operations, "PAYMENT_RESERVATION_TIMEOUT", 0)
+    response = client.post(f"/api/v1/transaction/process/{token}", headers=auth_headers)
+
+    assert response.json()["state"] == "success"
+    assert client.get(f"/api/v1/merchant/{merchant_id}", headers=auth_headers).json()["amount_account"] == 10
+    # The processor was asked twice for the same payment and answered it once.
+    assert processor.calls == 2
+    assert len(processor.results) == 1
@@ -0,0 +1,71 @@
+import logging
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+
+from src.utils.query_stats import (N_PLUS_ONE_THRESHOLD, QueryStats, SlowestStatements, fingerprint,
+                                   query_stats_middleware, slowest_statements)
+
+
+def test_fingerprint_ignores_values():
+    first = fingerprint("SELECT * FROM merchants WHERE id IN ($1::INTEGER, $2::INTEGER) AND name = 'a''b'")
+    second = fingerprint("SELECT *  FROM merchants\nWHERE id IN ($1::INTEGER, $2::INTEGER, $3::INTEGER) AND name = 'c'")
+
+    assert first == second == "SELECT * FROM merchants WHERE id IN (...) AND name = ?"
+
+
+def test_repeated_statements_are_reported():
+    stats = QueryStats()
+    for _ in range(5):
+        stats.record("SELECT * FROM customers WHERE id = ?", 0.001)
+    stats.record("SELECT * FROM merchants WHERE id = ?", 0.001)
+
+    assert stats.count == 6
+    assert stats.repeated(threshold=5) == {"SELECT * FROM customers WHERE id = ?": 5}
+
+
+def test_slowest_statements_keep_the_most_expensive():
+    slowest = SlowestStatements(max_size=2)
+    slowest.record("a", 0.5)
+    slowest.record("b", 0.1)
+    slowest.record("b", 0.1)
+    slowest.record("c", 0.3)
+
+    top = slowest.top()
+
+    assert [entry["statement"] for entry in top] == ["a", "c"]
+    assert top[0] == {"statement": "a", "count": 1, "total_ms": 500.0, "mean_ms": 500.0, "max_ms": 500.0}
+
+
+def test_requests_report_database_time(client, auth_headers, merchant_id):
+    slowest_statements.clear()
+    response = client.get(f"/api/v1/merchant/{merchant_id}", headers=auth_headers)
+
+    assert response.headers["Server-Timing"].startswith("db;dur=")
+    assert 'queries"' in response.headers["Server-Timing"]
+    slowest = client.get("/debug/queries", headers=auth_headers).json()
+    assert any("FROM merchants" in entry["statement"] for entry in slowest)
+
+
+def test_debug_queries_requires_authentication(client):
+    assert client.get("/debug/queries").status_code == 401
+
+
+def test_n_plus_one_is_logged(engine, caplog):
+    app = FastAPI()
+    app.middleware("http")(query_stats_middleware)
+
+    @app.get("/customers")
+    async def read_customers():
+        async with engine.connect() as conn:
+            for customer_id in range(N_PLUS_ONE_THRESHOLD):
+                await conn.execute(text(f"SELECT * FROM customers WHERE id = {customer_id}"))
+        return {}
+
+    with caplog.at_level(logging.WARNING, logger="src.utils.query_stats"):
+        response = TestClient(app).get("/customers")
+
+    assert f'desc="{N_PLUS_ONE_THRESHOLD} queries"' in response.headers["Server-Timing"]
+    assert any(f"Possible N+1 on GET /customers: {N_PLUS_ONE_THRESHOLD}x SELECT * FROM customers WHERE id = ?"
+               in record.message for record in caplog.records)
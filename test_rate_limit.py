@@ -0,0 +1,71 @@
+import time
+
+import pytest
+
+from src.utils.rate_limit import (MemoryRateLimitStore, RateLimitRule, RateLimitStore, SharedMemoryRateLimitStore,
+                                  parse_rules, rate_limiter)
+
+
+def test_rules_are_parsed_in_order():
+    rules = parse_rules("POST /api/v1/transaction/=5:10, * /api/v1/=20.5:40")
+
+    assert rules == [RateLimitRule("POST", "/api/v1/transaction/", 5.0, 10),
+                     RateLimitRule("*", "/api/v1/", 20.5, 40)]
+    assert rules[1].matches("GET", "/api/v1/customer/")
+    assert not rules[0].matches("GET", "/api/v1/transaction/")
+    with pytest.raises(ValueError):
+        parse_rules("POST /api/v1/transaction/=fast")
+
+
+def test_bucket_empties_and_refills():
+    store = MemoryRateLimitStore()
+
+    results = [store.take("client", rate=20, burst=3) for _ in range(4)]
+
+    assert [result.allowed for result in results] == [True, True, True, False]
+    assert [result.remaining for result in results[:3]] == [2, 1, 0]
+    assert 0 < results[3].retry_after <= 0.05
+    time.sleep(0.06)
+    assert store.take("client", rate=20, burst=3).allowed
+    assert store.take("other", rate=20, burst=3).remaining == 2
+
+
+def test_shared_memory_buckets_are_seen_by_every_worker(tmp_path):
+    path = str(tmp_path / "buckets")
+    first, second = SharedMemoryRateLimitStore(path, slots=64), SharedMemoryRateLimitStore(path, slots=64)
+
+    assert first.take("client", rate=0.01, burst=2).allowed
+    assert second.take("client", rate=0.01, burst=2).allowed
+    assert not first.take("client", rate=0.01, burst=2).allowed
+    assert second.take("other", rate=0.01, burst=2).allowed
+    assert len(first) == 2
+    second.reset()
+    assert first.take("client", rate=0.01, burst=2).allowed
+    first.close()
+    second.close()
+
+
+def test_stores_must_implement_the_interface():
+    class Incomplete(RateLimitStore):
+        def take(self, key, rate, burst, cost=1.0):
+            return None
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_requests_over_the_limit_get_429(client, auth_headers, monkeypatch):
+    monkeypatch.setattr(rate_limiter, "rules", [RateLimitRule("GET", "/api/v1/customer/", 0.01, 2)])
+
+    responses = [client.get("/api/v1/customer/", headers=auth_headers) for _ in range(3)]
+
+    assert [response.status_code for response in responses] == [200, 200, 429]
+    assert responses[0].headers["RateLimit-Limit"] == "2"
+    assert responses[0].headers["RateLimit-Remaining"] == "1"
+    assert responses[2].headers["RateLimit-Remaining"] == "0"
+    assert int(responses[2].headers["Retry-After"]) >= 1
+    # Other routes and other clients have their own buckets; probes are never limited.
+    assert client.get("/api/v1/merchant/", headers=auth_headers).status_code == 200
+    assert client.get("/api/v1/customer/").status_code == 401
+    assert client.get("/health").status_code == 200
+    assert "RateLimit-Limit" not in client.get("/health").headers
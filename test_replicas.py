@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+from sqlalchemy import insert, lambda_stmt, select
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+from src.db.connection import Base, Replica, is_plain_select, replica_router
+from src.db.models.customer import Customer as CustomerModel
+from src.utils.cache import LRUCache
+
+
+@pytest.fixture
+def replica(tmp_path, monkeypatch):
+    """SQLite database standing in for a replica, holding a customer the primary does not have."""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'replica.db'}", poolclass=NullPool)
+
+    async def create_tables():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.execute(insert(CustomerModel).values(name="Replica", email="replica@example.com",
+                                                            hash_credit_card="card"))
+
+    asyncio.run(create_tables())
+    replica = Replica("replica", engine)
+    replica.healthy = True
+    monkeypatch.setattr(replica_router, "replicas", [replica])
+    monkeypatch.setattr(replica_router, "_writers", LRUCache(ttl=60))
+    return replica
+
+
+def customer_names(client, auth_headers):
+    return [item["name"] for item in client.get("/api/v1/customer/", headers=auth_headers).json()["items"]]
+
+
+def test_reads_go_to_a_healthy_replica(client, auth_headers, replica):
+    assert customer_names(client, auth_headers) == ["Replica"]
+
+
+def test_reads_fall_back_to_the_primary(client, auth_headers, replica):
+    replica.healthy = False
+
+    assert customer_names(client, auth_headers) == []
+
+
+def test_clients_read_their_own_writes(client, auth_headers, replica):
+    client.post("/api/v1/customer/", headers=auth_headers,
+                json={"name": "Primary", "email": "primary@example.com", "hash_credit_card": "card"})
+
+    assert customer_names(client, auth_headers) == ["Primary"]
+
+
+def test_failed_check_takes_the_replica_out_of_rotation(replica):
+    # SQLite has no replication functions, like a replica that cannot answer the lag query.
+    asyncio.run(replica_router.check())
+
+    assert replica_router.stats() == {"replica": {"healthy": False, "lag": None, "error": "OperationalError"}}
+    assert replica_router.choose() is None
+
+
+def test_lambda_lookups_are_routed_as_reads():
+    assert is_plain_select(lambda_stmt(lambda: select(CustomerModel).where(CustomerModel.id == 1)))
+    assert not is_plain_select(lambda_stmt(lambda: select(CustomerModel).with_for_update()))
@@ -0,0 +1,36 @@
+import json
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from src.db.models.merchant import Merchant as MerchantModel
+from src.db.models.transaction import Transaction as TransactionModel
+from src.db.operations import MERCHANT_ROWS, TRANSACTION_ROWS
+from src.db.schemas.merchant import Merchant
+from src.db.schemas.transaction import Transaction
+
+
+def rendered(serializer, row):
+    return json.loads(serializer.response(row).body)
+
+
+def test_rows_render_like_the_validated_schema():
+    transaction = TransactionModel(id=1, merchant_id=2, customer_id=3, amount=Decimal("10.50"), currency="USD",
+                                   state="pending", hash_credit_card="card", token="token",
+                                   created_at=datetime(2024, 5, 1, 12, 30, 15, 123456, tzinfo=timezone.utc))
+    merchant = MerchantModel(id=2, name="Merchant", email="merchant@example.com", is_active=True,
+                             amount_account=Decimal("12"), authentication_key="key", balance_shards=4,
+                             created_at=datetime(2024, 5, 1, 12, 30))
+
+    assert rendered(TRANSACTION_ROWS, transaction) == json.loads(Transaction.model_validate(transaction).model_dump_json())
+    assert rendered(MERCHANT_ROWS, merchant) == json.loads(Merchant.model_validate(merchant).model_dump_json())
+
+
+def test_listing_matches_the_lookup(client, auth_headers, customer_id, merchant_id):
+    token = client.post("/api/v1/transaction/", headers=auth_headers,
+                        json={"merchant_id": merchant_id, "customer_id": customer_id, "amount": "10.00",
+                              "currency": "USD", "hash_credit_card": "card"}).json()["token"]
+
+    page = client.get(f"/api/v1/customer/{customer_id}/transactions", headers=auth_headers).json()
+
+    assert page["items"] == [client.get(f"/api/v1/transaction/token/{token}", headers=auth_headers).json()]
+    assert page["items"][0]["amount"] == "10.00"
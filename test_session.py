@@ -0,0 +1,50 @@
+import pytest
+from sqlalchemy import event
+
+
+@pytest.fixture
+def checkouts(engine):
+    """Counts pool checkouts and the peak number of connections held at once."""
+    stats = {"total": 0, "open": 0, "peak": 0}
+
+    def on_checkout(*args):
+        stats["total"] += 1
+        stats["open"] += 1
+        stats["peak"] = max(stats["peak"], stats["open"])
+
+    def on_checkin(*args):
+        stats["open"] -= 1
+
+    event.listen(engine.sync_engine, "checkout", on_checkout)
+    event.listen(engine.sync_engine, "checkin", on_checkin)
+    yield stats
+    event.remove(engine.sync_engine, "checkout", on_checkout)
+    event.remove(engine.sync_engine, "checkin", on_checkin)
+
+
+def test_read_uses_a_single_connection(client, auth_headers, customer_id, checkouts):
+    response = client.get(f"/api/v1/customer/{customer_id}", headers=auth_headers)
+
+    assert response.status_code == 200
+    assert checkouts["total"] == 1
+    assert checkouts["open"] == 0
+
+
+def test_process_never_holds_more_than_one_connection(client, auth_headers, customer_id, merchant_id,
+                                                      checkouts):
+    transaction = client.post("/api/v1/transaction/", headers=auth_headers,
+                              json={"merchant_id": merchant_id, "customer_id": customer_id, "amount": "10.00",
+                                    "currency": "USD", "hash_credit_card": "card"}).json()
+    checkouts.update(total=0, peak=0)
+
+    client.post(f"/api/v1/transaction/process/{transaction['token']}", headers=auth_headers)
+
+    assert checkouts["peak"] == 1
+    assert checkouts["open"] == 0
+
+
+def test_requests_without_database_access_check_out_nothing(client, checkouts):
+    response = client.get("/health")
+
+    assert response.status_code == 200
+    assert checkouts["total"] == 0
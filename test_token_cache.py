@@ -0,0 +1,63 @@
+import time
+
+import pytest
+
+from src.utils.token_cache import TokenCache
+
+
+class CountingDecoder:
+    def __init__(self, lifetime=60):
+        self.calls = 0
+        self.lifetime = lifetime
+
+    def __call__(self, token):
+        self.calls += 1
+        if token == "invalid":
+            raise ValueError("invalid token")
+        return {"sub": token, "exp": time.time() + self.lifetime}
+
+
+def test_verified_tokens_are_decoded_once():
+    decoder = CountingDecoder()
+    cache = TokenCache(decoder)
+
+    assert cache.claims("a")["sub"] == "a"
+    assert cache.claims("a")["sub"] == "a"
+    assert decoder.calls == 1
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 1)
+
+
+def test_expired_entries_are_verified_again():
+    decoder = CountingDecoder(lifetime=-1)
+    cache = TokenCache(decoder)
+
+    cache.claims("a")
+    cache.claims("a")
+
+    assert decoder.calls == 2
+
+
+def test_invalid_tokens_are_not_cached():
+    decoder = CountingDecoder()
+    cache = TokenCache(decoder)
+
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            cache.claims("invalid")
+
+    assert decoder.calls == 2
+    assert cache.stats()["size"] == 0
+
+
+def test_least_recently_used_token_is_evicted():
+    decoder = CountingDecoder()
+    cache = TokenCache(decoder, max_size=2)
+
+    cache.claims("a")
+    cache.claims("b")
+    cache.claims("a")
+    cache.claims("c")
+
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+    assert cache.stats()["evictions"] == 1
@@ -0,0 +1,126 @@
+import asyncio
+import uuid
+from decimal import Decimal
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import select
+
+from src.db.connection import AsyncSessionLocal
+from src.db.models.customer import Customer as CustomerModel
+from src.db.models.merchant import Merchant as MerchantModel
+from src.db.models.transaction import Transaction as TransactionModel
+from src.db.operations import process_transaction
+
+
+async def seed(amounts, merchant_active=True):
+    async with AsyncSessionLocal() as db:
+        customer = CustomerModel(name="Customer", email="customer@example.com", hash_credit_card="card")
+        merchant = MerchantModel(name="Merchant", email="merchant@example.com", authentication_key="key",
+                                 amount_account=0, is_active=merchant_active)
+        db.add_all([customer, merchant])
+        await db.flush()
+        transactions = [
+            TransactionModel(merchant_id=merchant.id, customer_id=customer.id, amount=Decimal(amount),
+                             currency="USD", hash_credit_card="card", token=str(uuid.uuid4()), state="pending")
+            for amount in amounts
+        ]
+        db.add_all(transactions)
+        await db.commit()
+        return merchant.id, [transaction.token for transaction in transactions]
+
+
+async def process(token, type="capture"):
+    async with AsyncSessionLocal() as db:
+        try:
+            return (await process_transaction(db, token, type)).state
+        except HTTPException as e:
+            return e.detail
+
+
+async def balance(merchant_id):
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(select(MerchantModel.amount_account).where(MerchantModel.id == merchant_id))
+
+
+def test_parallel_captures_credit_each_transaction_once(engine):
+    async def scenario():
+        merchant_id, tokens = await seed([10, 20, 30, 40, 50, 60, 70, 80])
+        results = await asyncio.gather(*(process(token) for token in tokens * 4))
+        return merchant_id, tokens, results, await balance(merchant_id)
+
+    merchant_id, tokens, results, final_balance = asyncio.run(scenario())
+
+    assert results.count("success") == len(tokens)
+    assert results.count("Transaction already processed.") == len(tokens) * 3
+    assert final_balance == 360
+
+
+def test_refund_debits_the_merchant(engine):
+    async def scenario():
+        merchant_id, tokens = await seed([25])
+        return await process(tokens[0], "refund"), await balance(merchant_id)
+
+    assert asyncio.run(scenario()) == ("refunded", -25)
+
+
+@pytest.mark.parametrize("token, expected", [
+    ("missing", "Transaction not found."),
+    (None, "Merchant not found or not active."),
+])
+def test_failed_capture_leaves_state_untouched(engine, token, expected):
+    async def scenario():
+        merchant_id, tokens = await seed([10], merchant_active=False)
+        result = await process(token or tokens[0])
+        async with AsyncSessionLocal() as db:
+            state = await db.scalar(select(TransactionModel.state).where(TransactionModel.token == tokens[0]))
+        return result, state, await balance(merchant_id)
+
+    assert asyncio.run(scenario()) == (expected, "pending", 0)
+
+
+def test_batch_capture_reports_every_token(engine, client, auth_headers):
+    merchant_id, tokens = asyncio.run(seed([10, 20, 30]))
+    asyncio.run(process(tokens[0]))
+
+    response = client.post("/api/v1/transaction/process/batch", headers=auth_headers,
+                           json={"tokens": tokens + ["missing", tokens[1]]})
+
+    assert response.status_code == 200
+    assert [(result["state"], result["detail"]) for result in response.json()] == [
+        (None, "Transaction already processed."),
+        ("success", None),
+        ("success", None),
+        (None, "Transaction not found."),
+        (None, "Duplicate token in batch."),
+    ]
+    assert asyncio.run(balance(merchant_id)) == 60
+
+
+def test_batch_refund_applies_one_delta_per_merchant(engine, client, auth_headers):
+    merchant_id, tokens = asyncio.run(seed([5, 15]))
+
+    response = client.post("/api/v1/transaction/refund/batch", headers=auth_headers, json={"tokens": tokens})
+
+    assert [result["state"] for result in response.json()] == ["refunded", "refunded"]
+    assert asyncio.run(balance(merchant_id)) == -20
+
+
+def test_bulk_create_keeps_valid_items_when_others_fail(engine, client, auth_headers, customer_id, merchant_id):
+    item = {"merchant_id": merchant_id, "customer_id": customer_id, "amount": "12.50", "currency": "USD",
+            "hash_credit_card": "card"}
+
+    response = client.post("/api/v1/transaction/bulk", headers=auth_headers, json={"items": [
+        item,
+        {**item, "currency": "EURO"},
+        {**item, "merchant_id": merchant_id + 100},
+        {**item, "amount": "7.00"},
+    ]})
+
+    results = response.json()
+    assert response.status_code == 200
+    assert [result["index"] for result in results] == [0, 1, 2, 3]
+    assert [result["transaction"]["amount"] for result in (results[0], results[3])] == ["12.50", "7.00"]
+    assert {result["transaction"]["state"] for result in (results[0], results[3])} == {"pending"}
+    assert results[1]["detail"].startswith("currency:")
+    assert results[2]["detail"] == "Merchant not found"
@@ -0,0 +1,163 @@
+import asyncio
+import json
+import time
+import uuid
+from decimal import Decimal
+
+import httpx
+from fastapi import FastAPI, Request, Response
+from fastapi.testclient import TestClient
+from sqlalchemy import select
+
+from main import app
+from src.db.connection import AsyncSessionLocal
+from src.db.models.customer import Customer as CustomerModel
+from src.db.models.merchant import Merchant as MerchantModel
+from src.db.models.transaction import Transaction as TransactionModel
+from src.db.models.webhook_event import WebhookEvent as WebhookEventModel
+from src.db.operations import process_transactions_batch
+from src.utils.webhooks import WebhookDispatcher, verify_signature, webhook_dispatcher
+
+
+class Receiver:
+    """Stand-in for the webhook endpoints of the merchants."""
+
+    def __init__(self, status_code: int = 200, delay: float = 0.0):
+        self.status_code = status_code
+        self.delay = delay
+        self.received = []
+        self.active = 0
+        self.max_active = 0
+        self.app = FastAPI()
+        self.app.post("/hooks")(self.hook)
+
+    async def hook(self, request: Request):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        await asyncio.sleep(self.delay)
+        self.received.append((request.headers, await request.body()))
+        self.active -= 1
+        return Response(status_code=self.status_code)
+
+
+async def seed(count, webhook_url="http://merchant.test/hooks"):
+    async with AsyncSessionLocal() as db:
+        customer = CustomerModel(name="Customer", email="customer@example.com", hash_credit_card="card")
+        merchant = MerchantModel(name="Merchant", email="merchant@example.com", authentication_key="key",
+                                 amount_account=0, webhook_url=webhook_url)
+        db.add_all([customer, merchant])
+        await db.flush()
+        transactions = [
+            TransactionModel(merchant_id=merchant.id, customer_id=customer.id, amount=Decimal(10), currency="USD",
+                             hash_credit_card="card", token=str(uuid.uuid4()), state="pending")
+            for _ in range(count)
+        ]
+        db.add_all(transactions)
+        await db.commit()
+        return [transaction.token for transaction in transactions]
+
+
+async def events():
+    async with AsyncSessionLocal() as db:
+        return (await db.scalars(select(WebhookEventModel).order_by(WebhookEventModel.id))).all()
+
+
+async def dispatch(dispatcher):
+    await dispatcher.start()
+    try:
+        await dispatcher.dispatch()
+        await dispatcher.drain()
+    finally:
+        await dispatcher.stop()
+
+
+def test_capture_is_delivered_as_a_signed_webhook(engine, monkeypatch):
+    receiver = Receiver()
+    monkeypatch.setattr(webhook_dispatcher, "transport", httpx.ASGITransport(app=receiver.app))
+    token = asyncio.run(seed(1))[0]
+
+    with TestClient(app) as client:
+        client.post("/api/v1/auth", json={"username": "tester", "password": "secret"})
+        access_token = client.post("/api/v1/token", data={"username": "tester", "password": "secret"}).json()
+        response = client.post(f"/api/v1/transaction/process/{token}",
+                               headers={"Authorization": f"Bearer {access_token['access_token']}"})
+        assert response.status_code == 200
+        deadline = time.monotonic() + 5
+        while not receiver.received and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    headers, body = receiver.received[0]
+    assert verify_signature("key", headers["Webhook-Signature"], body)
+    assert not verify_signature("key", headers["Webhook-Signature"], body.replace(b"success", b"pending"))
+    assert not verify_signature("other-key", headers["Webhook-Signature"], body)
+    event = json.loads(body)
+    assert event["type"] == "transaction.captured"
+    assert event["data"]["token"] == token
+    assert event["data"]["state"] == "success"
+    assert headers["Webhook-Id"] == str(event["id"])
+    stored = asyncio.run(events())
+    assert [(row.status, row.attempts) for row in stored] == [("delivered", 0)]
+
+
+def test_batch_writes_one_event_per_processed_transaction(engine):
+    async def scenario():
+        tokens = await seed(3)
+        async with AsyncSessionLocal() as db:
+            await process_transactions_batch(db, tokens + ["missing"], "refund")
+        return tokens, await events()
+
+    tokens, stored = asyncio.run(scenario())
+
+    assert len(stored) == 3
+    assert {row.event_type for row in stored} == {"transaction.refunded"}
+    assert sorted(json.loads(row.payload)["token"] for row in stored) == sorted(tokens)
+
+
+def test_merchants_without_webhook_get_no_events(engine):
+    async def scenario():
+        tokens = await seed(2, webhook_url=None)
+        async with AsyncSessionLocal() as db:
+            await process_transactions_batch(db, tokens, "capture")
+        return await events()
+
+    assert asyncio.run(scenario()) == []
+
+
+def test_failed_deliveries_are_retried_then_dead_lettered(engine):
+    receiver = Receiver(status_code=500)
+    dispatcher = WebhookDispatcher(transport=httpx.ASGITransport(app=receiver.app), max_attempts=2, backoff=0.1)
+
+    async def scenario():
+        tokens = await seed(1)
+        async with AsyncSessionLocal() as db:
+            await process_transactions_batch(db, tokens, "capture")
+        await dispatch(dispatcher)
+        first = (await events())[0]
+        await asyncio.sleep(0.2)
+        await dispatch(dispatcher)
+        return first, (await events())[0]
+
+    first, second = asyncio.run(scenario())
+
+    assert (first.status, first.attempts, first.last_error) == ("pending", 1, "Endpoint answered 500.")
+    assert (second.status, second.attempts) == ("dead", 2)
+    assert len(receiver.received) == 2
+    assert dispatcher.stats()["dead"] == 1
+
+
+def test_deliveries_to_one_destination_are_limited(engine):
+    receiver = Receiver(delay=0.02)
+    dispatcher = WebhookDispatcher(transport=httpx.ASGITransport(app=receiver.app), per_destination=2)
+
+    async def scenario():
+        tokens = await seed(8)
+        async with AsyncSessionLocal() as db:
+            await process_transactions_batch(db, tokens, "capture")
+        await dispatch(dispatcher)
+        return await events()
+
+    stored = asyncio.run(scenario())
+
+    assert len(receiver.received) == 8
+    assert receiver.max_active == 2
+    assert {row.status for row in stored} == {"delivered"}